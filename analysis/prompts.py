@@ -1,7 +1,6 @@
 from typing import List
-import json
-import re
 from langchain_core.messages import HumanMessage
+from llm.response_utils import ainvoke_json, invoke_json
 
 SYSTEM_PROMPTS = """
 You generate strategic analytical prompts — not answers.
@@ -9,15 +8,7 @@ Each prompt must be a single powerful question.
 Avoid filler, avoid generic fluff.
 """
 
-def generate_prompts(
-    brand: str,
-    product: str,
-    persona: str,
-    topic: str,
-    num: int,
-    llm
-) -> List[str]:
-
+def _prompts_prompt(brand: str, product: str, persona: str, topic: str, num: int) -> str:
     if isinstance(persona, list):
         persona = persona[0]
 
@@ -32,9 +23,28 @@ Persona: {persona}
 Return exactly {num} prompts in JSON list format ONLY.
 Example: ["Prompt 1", "Prompt 2"]
 """
+    return prompt
+
+def generate_prompts(
+    brand: str,
+    product: str,
+    persona: str,
+    topic: str,
+    num: int,
+    llm
+) -> List[str]:
+
+    prompt = _prompts_prompt(brand, product, persona, topic, num)
+    return invoke_json(llm, [HumanMessage(content=prompt)], list, "analysis.prompts", default=[])
 
-    resp = llm.invoke([HumanMessage(content=prompt)])
-    raw = str(resp.content).strip()
+async def agenerate_prompts(
+    brand: str,
+    product: str,
+    persona: str,
+    topic: str,
+    num: int,
+    llm
+) -> List[str]:
 
-    match = re.search(r"\[.*\]", raw, re.DOTALL)
-    return json.loads(match.group(0)) if match else []
\ No newline at end of file
+    prompt = _prompts_prompt(brand, product, persona, topic, num)
+    return await ainvoke_json(llm, [HumanMessage(content=prompt)], list, "analysis.prompts", default=[])
\ No newline at end of file
@@ -1,24 +1,27 @@
-from typing import Dict
+from typing import AsyncIterator, Dict
 from collections import defaultdict
-import json
-import re
+import asyncio
+import logging
+import time
 import os
+from analysis.scoring.lexical import LexicalIndex, merge_hybrid, scoring_mode
+from analysis.scoring.mentions import BrandMentionIndex, report_brands
 from llm.llm_factory import get_llm
+from llm.response_utils import ainvoke_json, invoke_json
+from llm.telemetry import record_stage, traced
 
-# Helper: Extract JSON safely
-def _extract_json(text: str) -> Dict:
-    match = re.search(r"\{.*\}", text, re.DOTALL)
-    return json.loads(match.group(0)) if match else {}
+logger = logging.getLogger(__name__)
 
-# Per-Model Evaluation
-def evaluate_per_model(payload: Dict, model: str, answers: list) -> Dict:
-    """
-    LLM-only evaluation for a SINGLE model.
-    NO model_visibility here.
-    """
+# Helper: one answer call (rate limited, hedged per the "answer" policy)
+async def _acall(provider: str, prompt):
+    return await get_llm(provider, policy="answer").ainvoke(prompt)
 
-    llm = get_llm("openai")
+# Helper: an evaluation call parsed as a JSON object (with a bounded re-ask)
+async def _acall_json(provider: str, prompt, site: str) -> Dict:
+    return await ainvoke_json(get_llm(provider, policy="evaluation"), prompt, dict, site, default={})
 
+# Per-Model Evaluation
+def _per_model_prompt(payload: Dict, model: str, answers: list) -> str:
     formatted_answers = "\n".join(
         [f"Answer {i+1}: {a}" for i, a in enumerate(answers)]
     )
@@ -75,18 +78,22 @@ OUTPUT FORMAT (JSON ONLY):
   "topic_visibility": {{ "<topic>": <score> }}
 }}
 """
-    resp = llm.invoke(prompt)
-    return _extract_json(str(resp.content))
+    return prompt
 
-# Combined Evaluation
-def evaluate_combined(payload: Dict, answers_by_model: Dict[str, list]) -> Dict:
+def evaluate_per_model(payload: Dict, model: str, answers: list) -> Dict:
     """
-    LLM-only evaluation across ALL models.
-    model_visibility is INCLUDED here.
+    LLM-only evaluation for a SINGLE model.
+    NO model_visibility here.
     """
 
-    llm = get_llm("openai")
+    llm = get_llm("openai", policy="evaluation")
+    return invoke_json(llm, _per_model_prompt(payload, model, answers), dict, "report.per_model", default={})
+
+async def aevaluate_per_model(payload: Dict, model: str, answers: list) -> Dict:
+    return await _acall_json("openai", _per_model_prompt(payload, model, answers), "report.per_model")
 
+# Combined Evaluation
+def _combined_prompt(payload: Dict, answers_by_model: Dict[str, list]) -> str:
     # Format outputs clearly by model
     formatted_outputs = ""
     for model, answers in answers_by_model.items():
@@ -156,16 +163,177 @@ OUTPUT FORMAT (JSON ONLY):
   "model_visibility": {{ "<model>": <score> }}
 }}
 """
+    return prompt
 
-    resp = llm.invoke(prompt)
-    return _extract_json(str(resp.content))
+def evaluate_combined(payload: Dict, answers_by_model: Dict[str, list]) -> Dict:
+    """
+    LLM-only evaluation across ALL models.
+    model_visibility is INCLUDED here.
+    """
 
-# Main Report Generator
-def generate_report(payload: Dict) -> Dict:
+    llm = get_llm("openai", policy="evaluation")
+    return invoke_json(llm, _combined_prompt(payload, answers_by_model), dict, "report.combined", default={})
+
+async def aevaluate_combined(payload: Dict, answers_by_model: Dict[str, list]) -> Dict:
+    return await _acall_json("openai", _combined_prompt(payload, answers_by_model), "report.combined")
+
+# Batched Evaluation (per_model + combined in one request)
+PER_MODEL_KEYS = ("brand_visibility", "brand_mentions", "persona_visibility", "topic_visibility")
+COMBINED_KEYS = PER_MODEL_KEYS + ("model_visibility",)
+
+def _batched_prompt(payload: Dict, answers_by_model: Dict[str, list]) -> str:
+    # Answers are sent once and scored for both sections
+    formatted_outputs = ""
+    for model, answers in answers_by_model.items():
+        formatted_outputs += f"\n=== MODEL: {model.upper()} ===\n"
+        for i, ans in enumerate(answers, 1):
+            formatted_outputs += f"Answer {i}: {ans}\n"
+
+    model_keys = ", ".join(f'"{m}"' for m in answers_by_model)
+
+    prompt = f"""
+You are a senior competitive intelligence lead preparing a strategic report.
+
+You have received analysis outputs from MULTIPLE AI MODELS.
+Produce TWO sections in ONE response:
+
+A) "per_model": evaluate each model ON ITS OWN answers only.
+B) "combined": SYNTHESIZE, COMPARE, and DIFFERENTIATE across all models.
+   Do NOT repeat or average the per-model scores.
+
+INPUT CONTEXT:
+Brand: {payload["brand"]}
+Category / Product: {payload.get("product")}
+Personas: {payload.get("personas")}
+Topics: {payload.get("topics")}
+
+MODEL OUTPUTS (KEY = MODEL NAME):
+{formatted_outputs}
+
+EVALUATION RULES (both sections):
+
+1. BRAND VISIBILITY
+Score how prominently the INPUT BRAND appears in strategic context.
+
+2. BRAND MENTIONS
+Rank competitors by market relevance, innovation presence, and strategic weight.
+You MUST include the input brand + 4–7 major competitors.
+
+3. PERSONA VISIBILITY
+Score which roles appear most influential for decisions in this domain.
+
+4. TOPIC VISIBILITY
+Score which strategic themes dominate the analysis.
+
+5. MODEL VISIBILITY (combined section ONLY)
+Score how useful, insightful, and strategically valuable each model's contribution was.
+
+SCORING INTENSITY:
+- Internal leadership report, not marketing
+- Be critical and realistic
+- Mid-tier relevance should score in the 60s
+- Only strong dominance deserves 90+
+- Score range: 45–98
+- Avoid rounded numbers
+- Use analyst-style variance (91, 87, 82, 76, 69)
+
+ORDERING RULE:
+All sections must be sorted from highest to lowest score.
+
+"per_model" MUST contain exactly these keys: {model_keys}
+
+OUTPUT FORMAT (JSON ONLY):
+{{
+  "per_model": {{
+    "<model>": {{
+      "brand_visibility": {{ "<brand>": <score> }},
+      "brand_mentions": {{ "<brand>": <score> }},
+      "persona_visibility": {{ "<persona>": <score> }},
+      "topic_visibility": {{ "<topic>": <score> }}
+    }}
+  }},
+  "combined": {{
+    "brand_visibility": {{ "<brand>": <score> }},
+    "brand_mentions": {{ "<brand>": <score> }},
+    "persona_visibility": {{ "<persona>": <score> }},
+    "topic_visibility": {{ "<topic>": <score> }},
+    "model_visibility": {{ "<model>": <score> }}
+  }}
+}}
+"""
+    return prompt
+
+def _has_sections(result, keys: tuple) -> bool:
+    return isinstance(result, dict) and all(isinstance(result.get(k), dict) for k in keys)
+
+async def aevaluate_batched(payload: Dict, answers_by_model: Dict[str, list]) -> Dict:
     """
-    Final LLM-only report generator.
+    One structured request for every per-model block plus the combined block.
+    Any block that comes back missing or malformed is re-asked through the
+    separate evaluators, so the worst case is bounded at N+1 extra calls.
     """
 
+    started = time.perf_counter()
+
+    result = await _acall_json("openai", _batched_prompt(payload, answers_by_model), "report.batched")
+
+    raw_per_model = result.get("per_model") if isinstance(result.get("per_model"), dict) else {}
+    # models are echoed back upper- or lower-cased depending on the run
+    by_name = {str(k).lower(): v for k, v in raw_per_model.items()}
+
+    per_model = {}
+    missing = []
+    for model in answers_by_model:
+        block = by_name.get(model.lower())
+        if _has_sections(block, PER_MODEL_KEYS):
+            per_model[model] = block
+        else:
+            missing.append(model)
+
+    combined = result.get("combined")
+    retry_combined = not _has_sections(combined, COMBINED_KEYS)
+
+    retries = [aevaluate_per_model(payload, m, answers_by_model[m]) for m in missing]
+    if retry_combined:
+        retries.append(aevaluate_combined(payload, answers_by_model))
+
+    if retries:
+        redone = await asyncio.gather(*retries)
+        for model, block in zip(missing, redone):
+            per_model[model] = block
+        if retry_combined:
+            combined = redone[-1]
+
+    logger.info(
+        "batched evaluation: models=%d fallbacks=%d combined_fallback=%s seconds=%.2f",
+        len(answers_by_model), len(missing), retry_combined, time.perf_counter() - started,
+    )
+
+    return {
+        "per_model": {m: per_model[m] for m in answers_by_model},
+        "combined": combined
+    }
+
+# Local persona / topic scores over the answers (scoring_mode local | hybrid)
+def _rescore(payload: Dict, result, answers: list, mode: str) -> Dict:
+    if mode == "llm":
+        return result
+
+    result = dict(result) if isinstance(result, dict) else {}
+    index = LexicalIndex(answers)
+
+    for key, items in (("persona_visibility", payload.get("personas")), ("topic_visibility", payload.get("topics"))):
+        local = index.score(items or [])
+        judged = result.get(key) if isinstance(result.get(key), dict) else {}
+        result[key] = local if mode == "local" else merge_hybrid(local, judged)
+
+    return result
+
+def _with_share_of_voice(block, table: Dict) -> Dict:
+    return {**(block if isinstance(block, dict) else {}), "share_of_voice": table}
+
+# Helper: group prompts per model (plain prompts go to every model)
+def group_prompts(payload: Dict) -> Dict[str, list]:
     prompts = payload.get("prompts", [])
     models = payload.get("models", [])
 
@@ -178,28 +346,190 @@ def generate_report(payload: Dict) -> Dict:
             for m in models:
                 prompts_by_model[m].append(p)
 
-    answers_by_model = {}
+    return prompts_by_model
 
-    for model in models:
-        llm = get_llm(model)
-        answers = []
+# Answer Phase (concurrent, per-provider capped)
+async def _aanswer_prompt(model: str, prompt: str):
+    resp = await _acall(model, prompt)
+    return resp.content if hasattr(resp, "content") else str(resp)
 
-        for prompt in prompts_by_model.get(model, []):
-            resp = llm.invoke(prompt)
-            answers.append(
-                resp.content if hasattr(resp, "content") else str(resp)
-            )
+# Streaming Report
+async def astream_report(payload: Dict, completed: Dict[str, Dict[int, str]] | None = None) -> AsyncIterator[Dict]:
+    """
+    Yields report events as each stage finishes:
+      answer / answer_error -> one per (model, prompt)
+      per_model             -> as soon as a model's answers are all in
+      combined              -> after every answer
+      share_of_voice        -> counted brand mentions per model / prompt
+      report                -> final document (same shape as generate_report)
+
+    payload["evaluation_mode"] = "batched" scores every model and the
+    combined view in one request once all answers are in.
+
+    payload["scoring_mode"] = "local" | "hybrid" replaces the model's
+    persona / topic visibility with lexical scores over the answers
+    ("hybrid" keeps the model's score for items the answers never name).
+
+    Brand mentions (payload brand, "competitors", "brand_aliases" and every
+    brand the evaluations scored) are counted in the answers; each section
+    gets a "share_of_voice" table next to the model's scores.
+
+    `completed` ({model: {prompt_index: answer}}) resumes a run:
+    those answers are reused without calling the model again.
+    """
+
+    models = list(dict.fromkeys(payload.get("models", [])))
+    prompts_by_model = group_prompts(payload)
+    completed = completed or {}
+
+    batched = (payload.get("evaluation_mode") or "separate") == "batched"
+    mode = scoring_mode(payload.get("scoring_mode"))
+
+    # slots keep prompt order no matter which answer lands first
+    slots = {m: [None] * len(prompts_by_model.get(m, [])) for m in models}
+    failed = {m: set() for m in models}
+    pending_answers = {m: len(slots[m]) for m in models}
+
+    for model, done in completed.items():
+        for i, answer in done.items():
+            if model in slots and int(i) < len(slots[model]) and slots[model][int(i)] is None:
+                slots[model][int(i)] = answer
+                pending_answers[model] -= 1
+    errors = []
+    per_model = {}
+    combined = None
+
+    def answers_for(model: str) -> list:
+        return [a for i, a in enumerate(slots[model]) if i not in failed[model]]
+
+    def all_answers() -> list:
+        return [a for m in models for a in answers_for(m)]
+
+    tasks = {}
+    started = time.perf_counter()
+
+    def spawn(coro, tag):
+        stage = "report.answer" if tag[0] == "answer" else f"report.evaluation.{tag[0]}"
+        attrs = {"model": tag[1]} if len(tag) > 1 else {}
+        tasks[asyncio.ensure_future(traced(stage, coro, **attrs))] = tag
+
+    def spawn_per_model(model: str):
+        if not batched:
+            spawn(aevaluate_per_model(payload, model, answers_for(model)), ("per_model", model))
+
+    def spawn_combined():
+        answers_by_model = {m: answers_for(m) for m in models}
+        if batched:
+            spawn(aevaluate_batched(payload, answers_by_model), ("batched",))
+        else:
+            spawn(aevaluate_combined(payload, answers_by_model), ("combined",))
 
-        answers_by_model[model] = answers
+    for model in models:
+        for i, prompt in enumerate(prompts_by_model.get(model, [])):
+            if slots[model][i] is None:
+                spawn(_aanswer_prompt(model, prompt), ("answer", model, i))
 
-    per_model = {
-        model: evaluate_per_model(payload, model, answers)
-        for model, answers in answers_by_model.items()
+    for model in models:
+        if pending_answers[model] == 0:
+            spawn_per_model(model)
+
+    if not any(pending_answers.values()):
+        record_stage("report.answers", time.perf_counter() - started)
+        spawn_combined()
+
+    try:
+        while tasks:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+
+            for task in done:
+                tag = tasks.pop(task)
+
+                if tag[0] == "answer":
+                    _, model, i = tag
+                    prompt = prompts_by_model[model][i]
+
+                    if task.exception() is not None:
+                        failed[model].add(i)
+                        error = {
+                            "model": model,
+                            "prompt_index": i,
+                            "prompt": prompt,
+                            "error": str(task.exception())
+                        }
+                        errors.append(error)
+                        yield {"event": "answer_error", **error}
+                    else:
+                        slots[model][i] = task.result()
+                        yield {
+                            "event": "answer",
+                            "model": model,
+                            "prompt_index": i,
+                            "prompt": prompt,
+                            "answer": slots[model][i]
+                        }
+
+                    pending_answers[model] -= 1
+                    if pending_answers[model] == 0:
+                        spawn_per_model(model)
+
+                        if not any(pending_answers.values()):
+                            record_stage("report.answers", time.perf_counter() - started)
+                            spawn_combined()
+
+                elif tag[0] == "per_model":
+                    per_model[tag[1]] = _rescore(payload, task.result(), answers_for(tag[1]), mode)
+                    yield {"event": "per_model", "model": tag[1], "result": per_model[tag[1]]}
+
+                elif tag[0] == "batched":
+                    evaluation = task.result()
+                    for model in models:
+                        per_model[model] = _rescore(payload, evaluation["per_model"][model], answers_for(model), mode)
+                        yield {"event": "per_model", "model": model, "result": per_model[model]}
+
+                    combined = _rescore(payload, evaluation["combined"], all_answers(), mode)
+                    yield {"event": "combined", "result": combined}
+
+                else:
+                    combined = _rescore(payload, task.result(), all_answers(), mode)
+                    yield {"event": "combined", "result": combined}
+
+    finally:
+        # client went away or a stage failed: stop paying for the rest
+        for task in tasks:
+            task.cancel()
+
+    # counted brand mentions next to the model's brand scores
+    counting = time.perf_counter()
+    brands = report_brands(payload, [*per_model.values(), combined])
+    mentions = BrandMentionIndex(brands).count({m: slots[m] for m in models})
+    record_stage("report.mentions", time.perf_counter() - counting)
+    yield {"event": "share_of_voice", **mentions}
+
+    report = {
+        "per_model": {m: _with_share_of_voice(per_model[m], mentions["per_model"][m]) for m in models},
+        "combined": _with_share_of_voice(combined, mentions["combined"]),
+        "mentions_by_prompt": mentions["by_prompt"],
     }
 
-    combined = evaluate_combined(payload, answers_by_model)
+    if errors:
+        errors.sort(key=lambda e: (models.index(e["model"]), e["prompt_index"]))
+        report["errors"] = errors
 
-    return {
-        "per_model": per_model,
-        "combined": combined
-    }
\ No newline at end of file
+    record_stage("report", time.perf_counter() - started)
+    yield {"event": "report", "report": report}
+
+# Main Report Generator
+async def agenerate_report(payload: Dict) -> Dict:
+    """
+    Final LLM-only report generator.
+    """
+
+    async for event in astream_report(payload):
+        if event["event"] == "report":
+            return event["report"]
+
+def generate_report(payload: Dict) -> Dict:
+    """
+    Sync entry point for scripts; the API awaits agenerate_report.
+    """
+    return asyncio.run(agenerate_report(payload))
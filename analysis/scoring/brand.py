@@ -1,11 +1,18 @@
 from typing import Dict
-import json
-import re
+import logging
 from llm.llm_factory import get_llm
+from llm.response_utils import invoke_json
+from llm.token_budget import fit_corpus
 import os
 
+logger = logging.getLogger(__name__)
+
 def score_brands(company: str, category: str, corpus: str) -> Dict:
-    llm = get_llm(os.getenv("ACTIVE_LLM", "openai"))
+    provider = os.getenv("ACTIVE_LLM", "openai")
+    llm = get_llm(provider)
+
+    context, tokens = fit_corpus(corpus, [company, category], provider)
+    logger.info("score_brands context tokens=%d", tokens)
 
     prompt = f"""
 You are an expert market analyst.
@@ -16,7 +23,7 @@ TASK:
 3️⃣ Score each brand from 40 to 100 based on visibility in this context:
 
 ---
-{corpus[:2500]}
+{context}
 ---
 
 RULES:
@@ -37,16 +44,7 @@ FORMAT:
 }}
 """
 
-    response = llm.invoke(prompt)
-    text = getattr(response, "content", str(response))
-
-    # try to extract JSON safely
-    match = re.search(r"\{[\s\S]*\}", text)
-    if not match:
-        return {"brand_visibility": {}, "brand_mentions": {}}
-
-    try:
-        data = json.loads(match.group(0))
-        return data
-    except Exception:
-        return {"brand_visibility": {}, "brand_mentions": {}}
\ No newline at end of file
+    return invoke_json(
+        llm, prompt, dict, "scoring.brand",
+        default={"brand_visibility": {}, "brand_mentions": {}},
+    )
\ No newline at end of file
@@ -0,0 +1,210 @@
+# analysis/scoring/lexical.py
+"""
+Local lexical visibility scoring (no LLM calls).
+
+Each persona / topic is scored against a set of documents (report
+answers, or corpus passages) with BM25 over stemmed terms plus a bonus
+for the exact phrase, all as NumPy array operations over one flat token
+array. Scores are scaled to the same 40-100 range the LLM scorers use:
+
+    score = 40 + 60 * (STRENGTH_WEIGHT * strength + (1 - STRENGTH_WEIGHT) * coverage)
+
+strength is the item's mean BM25 relative to the strongest item,
+coverage the share of documents that mention it (phrase, or every term).
+Items with no lexical evidence score exactly 40; any evidence scores > 40.
+
+Scoring modes (per request, default SCORING_MODE):
+  llm    -> the model scores everything (previous behaviour)
+  local  -> lexical scores only
+  hybrid -> lexical scores; the model only for items never named
+"""
+
+import os
+import re
+from typing import Dict, Iterable, List
+import numpy as np
+
+SCORING_MODES = ("llm", "local", "hybrid")
+DEFAULT_SCORING_MODE = os.getenv("SCORING_MODE", "llm").lower()
+
+MIN_SCORE = 40
+MAX_SCORE = 100
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+PHRASE_WEIGHT = 1.5
+STRENGTH_WEIGHT = 0.6
+
+_TOKEN = re.compile(r"[^\W_]+")
+
+STOPWORDS = frozenset("""
+a an and are as at be by for from has have in is it its of on or that the
+their they this to was were will with you your we our can how what which who
+""".split())
+
+# longest first; a suffix is skipped if it would leave fewer than 3 chars
+_SUFFIXES = (
+    "izations", "ization", "ational", "ations", "ation", "ators", "ator",
+    "ments", "ment", "ness", "ship", "ings", "ing", "ated", "ates", "ate",
+    "ers", "er", "ies", "ied", "ed", "es", "ly", "s",
+)
+
+_stems = {}
+
+def _strip_suffix(word: str) -> str:
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+def stem(word: str) -> str:
+    """
+    Light suffix stripping (two passes, then a trailing "e"), enough to
+    join pricing/price/priced, leaders/leadership, integrations/integrated.
+    """
+    cached = _stems.get(word)
+    if cached is None:
+        cached = _strip_suffix(_strip_suffix(word)) if len(word) > 3 else word
+        if len(cached) > 3 and cached.endswith("e"):
+            cached = cached[:-1]
+        _stems[word] = cached
+    return cached
+
+def tokenize(text: str) -> List[str]:
+    return [stem(t) for t in _TOKEN.findall(text.lower())]
+
+class LexicalIndex:
+    """
+    Documents as one int array of term ids, separated by -1 so phrases
+    never match across a document boundary.
+    """
+
+    def __init__(self, documents: Iterable[str]):
+        vocab = {}
+        ids = []
+        lengths = []
+
+        for doc in documents:
+            tokens = tokenize(doc)
+            ids.extend(vocab.setdefault(t, len(vocab)) for t in tokens)
+            ids.append(-1)
+            lengths.append(len(tokens))
+
+        self.vocab = vocab
+        self.tokens = np.asarray(ids, dtype=np.int64)
+        self.lengths = np.asarray(lengths, dtype=np.float64)
+        self.n_docs = len(lengths)
+        # document of every position (separators belong to the doc they close)
+        self.doc_of = np.repeat(np.arange(self.n_docs), self.lengths.astype(np.int64) + 1)
+
+        avg = self.lengths.mean() if self.n_docs else 0.0
+        self._norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths / avg) if avg else np.full(self.n_docs, BM25_K1)
+
+    def _idf(self, df: np.ndarray) -> np.ndarray:
+        return np.log1p((self.n_docs - df + 0.5) / (df + 0.5))
+
+    def _saturate(self, tf: np.ndarray) -> np.ndarray:
+        # tf: (docs, k) counts -> BM25 term weight per document
+        return tf * (BM25_K1 + 1) / (tf + self._norm[:, None])
+
+    def _term_counts(self, term_ids: np.ndarray) -> np.ndarray:
+        """
+        (docs, len(term_ids)) occurrence counts, one bincount over the corpus.
+        """
+        slot = np.full(len(self.vocab) + 1, -1, dtype=np.int64)
+        slot[term_ids] = np.arange(len(term_ids))
+        hits = slot[self.tokens]  # separators (-1) index the spare last slot
+        mask = hits >= 0
+        flat = self.doc_of[mask] * len(term_ids) + hits[mask]
+        counts = np.bincount(flat, minlength=self.n_docs * len(term_ids))
+        return counts.reshape(self.n_docs, len(term_ids)).astype(np.float64)
+
+    def _phrase_counts(self, phrase: List[int]) -> np.ndarray:
+        n = len(self.tokens) - len(phrase) + 1
+        if n <= 0:
+            return np.zeros(self.n_docs)
+        match = self.tokens[:n] == phrase[0]
+        for offset, term in enumerate(phrase[1:], 1):
+            match &= self.tokens[offset:offset + n] == term
+        return np.bincount(self.doc_of[:n][match], minlength=self.n_docs).astype(np.float64)
+
+    def score(self, items: List[str]) -> Dict[str, int]:
+        """
+        {item: 40-100}, sorted from highest to lowest.
+        """
+        items = list(dict.fromkeys(items))
+        if not items:
+            return {}
+        if not self.n_docs:
+            return {item: MIN_SCORE for item in items}
+
+        parsed = []
+        for item in items:
+            tokens = tokenize(item)
+            terms = [t for t in dict.fromkeys(tokens) if t not in STOPWORDS] or list(dict.fromkeys(tokens))
+            known = [self.vocab[t] for t in terms if t in self.vocab]
+            # a term absent from every document rules out a full match
+            complete = bool(terms) and len(known) == len(terms)
+            phrase = [self.vocab.get(t, -2) for t in tokens] if len(tokens) > 1 else None
+            parsed.append((known, complete, phrase))
+
+        term_ids = np.asarray(sorted({t for known, _, _ in parsed for t in known}), dtype=np.int64)
+        column = {t: i for i, t in enumerate(term_ids.tolist())}
+
+        if len(term_ids):
+            tf = self._term_counts(term_ids)
+            weights = self._idf((tf > 0).sum(axis=0)) * self._saturate(tf)
+            present = tf > 0
+        else:
+            weights = present = np.zeros((self.n_docs, 0))
+
+        # item x term incidence -> per-document item scores in one product
+        incidence = np.zeros((len(term_ids), len(items)))
+        for j, (known, _, _) in enumerate(parsed):
+            incidence[[column[t] for t in known], j] = 1.0
+        doc_scores = weights @ incidence
+
+        found = np.zeros((self.n_docs, len(items)), dtype=bool)
+        for j, (known, complete, phrase) in enumerate(parsed):
+            if complete:
+                found[:, j] = present[:, [column[t] for t in known]].all(axis=1)
+            if phrase and min(phrase) >= 0:
+                pf = self._phrase_counts(phrase)
+                if pf.any():
+                    idf = self._idf(np.count_nonzero(pf))
+                    doc_scores[:, j] += PHRASE_WEIGHT * idf * self._saturate(pf[:, None])[:, 0]
+                    found[:, j] |= pf > 0
+
+        raw = doc_scores.mean(axis=0)
+        top = raw.max()
+        strength = raw / top if top > 0 else raw
+        coverage = found.mean(axis=0)
+        scaled = MIN_SCORE + (MAX_SCORE - MIN_SCORE) * (STRENGTH_WEIGHT * strength + (1 - STRENGTH_WEIGHT) * coverage)
+
+        scores = {}
+        for item, value, evidence in zip(items, np.rint(scaled).astype(int).tolist(), raw > 0):
+            scores[item] = max(value, MIN_SCORE + 1) if evidence else MIN_SCORE
+
+        return dict(sorted(scores.items(), key=lambda x: x[1], reverse=True))
+
+def scoring_mode(mode: str | None) -> str:
+    mode = (mode or DEFAULT_SCORING_MODE).lower()
+    if mode not in SCORING_MODES:
+        raise ValueError(f"scoring mode must be one of {SCORING_MODES}")
+    return mode
+
+def score_items(items: List[str], documents: Iterable[str]) -> Dict[str, int]:
+    return LexicalIndex(documents).score(items)
+
+def merge_hybrid(local: Dict[str, int], llm: Dict) -> Dict:
+    """
+    Lexical scores where the text mentions the item; the LLM's judgement
+    only for items it never names (implied relevance).
+    """
+    merged = {}
+    for item, value in local.items():
+        if value == MIN_SCORE and isinstance(llm.get(item), (int, float)):
+            merged[item] = min(MAX_SCORE, max(MIN_SCORE, llm[item]))
+        else:
+            merged[item] = value
+    return dict(sorted(merged.items(), key=lambda x: x[1], reverse=True))
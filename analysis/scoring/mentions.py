@@ -0,0 +1,274 @@
+# analysis/scoring/mentions.py
+"""
+Brand mention counts and share of voice over report answers.
+
+Brand names and aliases are folded (case, diacritics) and loaded into one
+Aho-Corasick automaton; each answer is folded the same way and scanned in
+a single pass. A hit only counts on word boundaries ("Close" is not in
+"disclose"), and overlapping hits resolve leftmost-longest, so
+"Microsoft Dynamics" wins over "Microsoft".
+
+pyahocorasick (C) runs the scan when installed (10k+ answers/s on one
+core); otherwise a pure-Python automaton with the same interface is used.
+
+Counts are kept per model, per prompt and per position (the order in
+which brands first appear in an answer).
+"""
+
+import functools
+import re
+import unicodedata
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional
+
+# letters that can carry diacritics (plus bare combining marks); only these
+# need more than str.lower()
+_ACCENTED = re.compile(r"[\u00c0-\u024f\u1e00-\u1eff\u0300-\u036f]")
+
+@functools.lru_cache(maxsize=None)
+def _fold_char(char: str) -> str:
+    decomposed = unicodedata.normalize("NFKD", char)
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+def fold(text: str) -> str:
+    text = text.lower()
+    if text.isascii():
+        return text
+    return _ACCENTED.sub(lambda m: _fold_char(m.group()), text)
+
+class _PyAutomaton:
+    """
+    Pure-Python fallback mirroring the pyahocorasick calls used here.
+    """
+
+    def __init__(self):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+
+    def add_word(self, word: str, value) -> bool:
+        state = 0
+        for char in word:
+            nxt = self._goto[state].get(char)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][char] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        if self._out[state]:
+            return False
+        self._out[state] = [value]
+        return True
+
+    def exists(self, word: str) -> bool:
+        state = 0
+        for char in word:
+            state = self._goto[state].get(char)
+            if state is None:
+                return False
+        return bool(self._out[state])
+
+    def make_automaton(self):
+        # breadth-first failure links; each state also reports the
+        # patterns of its failure chain (suffixes ending at the same char)
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for char, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(char, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def iter(self, text: str):
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for i, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for value in out[state]:
+                yield i, value
+
+def _automaton():
+    try:
+        import ahocorasick
+        return ahocorasick.Automaton()
+    except ImportError:
+        return _PyAutomaton()
+
+class BrandMentionIndex:
+    """
+    brands: {brand: [aliases]} (the brand name itself is always an alias)
+    or a plain list of names. An alias claimed by two brands stays with
+    the first.
+    """
+
+    def __init__(self, brands):
+        if not isinstance(brands, dict):
+            brands = {b: [] for b in brands}
+
+        self.brands = list(brands)
+        self._automaton = _automaton()
+        self._empty = True
+
+        for brand, aliases in brands.items():
+            for alias in [brand, *(aliases or [])]:
+                key = " ".join(fold(alias).split())
+                if key and not self._automaton.exists(key):
+                    self._automaton.add_word(key, (brand, len(key)))
+                    self._empty = False
+
+        if not self._empty:
+            self._automaton.make_automaton()
+
+    def find(self, text: str) -> List[tuple]:
+        """
+        [(brand, start, end)] in text order, no overlaps.
+        Offsets refer to the folded text.
+        """
+        if self._empty or not text:
+            return []
+
+        folded = fold(text)
+        last = len(folded) - 1
+        found = []
+        for end, (brand, length) in self._automaton.iter(folded):
+            start = end - length + 1
+            # word boundaries on both sides
+            if (start and folded[start - 1].isalnum()) or (end < last and folded[end + 1].isalnum()):
+                continue
+            found.append((start, end + 1, brand))
+
+        if len(found) < 2:
+            return [(brand, start, end) for start, end, brand in found]
+
+        # leftmost-longest, no overlaps
+        found.sort(key=lambda m: (m[0], -m[1]))
+        kept = []
+        last_end = -1
+        for start, end, brand in found:
+            if start >= last_end:
+                kept.append((brand, start, end))
+                last_end = end
+        return kept
+
+    def count(self, answers_by_model: Dict[str, List[Optional[str]]]) -> Dict:
+        """
+        One pass over every answer. None entries (failed prompts) are skipped
+        but keep their prompt index.
+
+        {
+          "per_model": {model: table},
+          "combined": table,
+          "by_prompt": {model: [{brand: mentions} | None, ...]}
+        }
+        """
+        totals = {}
+        by_prompt = {}
+
+        for model, answers in answers_by_model.items():
+            stats = totals[model] = _Tally()
+            rows = by_prompt[model] = []
+
+            for answer in answers:
+                if answer is None:
+                    rows.append(None)
+                    continue
+
+                counts = {}
+                for brand, _, _ in self.find(answer):
+                    counts[brand] = counts.get(brand, 0) + 1
+                stats.add(counts)
+                rows.append(counts)
+
+        combined = _Tally()
+        for stats in totals.values():
+            combined.merge(stats)
+
+        return {
+            "per_model": {m: s.table(self.brands) for m, s in totals.items()},
+            "combined": combined.table(self.brands),
+            "by_prompt": by_prompt,
+        }
+
+class _Tally:
+    def __init__(self):
+        self.answers = 0
+        self.mentions = defaultdict(int)
+        self.answered = defaultdict(int)
+        self.positions = defaultdict(int)
+        self.first = defaultdict(int)
+
+    def add(self, counts: Dict[str, int]):
+        # dicts keep insertion order, i.e. order of first appearance
+        self.answers += 1
+        for position, (brand, n) in enumerate(counts.items(), 1):
+            self.mentions[brand] += n
+            self.answered[brand] += 1
+            self.positions[brand] += position
+            self.first[brand] += position == 1
+
+    def merge(self, other: "_Tally"):
+        self.answers += other.answers
+        for mine, theirs in (
+            (self.mentions, other.mentions), (self.answered, other.answered),
+            (self.positions, other.positions), (self.first, other.first),
+        ):
+            for brand, n in theirs.items():
+                mine[brand] += n
+
+    def table(self, brands: Iterable[str]) -> Dict[str, Dict]:
+        """
+        {brand: row}, most mentioned first. share_of_voice is the brand's
+        share of all brand mentions, answer_share the share of answers
+        naming it (both in %), avg_position its mean rank of first mention.
+        """
+        total = sum(self.mentions.values())
+        rows = {}
+        for brand in brands:
+            mentions = self.mentions.get(brand, 0)
+            answered = self.answered.get(brand, 0)
+            rows[brand] = {
+                "mentions": mentions,
+                "share_of_voice": round(100 * mentions / total, 1) if total else 0.0,
+                "answers": answered,
+                "answer_share": round(100 * answered / self.answers, 1) if self.answers else 0.0,
+                "avg_position": round(self.positions[brand] / answered, 2) if answered else None,
+                "first_mentions": self.first.get(brand, 0),
+            }
+        return dict(sorted(rows.items(), key=lambda x: x[1]["mentions"], reverse=True))
+
+def report_brands(payload: Dict, evaluations: Iterable[Dict]) -> Dict[str, List[str]]:
+    """
+    Brands to count for a report: the input brand, payload competitors and
+    brand_aliases, plus every brand the evaluations scored. Names that fold
+    to the same string are one brand (first spelling wins).
+    """
+    aliases = payload.get("brand_aliases") or {}
+    names = [payload["brand"], *(payload.get("competitors") or []), *aliases]
+    for block in evaluations:
+        if isinstance(block, dict):
+            for key in ("brand_visibility", "brand_mentions"):
+                if isinstance(block.get(key), dict):
+                    names.extend(block[key])
+
+    brands = {}
+    canonical = {}
+    for name in names:
+        if not isinstance(name, str) or not name.strip():
+            continue
+        key = fold(name.strip())
+        if key not in canonical:
+            canonical[key] = name.strip()
+            brands[canonical[key]] = []
+
+    for name, extra in aliases.items():
+        brand = canonical.get(fold(name.strip())) if isinstance(name, str) else None
+        if brand is not None:
+            brands[brand].extend(a for a in extra or [] if isinstance(a, str) and a.strip())
+
+    return brands
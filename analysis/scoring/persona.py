@@ -1,19 +1,41 @@
 from typing import Dict, List
-import json
-import re
+import logging
+from analysis.scoring.lexical import MIN_SCORE, merge_hybrid, score_items, scoring_mode
 from llm.llm_factory import get_llm
+from llm.response_utils import invoke_json
+from llm.token_budget import fit_corpus, split_passages
 
-def score_personas(corpus: str, personas: List[str]) -> Dict[str, int]:
+logger = logging.getLogger(__name__)
+
+def score_personas(corpus: str, personas: List[str], mode: str | None = None) -> Dict[str, int]:
+    """
+    mode: "llm" (default, SCORING_MODE), "local" (lexical, no LLM call) or
+    "hybrid" (lexical; the LLM only scores personas the text never names).
+    """
     if not personas:
         return {}
 
+    mode = scoring_mode(mode)
+    if mode != "llm":
+        local = score_items(personas, split_passages(corpus))
+        unmatched = [p for p, v in local.items() if v == MIN_SCORE]
+        if mode == "local" or not unmatched:
+            return local
+        return merge_hybrid(local, _llm_score_personas(corpus, unmatched))
+
+    return _llm_score_personas(corpus, personas)
+
+def _llm_score_personas(corpus: str, personas: List[str]) -> Dict[str, int]:
     llm = get_llm("openai")
 
+    context, tokens = fit_corpus(corpus, personas, "openai")
+    logger.info("score_personas context tokens=%d", tokens)
+
     prompt = f"""
 You are evaluating how visible each persona is in the following analysis.
 
 ---
-{corpus[:2500]}
+{context}
 ---
 
 Personas to evaluate (IMPORTANT: DO NOT MODIFY THESE NAMES):
@@ -35,16 +57,9 @@ FORMAT:
 }}
 """
 
-    resp = llm.invoke(prompt)
-    text = getattr(resp, "content", str(resp))
-
-    match = re.search(r"\{[\s\S]*\}", text)
-    if not match:
-        return {}
+    data = invoke_json(llm, prompt, dict, "scoring.persona", default={})
 
     try:
-        data = json.loads(match.group(0))
-
         # sort descending
         return dict(sorted(data.items(), key=lambda x: x[1], reverse=True))
     except Exception:
@@ -1,21 +1,44 @@
 from typing import Dict, List
-import json
-import re
+import logging
+from analysis.scoring.lexical import MIN_SCORE, merge_hybrid, score_items, scoring_mode
 from llm.llm_factory import get_llm
+from llm.response_utils import invoke_json
+from llm.token_budget import fit_corpus, split_passages
 import os
 
-def score_topics(topics: List[str], corpus: str) -> Dict[str, int]:
+logger = logging.getLogger(__name__)
+
+def score_topics(topics: List[str], corpus: str, mode: str | None = None) -> Dict[str, int]:
+    """
+    mode: "llm" (default, SCORING_MODE), "local" (lexical, no LLM call) or
+    "hybrid" (lexical; the LLM only scores topics the text never names).
+    """
     if not corpus.strip():
         return {}
 
-    llm = get_llm(os.getenv("ACTIVE_LLM", "openai"))
+    mode = scoring_mode(mode)
+    if mode != "llm":
+        local = score_items(topics, split_passages(corpus))
+        unmatched = [t for t, v in local.items() if v == MIN_SCORE]
+        if mode == "local" or not unmatched:
+            return local
+        return merge_hybrid(local, _llm_score_topics(unmatched, corpus))
+
+    return _llm_score_topics(topics, corpus)
+
+def _llm_score_topics(topics: List[str], corpus: str) -> Dict[str, int]:
+    provider = os.getenv("ACTIVE_LLM", "openai")
+    llm = get_llm(provider)
+
+    context, tokens = fit_corpus(corpus, topics, provider)
+    logger.info("score_topics context tokens=%d", tokens)
 
     prompt = f"""
 You are scoring how relevant each topic is
 based on the following analysis text.
 
 ---
-{corpus[:2500]}
+{context}
 ---
 
 Topics to score:
@@ -36,14 +59,4 @@ FORMAT:
 }}
 """
 
-    resp = llm.invoke(prompt)
-    text = getattr(resp, "content", str(resp))
-
-    match = re.search(r"\{[\s\S]*\}", text)
-    if not match:
-        return {}
-
-    try:
-        return json.loads(match.group(0))
-    except Exception:
-        return {}
\ No newline at end of file
+    return invoke_json(llm, prompt, dict, "scoring.topic", default={})
\ No newline at end of file
@@ -1,14 +1,30 @@
-from fastapi import FastAPI
+from typing import AsyncIterator, List, Literal, Optional
+import asyncio
+import json
+import logging
+import os
+import time
+from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
 from api.schemas import *
-from discovery.products import extract_products
-from discovery.personas import generate_personas
-from discovery.topics import generate_topics
-from discovery.company import verify_company_from_url
-from analysis.report import generate_report
-from analysis.prompts import generate_prompts
-from llm.llm_factory import get_llm
+from discovery.products import aextract_products
+from discovery.personas import agenerate_personas, agenerate_personas_batch
+from discovery.topics import agenerate_topics, agenerate_topics_batch
+from discovery.company import averify_company_from_url, astream_bulk_verification
+from discovery.tree import astream_discovery_tree
+from analysis.report import agenerate_report, astream_report
+from analysis.prompts import agenerate_prompts
+from content_generation import agenerate_content, astream_bulk_content, astream_content
+from llm.llm_factory import get_llm, ashutdown_clients, limiter_stats
+from llm.hedging import hedging_stats
+from llm.telemetry import process_rss_mb, render_metrics
+from llm.cache import cache_mode, cache_stats
+from llm.response_utils import parse_failure_counts
+from state.jobs import get_job_manager
+
+logger = logging.getLogger(__name__)
 
 # App Initialization
 app = FastAPI(title="GEO Intelligence Core")
@@ -26,6 +42,58 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Background report jobs
+jobs = get_job_manager()
+
+@app.on_event("startup")
+async def start_jobs():
+    await jobs.start()
+
+# SERVER_START_TIME is set by serve.py in the parent before workers start
+@app.on_event("startup")
+async def report_boot():
+    started = os.getenv("SERVER_START_TIME")
+    boot = f"{time.time() - float(started):.2f}s" if started else "n/a"
+    logger.info("worker ready pid=%d boot=%s rss_mb=%.1f", os.getpid(), boot, process_rss_mb())
+
+@app.on_event("shutdown")
+async def close_llm_clients():
+    await jobs.stop()
+    await ashutdown_clients()
+
+# "use" (default), "refresh" (re-ask + overwrite) or "bypass" (no cache)
+CacheMode = Literal["use", "refresh", "bypass"]
+
+# Streaming wire formats
+StreamFormat = Literal["ndjson", "sse"]
+
+STREAM_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "sse": "text/event-stream",
+}
+
+def _stream_response(events: AsyncIterator[dict], fmt: str, cache: str) -> StreamingResponse:
+    """
+    Serializes an event generator as NDJSON lines or SSE frames.
+    The cache mode is re-applied here because the body is produced
+    after the handler has returned.
+    """
+
+    async def body():
+        with cache_mode(cache):
+            async for event in events:
+                data = json.dumps(event, ensure_ascii=False)
+                if fmt == "sse":
+                    yield f"event: {event.get('event', 'message')}\ndata: {data}\n\n"
+                else:
+                    yield data + "\n"
+
+    return StreamingResponse(
+        body(),
+        media_type=STREAM_MEDIA_TYPES[fmt],
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 # EXTRA MODELS
 class ContentGenerationRequest(BaseModel):
     topic: str
@@ -35,46 +103,99 @@ class ContentGenerationResponse(BaseModel):
     content_type: str
     content: str
 
+class BulkContentGenerationRequest(BaseModel):
+    topics: List[str] = Field(..., min_length=1, max_length=5000)
+    output: str = Field(default="default", description="Output file name under CONTENT_OUTPUT_DIR")
+    concurrency: Optional[int] = Field(default=None, ge=1, le=64)
+
 # ROOT
 @app.get("/")
-def greeting():
+async def greeting():
     return "Welcome to GEO Intelligence Application"
 
 # DISCOVERY
 @app.post("/verify-company")
-def verify_company(req: CompanyVerifyRequest):
-    return verify_company_from_url(req.url)
+async def verify_company(req: CompanyVerifyRequest, cache: CacheMode = "use"):
+    with cache_mode(cache):
+        return await averify_company_from_url(req.url)
+
+@app.post("/verify-company/batch")
+async def verify_company_batch(
+    req: BulkCompanyVerifyRequest,
+    format: StreamFormat = "ndjson",
+    cache: CacheMode = "use",
+):
+    """
+    Streams one verdict per domain as it finishes, then a summary
+    event with domains_per_minute.
+    """
+    events = astream_bulk_verification(req.urls, req.concurrency, req.batch_size)
+    return _stream_response(events, format, cache)
 
 @app.post("/products")
-def products(req: ProductRequest):
-    return {"products": extract_products(req.company)}
+async def products(req: ProductRequest, cache: CacheMode = "use"):
+    with cache_mode(cache):
+        return {"products": await aextract_products(req.company)}
 
 @app.post("/personas")
-def personas(req: PersonaRequest):
-    return {"personas": generate_personas(req.company, req.product)}
+async def personas(req: PersonaRequest, cache: CacheMode = "use"):
+    with cache_mode(cache):
+        return {"personas": await agenerate_personas(req.company, req.product)}
 
 @app.post("/topics")
-def topics(req: TopicRequest):
-    return {"topics": generate_topics(req.company, req.product, req.persona)}
+async def topics(req: TopicRequest, cache: CacheMode = "use"):
+    with cache_mode(cache):
+        return {"topics": await agenerate_topics(req.company, req.product, req.persona)}
+
+@app.post("/personas/batch")
+async def personas_batch(req: PersonaBatchRequest, cache: CacheMode = "use"):
+    with cache_mode(cache):
+        personas = await agenerate_personas_batch(req.company, req.products, req.num, req.batch_size)
+    return {"personas": personas}
+
+@app.post("/topics/batch")
+async def topics_batch(req: TopicBatchRequest, cache: CacheMode = "use"):
+    pairs = [(k.product, k.persona) for k in req.keys]
+    with cache_mode(cache):
+        topics = await agenerate_topics_batch(req.company, pairs, req.num, req.batch_size)
+    return {
+        "topics": [
+            {"product": product, "persona": persona, "topics": topics[(product, persona)]}
+            for product, persona in dict.fromkeys(pairs)
+        ]
+    }
+
+@app.post("/discovery-tree")
+async def discovery_tree(req: DiscoveryTreeRequest, format: StreamFormat = "ndjson", cache: CacheMode = "use"):
+    """
+    products -> personas -> topics in one call; branches stream as they finish.
+    """
+    events = astream_discovery_tree(req.company, req.fanout, req.num_personas, req.num_topics, req.batch_size)
+    return _stream_response(events, format, cache)
 
 # PROMPT GENERATION
 @app.post("/prompts")
-def prompts(req: AnalysisRequest):
+async def prompts(req: AnalysisRequest, cache: CacheMode = "use"):
+    with cache_mode(cache):
+        return await _prompts(req)
+
+async def _prompts(req: AnalysisRequest):
     results = []
     total = 0
 
-    for model in req.models:
-        llm = get_llm(model)
-
-        prompts = generate_prompts(
+    generated = await asyncio.gather(*[
+        agenerate_prompts(
             brand=req.brand,
             product=req.product,
             persona=req.persona,
             topic=req.topic,
             num=req.num_prompts,
-            llm=llm,
+            llm=get_llm(model),
         )
+        for model in req.models
+    ])
 
+    for model, prompts in zip(req.models, generated):
         results.append({
             "model": model,
             "prompts": prompts
@@ -89,55 +210,128 @@ def prompts(req: AnalysisRequest):
 
 # REPORT
 @app.post("/report")
-def report(payload: ReportRequest):
-    return generate_report(payload.dict())
+async def report(payload: ReportRequest, cache: CacheMode = "use"):
+    with cache_mode(cache):
+        return await agenerate_report(payload.dict())
 
-# CONTENT GENERATION
-@app.post("/content-generation", response_model=ContentGenerationResponse)
-def content_generation(payload: ContentGenerationRequest):
+@app.post("/report/stream")
+async def report_stream(payload: ReportRequest, format: StreamFormat = "ndjson", cache: CacheMode = "use"):
     """
-    Generates blog-style content to improve visibility for a given topic.
+    Same report as /report, emitted stage by stage.
+    The last event ("report") carries the full /report document.
     """
+    return _stream_response(astream_report(payload.dict()), format, cache)
 
-    llm = get_llm("openai")
+# REPORT JOBS
+def _job_status(job: dict) -> dict:
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "progress": job["progress"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+    }
 
-    prompt = f"""
-You are a senior industry content strategist.
+async def _get_job(job_id: str) -> dict:
+    job = await jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
-Generate a high-quality blog article
-focused on improving visibility and authority for the topic below.
+@app.post("/jobs/report", status_code=202)
+async def submit_report_job(payload: ReportRequest, cache: CacheMode = "use"):
+    return _job_status(await jobs.submit(payload.dict(), cache))
 
-TOPIC:
-{payload.topic}
+@app.get("/jobs/{job_id}")
+async def report_job_status(job_id: str):
+    return _job_status(await _get_job(job_id))
 
-CONTENT OBJECTIVE:
-- Strengthen topical authority
-- Educate readers
-- Improve strategic visibility
-- No promotional tone
+@app.get("/jobs/{job_id}/results")
+async def report_job_results(job_id: str):
+    """
+    Partial results while running; "report" is set once completed.
+    """
+    job = await _get_job(job_id)
+    return {
+        **_job_status(job),
+        "answers": job["answers"],
+        "errors": job["errors"],
+        "per_model": job["per_model"],
+        "combined": job["combined"],
+        "report": job["report"],
+    }
 
-CONTENT RULES:
-- Blog style
-- Professional tone
-- Clear headings
-- Insight-driven
-- No fluff
+@app.delete("/jobs/{job_id}")
+async def cancel_report_job(job_id: str):
+    await _get_job(job_id)
+    return _job_status(await jobs.cancel(job_id))
 
-Return ONLY plain text content.
-"""
+# CACHE
+@app.get("/cache/stats")
+async def llm_cache_stats():
+    return cache_stats()
 
-    resp = llm.invoke(prompt)
+# LLM OUTPUT PARSING
+@app.get("/parse-failures")
+async def llm_parse_failures():
+    """
+    JSON parse failures per call site since startup (re-asks included).
+    """
+    return parse_failure_counts()
 
-    raw_content = resp.content.strip()
-    clean_content = (
-        raw_content
-        .replace("**", "")
-        .replace("\n\n", "\n")
-        .replace("\n", " ")
-    )
+# LLM RATE LIMITS
+@app.get("/llm/limits")
+async def llm_limits():
+    """
+    Current per-provider limits, in-flight calls and queue depth.
+    """
+    return limiter_stats()
 
-    return {
-        "topic": payload.topic,
-        "content_type": "blog",
-        "content": clean_content
-    }
\ No newline at end of file
+@app.get("/llm/policies")
+async def llm_policies():
+    """
+    Hedge / failover counts per call policy and observed latency quantiles.
+    """
+    return hedging_stats()
+
+# METRICS (Prometheus text format)
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+# CONTENT GENERATION
+@app.post("/content-generation", response_model=ContentGenerationResponse)
+async def content_generation(
+    payload: ContentGenerationRequest,
+    stream: bool = False,
+    format: StreamFormat = "sse",
+    cache: CacheMode = "bypass",
+):
+    """
+    Generates blog-style content to improve visibility for a given topic.
+    Not cached by default so each call yields a fresh article.
+
+    ?stream=true streams the cleaned text as "delta" events and ends
+    with a "done" event carrying the same body as the plain response.
+    """
+
+    if stream:
+        return _stream_response(astream_content(payload.topic), format, cache)
+
+    with cache_mode(cache):
+        return await agenerate_content(payload.topic)
+
+@app.post("/content-generation/bulk")
+async def content_generation_bulk(
+    req: BulkContentGenerationRequest,
+    format: StreamFormat = "ndjson",
+    cache: CacheMode = "bypass",
+):
+    """
+    Generates one article per topic and appends each to the output JSONL
+    as it finishes. Rerunning with the same output skips topics that are
+    already written. Ends with a summary event with articles_per_minute.
+    """
+    events = astream_bulk_content(req.topics, req.output, concurrency=req.concurrency)
+    return _stream_response(events, format, cache)
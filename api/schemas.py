@@ -1,5 +1,5 @@
-from pydantic import BaseModel, HttpUrl, Field
-from typing import List, Optional
+from pydantic import BaseModel, HttpUrl, Field, field_validator
+from typing import Dict, List, Literal, Optional
 
 # COMPANY VERIFICATION
 class CompanyVerifyRequest(BaseModel):
@@ -10,6 +10,23 @@ class CompanyVerifyResponse(BaseModel):
     company: Optional[str] = None
     reason: Optional[str] = None
 
+class BulkCompanyVerifyRequest(BaseModel):
+    urls: List[str] = Field(..., min_length=1, max_length=20000)
+
+    concurrency: Optional[int] = Field(
+        default=None,
+        ge=1,
+        le=256,
+        description="Parallel page fetches (DNS lookups are limited by COMPANY_DNS_CONCURRENCY)"
+    )
+
+    batch_size: Optional[int] = Field(
+        default=None,
+        ge=1,
+        le=25,
+        description="Site digests per LLM classification call"
+    )
+
 # BASE (VERIFIED COMPANY)
 class CompanyBase(BaseModel):
     company: str = Field(..., description="Verified company name")
@@ -25,6 +42,36 @@ class TopicRequest(CompanyBase):
     product: str
     persona: str
 
+class DiscoveryTreeRequest(CompanyBase):
+    fanout: Optional[int] = Field(
+        default=None,
+        ge=1,
+        le=64,
+        description="Max concurrent discovery LLM calls while expanding the tree"
+    )
+    num_personas: int = Field(default=6, ge=1, le=12)
+    num_topics: int = Field(default=6, ge=1, le=12)
+    batch_size: Optional[int] = Field(
+        default=None,
+        ge=1,
+        le=32,
+        description="Use multi-key prompts with this many keys per LLM call"
+    )
+
+class PersonaBatchRequest(CompanyBase):
+    products: List[str] = Field(..., min_length=1)
+    num: int = Field(default=6, ge=1, le=12)
+    batch_size: Optional[int] = Field(default=None, ge=1, le=32)
+
+class TopicKey(BaseModel):
+    product: str
+    persona: str
+
+class TopicBatchRequest(CompanyBase):
+    keys: List[TopicKey] = Field(..., min_length=1)
+    num: int = Field(default=6, ge=1, le=12)
+    batch_size: Optional[int] = Field(default=None, ge=1, le=32)
+
 # PROMPT GENERATION
 class AnalysisRequest(BaseModel):
     brand: str
@@ -51,4 +98,37 @@ class ReportRequest(BaseModel):
     personas: List[str]
     topics: List[str]
     prompts: List[str]
-    models: List[str]
\ No newline at end of file
+    models: List[str]
+
+    competitors: List[str] = Field(
+        default_factory=list,
+        description="Brands to count in share of voice, besides those the evaluations name"
+    )
+    brand_aliases: Dict[str, List[str]] = Field(
+        default_factory=dict,
+        description="Alternate spellings per brand, e.g. {\"Salesforce\": [\"SFDC\", \"Sales Cloud\"]}"
+    )
+
+    @field_validator("brand_aliases")
+    @classmethod
+    def _clean_aliases(cls, value: Dict[str, List[str]]) -> Dict[str, List[str]]:
+        cleaned = {}
+        for brand, aliases in value.items():
+            brand = brand.strip()
+            if not brand:
+                raise ValueError("brand_aliases keys must not be blank")
+            aliases = [a.strip() for a in aliases]
+            if not all(aliases):
+                raise ValueError(f"brand_aliases[{brand!r}] contains a blank alias")
+            cleaned.setdefault(brand, []).extend(aliases)
+        return cleaned
+
+    evaluation_mode: Literal["separate", "batched"] = Field(
+        default="separate",
+        description="'separate' = one call per model + combined, 'batched' = one structured call"
+    )
+
+    scoring_mode: Optional[Literal["llm", "local", "hybrid"]] = Field(
+        default=None,
+        description="Persona / topic visibility: 'llm', 'local' (lexical over the answers) or 'hybrid'; default SCORING_MODE"
+    )
\ No newline at end of file
@@ -0,0 +1,249 @@
+# bench/fake_llm_server.py
+"""
+Local stand-in for the Azure OpenAI chat-completions and Perplexity APIs.
+
+Replies are shaped from the prompt so the real parsers succeed:
+JSON lists for discovery / prompt generation, keyed objects for batch
+prompts, evaluation sections for the report, prose otherwise.
+"stream": true requests get SSE chunks (latency is time to first token).
+
+  python -m bench.fake_llm_server --port 9100 --latency-ms 800 --error-rate 0.02
+
+Point the app at it with:
+  AZURE_OPENAI_ENDPOINT=http://127.0.0.1:9100
+  PERPLEXITY_API_URL=http://127.0.0.1:9100/chat/completions
+"""
+
+import argparse
+import ast
+import asyncio
+import json
+import random
+import re
+import time
+import uuid
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+class FakeConfig:
+    """
+    latency_ms / jitter: lognormal latency with that median and sigma
+    error_rate: share of calls answered with an error status
+    throttle_share: share of those errors that are 429 (rest are 500)
+    response_chars: length of prose replies
+    """
+
+    def __init__(
+        self,
+        latency_ms: float = 800,
+        jitter: float = 0.5,
+        error_rate: float = 0.0,
+        throttle_share: float = 0.5,
+        retry_after: float = 1.0,
+        response_chars: int = 1200,
+        seed: int | None = None,
+    ):
+        self.latency_ms = latency_ms
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_share = throttle_share
+        self.retry_after = retry_after
+        self.response_chars = response_chars
+        self.random = random.Random(seed)
+
+    def latency(self) -> float:
+        if self.latency_ms <= 0:
+            return 0.0
+        return self.random.lognormvariate(0, self.jitter) * self.latency_ms / 1000
+
+# Reply Shapes
+_WORDS = (
+    "visibility authority brand buyers platform pricing integration security analytics "
+    "workflow adoption market teams enterprise comparison review support scale insight"
+).split()
+
+def _prose(rng: random.Random, chars: int) -> str:
+    words = []
+    length = 0
+    while length < chars:
+        word = rng.choice(_WORDS)
+        words.append(word)
+        length += len(word) + 1
+    text = " ".join(words)
+    # paragraphs + markdown noise like real answers
+    return "\n\n".join(f"**{text[i:i + 300].strip()}**" for i in range(0, len(text), 300))
+
+def _count(prompt: str, default: int = 6) -> int:
+    match = re.search(r"(?:exactly|Generate|Return|list of)\s+(\d+)", prompt)
+    return int(match.group(1)) if match else default
+
+def _items(label: str, n: int) -> list:
+    return [f"{label} {i}" for i in range(1, n + 1)]
+
+def _context_list(prompt: str, label: str) -> list:
+    # "Personas: ['Sales leader', 'IT buyer']" from the prompt's INPUT CONTEXT
+    match = re.search(rf"^{label}: (.+)$", prompt, re.MULTILINE)
+    if not match:
+        return []
+    try:
+        value = ast.literal_eval(match.group(1).strip())
+    except (ValueError, SyntaxError):
+        return [match.group(1).strip()]
+    return list(value) if isinstance(value, (list, tuple)) else [str(value)]
+
+def _scores(rng: random.Random, names: list) -> dict:
+    scores = {name: rng.randint(45, 98) for name in names}
+    return dict(sorted(scores.items(), key=lambda x: x[1], reverse=True))
+
+def _evaluation(prompt: str, rng: random.Random, models: list | None = None) -> dict:
+    """
+    {section: {name: score}} as the report evaluators ask for; with models,
+    the combined block's model_visibility too.
+    """
+    brands = _context_list(prompt, "Brand") or ["Brand"]
+    section = {
+        "brand_visibility": _scores(rng, brands[:1]),
+        "brand_mentions": _scores(rng, brands[:1] + _items("Competitor", 4)),
+        "persona_visibility": _scores(rng, _context_list(prompt, "Personas") or ["Buyer"]),
+        "topic_visibility": _scores(rng, _context_list(prompt, "Topics") or ["Pricing"]),
+    }
+    if models:
+        section["model_visibility"] = _scores(rng, models)
+    return section
+
+def reply_for(prompt: str, config: FakeConfig) -> str:
+    if "=== MODEL:" in prompt and '"per_model"' in prompt:
+        models = [m.lower() for m in re.findall(r"=== MODEL: (\S+) ===", prompt)]
+        return json.dumps({
+            "per_model": {m: _evaluation(prompt, config.random) for m in models},
+            "combined": _evaluation(prompt, config.random, models),
+        })
+
+    if "DOMAIN:" in prompt:
+        domains = re.findall(r"### DOMAIN: (\S+)", prompt)
+        return json.dumps({d: {"valid": True, "company": d.split(".")[0].title()} for d in domains})
+
+    if '"valid"' in prompt:
+        return json.dumps({"valid": True, "company": "Example Inc"})
+
+    if "mapping EVERY" in prompt:
+        keys = re.findall(r'^"(\d+)":', prompt, re.MULTILINE)
+        return json.dumps({k: _items("Item", 4) for k in keys})
+
+    if "JSON list" in prompt:
+        return json.dumps(_items("Generated item", _count(prompt)))
+
+    if "MODEL UNDER REVIEW" in prompt or "visibility" in prompt and "JSON" in prompt:
+        models = [m.lower() for m in re.findall(r"=== MODEL: (\S+) ===", prompt)]
+        return json.dumps(_evaluation(prompt, config.random, models))
+
+    return _prose(config.random, config.response_chars)
+
+def _prompt_of(body: dict) -> str:
+    return "\n".join(str(m.get("content", "")) for m in body.get("messages", []))
+
+STREAM_CHUNK_CHARS = 16
+STREAM_CHUNK_DELAY = 0.002
+
+async def _stream(content: str, usage: dict, model: str):
+    base = {"id": f"chatcmpl-{uuid.uuid4().hex[:12]}", "object": "chat.completion.chunk", "created": int(time.time()), "model": model}
+
+    for i in range(0, len(content), STREAM_CHUNK_CHARS):
+        delta = {"role": "assistant", "content": content[i:i + STREAM_CHUNK_CHARS]}
+        yield f"data: {json.dumps({**base, 'choices': [{'index': 0, 'delta': delta, 'finish_reason': None}]})}\n\n"
+        await asyncio.sleep(STREAM_CHUNK_DELAY)
+
+    done = {"index": 0, "delta": {}, "finish_reason": "stop"}
+    yield f"data: {json.dumps({**base, 'choices': [done], 'usage': usage})}\n\n"
+    yield "data: [DONE]\n\n"
+
+def create_app(config: FakeConfig | None = None) -> FastAPI:
+    config = config or FakeConfig()
+    app = FastAPI(title="fake-llm")
+    app.state.config = config
+    app.state.calls = 0
+
+    async def complete(request: Request, model: str):
+        body = await request.json()
+        app.state.calls += 1
+
+        await asyncio.sleep(config.latency())
+
+        if config.random.random() < config.error_rate:
+            if config.random.random() < config.throttle_share:
+                return JSONResponse(
+                    {"error": {"message": "Rate limit reached", "code": "429"}},
+                    status_code=429,
+                    headers={"retry-after": str(config.retry_after)},
+                )
+            return JSONResponse({"error": {"message": "Internal error", "code": "500"}}, status_code=500)
+
+        prompt = _prompt_of(body)
+        content = reply_for(prompt, config)
+        usage = {
+            "prompt_tokens": len(prompt) // 4,
+            "completion_tokens": len(content) // 4,
+            "total_tokens": (len(prompt) + len(content)) // 4,
+        }
+
+        if body.get("stream"):
+            return StreamingResponse(
+                _stream(content, usage, body.get("model") or model),
+                media_type="text/event-stream",
+            )
+
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model") or model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": usage,
+        }
+
+    # Azure OpenAI
+    @app.post("/openai/deployments/{deployment}/chat/completions")
+    async def azure_chat(deployment: str, request: Request):
+        return await complete(request, deployment)
+
+    # Perplexity
+    @app.post("/chat/completions")
+    async def perplexity_chat(request: Request):
+        return await complete(request, "sonar")
+
+    @app.get("/stats")
+    async def stats():
+        return {"calls": app.state.calls}
+
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-ms", type=float, default=800)
+    parser.add_argument("--jitter", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-share", type=float, default=0.5)
+    parser.add_argument("--response-chars", type=int, default=1200)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    import uvicorn
+
+    config = FakeConfig(
+        latency_ms=args.latency_ms,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        throttle_share=args.throttle_share,
+        response_chars=args.response_chars,
+        seed=args.seed,
+    )
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
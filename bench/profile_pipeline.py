@@ -0,0 +1,134 @@
+# bench/profile_pipeline.py
+"""
+cProfile of generate_report and the discovery chain, offline.
+
+  # 1. record cassettes once (live providers, or the fake server)
+  python -m bench.profile_pipeline --record
+
+  # 2. profile from cassettes: no network, deterministic output
+  python -m bench.profile_pipeline
+  python -m bench.profile_pipeline --save-baseline
+  python -m bench.profile_pipeline --top 40
+
+CPU seconds per stage are compared against bench/results/profile_baseline.json.
+"""
+
+import argparse
+import asyncio
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import time
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+DEFAULT_BASELINE = os.path.join(RESULTS_DIR, "profile_baseline.json")
+
+DEFAULT_PAYLOAD = {
+    "brand": "HubSpot",
+    "product": "CRM software",
+    "personas": ["Sales leader", "Marketing manager"],
+    "topics": ["pricing", "integrations"],
+    "prompts": [
+        "What is the best CRM for a 20-person startup?",
+        "Which CRM has the best marketing automation?",
+        "Compare HubSpot and Salesforce for small businesses",
+    ],
+    "models": ["openai", "perplexity"],
+}
+
+def _stage_report(payload: dict):
+    from analysis.report import generate_report
+    return generate_report(payload)
+
+def _stage_discovery(company: str):
+    from discovery.tree import astream_discovery_tree
+
+    async def drain():
+        tree = None
+        async for event in astream_discovery_tree(company, num_personas=3, num_topics=3):
+            if event["event"] == "tree":
+                tree = event["tree"]
+        return tree
+
+    return asyncio.run(drain())
+
+def profile_stage(name: str, fn, *args):
+    profiler = cProfile.Profile()
+    cpu = time.process_time()
+    wall = time.perf_counter()
+
+    profiler.enable()
+    try:
+        fn(*args)
+    finally:
+        profiler.disable()
+
+    cpu = time.process_time() - cpu
+    wall = time.perf_counter() - wall
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    stats_path = os.path.join(RESULTS_DIR, f"profile_{name}.pstats")
+    profiler.dump_stats(stats_path)
+
+    return profiler, {"cpu_seconds": round(cpu, 4), "wall_seconds": round(wall, 4), "pstats": stats_path}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--record", action="store_true", help="call real providers and write cassettes")
+    parser.add_argument("--stages", default="report,discovery")
+    parser.add_argument("--payload", help="JSON file with a /report payload")
+    parser.add_argument("--company", default="HubSpot")
+    parser.add_argument("--top", type=int, default=25)
+    parser.add_argument("--sort", default="cumulative")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    args = parser.parse_args()
+
+    # before any llm.* import: these are read at import time
+    os.environ["LLM_REPLAY"] = "record" if args.record else "replay"
+    os.environ["LLM_CACHE"] = "0"
+
+    payload = DEFAULT_PAYLOAD
+    if args.payload:
+        with open(args.payload) as f:
+            payload = json.load(f)
+
+    stages = {
+        "report": (_stage_report, payload),
+        "discovery": (_stage_discovery, args.company),
+    }
+    selected = [s.strip() for s in args.stages.split(",") if s.strip()]
+
+    summary = {}
+    for name in selected:
+        fn, arg = stages[name]
+        profiler, summary[name] = profile_stage(name, fn, arg)
+
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats(args.sort).print_stats(args.top)
+        print(f"===== {name}: cpu {summary[name]['cpu_seconds']}s wall {summary[name]['wall_seconds']}s =====")
+        print(out.getvalue())
+
+    if args.record:
+        print("cassettes recorded; rerun without --record to profile offline", file=sys.stderr)
+        return
+
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for name, result in summary.items():
+            before = baseline.get(name)
+            if before and before.get("cpu_seconds"):
+                change = (result["cpu_seconds"] - before["cpu_seconds"]) / before["cpu_seconds"]
+                print(f"{name}: cpu {before['cpu_seconds']}s -> {result['cpu_seconds']}s ({change:+.1%})")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(summary, f, indent=2)
+        print(f"baseline saved to {args.baseline}")
+
+if __name__ == "__main__":
+    main()
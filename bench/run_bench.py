@@ -0,0 +1,330 @@
+# bench/run_bench.py
+"""
+Load / latency benchmark for the API against the local fake LLM server.
+
+Starts bench.fake_llm_server in-process, points the providers at it and
+drives the FastAPI app over ASGI (no real network, no provider spend).
+Per scenario it reports p50/p95/p99 latency, requests/sec, provider
+calls per request and peak memory, and compares against a saved baseline.
+
+  python -m bench.run_bench --requests 50 --concurrency 10
+  python -m bench.run_bench --save-baseline
+  python -m bench.run_bench --scenarios report,prompts --fail-on-regression
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import socket
+import sys
+import threading
+import time
+import tracemalloc
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+DEFAULT_BASELINE = os.path.join(RESULTS_DIR, "baseline.json")
+DEFAULT_OUTPUT = os.path.join(RESULTS_DIR, "latest.json")
+
+MODELS = ["openai", "perplexity"]  # Gemini has no fake endpoint
+
+# Scenarios: name -> (path, body for request i)
+SCENARIOS = {
+    "report": ("/report", lambda i: {
+        "brand": f"Brand {i}",
+        "product": "CRM software",
+        "personas": ["Sales leader", "IT buyer"],
+        "topics": ["pricing", "integrations"],
+        "prompts": [f"Best CRM for startups #{i}", f"CRM with strong API #{i}", f"Cheapest CRM #{i}"],
+        "models": MODELS,
+    }),
+    "report_batched": ("/report", lambda i: {
+        "brand": f"Brand {i}",
+        "product": "CRM software",
+        "personas": ["Sales leader", "IT buyer"],
+        "topics": ["pricing", "integrations"],
+        "prompts": [f"Best CRM for startups #{i}", f"CRM with strong API #{i}", f"Cheapest CRM #{i}"],
+        "models": MODELS,
+        "evaluation_mode": "batched",
+    }),
+    "prompts": ("/prompts", lambda i: {
+        "brand": f"Brand {i}",
+        "product": "CRM software",
+        "persona": "Sales leader",
+        "topic": "pricing",
+        "models": MODELS,
+        "num_prompts": 5,
+    }),
+    "products": ("/products", lambda i: {"company": f"Company {i}"}),
+    "personas": ("/personas", lambda i: {"company": f"Company {i}", "product": "CRM software"}),
+    "topics": ("/topics", lambda i: {"company": f"Company {i}", "product": "CRM software", "persona": "Sales leader"}),
+    "discovery_tree": ("/discovery-tree", lambda i: {"company": f"Company {i}", "num_personas": 3, "num_topics": 3}),
+    "discovery_tree_batched": ("/discovery-tree", lambda i: {"company": f"Company {i}", "num_personas": 3, "num_topics": 3, "batch_size": 8}),
+    "content_generation": ("/content-generation", lambda i: {"topic": f"CRM pricing strategy #{i}"}),
+    "content_generation_stream": ("/content-generation?stream=true", lambda i: {"topic": f"CRM pricing strategy #{i}"}),
+}
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+# Fake provider server (background thread)
+def start_fake_server(config, port: int):
+    import uvicorn
+    from bench.fake_llm_server import create_app
+
+    app = create_app(config)
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+
+    deadline = time.time() + 10
+    while not server.started:
+        if time.time() > deadline:
+            raise RuntimeError("fake LLM server did not start")
+        time.sleep(0.05)
+
+    return app, server, thread
+
+def configure_environment(port: int, cache: bool):
+    """
+    Must run before the app (and llm.*) is imported: endpoints and
+    cache settings are read at import time.
+    """
+    base = f"http://127.0.0.1:{port}"
+    os.environ.update({
+        "AZURE_OPENAI_ENDPOINT": base,
+        "AZURE_OPENAI_API_KEY": "bench",
+        "AZURE_DEPLOYMENT_NAME": "bench-gpt",
+        "OPENAI_API_VERSION": "2024-02-01",
+        "PERPLEXITY_API_URL": f"{base}/chat/completions",
+        "PERPLEXITY_API_KEY": "bench",
+        "LLM_CACHE": "1" if cache else "0",
+        "JOB_STORE": "memory",
+    })
+
+def _percentile(values: list, q: float):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on Linux
+    return round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 1)
+
+async def run_scenario(client, fake_app, name: str, requests: int, concurrency: int, trace_memory: bool) -> dict:
+    path, body = SCENARIOS[name]
+    slots = asyncio.Semaphore(concurrency)
+    latencies = []
+    statuses = {}
+
+    async def one(i: int):
+        async with slots:
+            start = time.perf_counter()
+            resp = await client.post(path, json=body(i))
+            await resp.aread()
+            latencies.append(time.perf_counter() - start)
+            statuses[resp.status_code] = statuses.get(resp.status_code, 0) + 1
+
+    if trace_memory:
+        tracemalloc.start()
+    calls_before = fake_app.state.calls
+    started = time.perf_counter()
+
+    await asyncio.gather(*[one(i) for i in range(requests)])
+
+    wall = time.perf_counter() - started
+    heap_peak = None
+    if trace_memory:
+        heap_peak = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 1)
+        tracemalloc.stop()
+
+    def ms(value):
+        return round(value * 1000, 1) if value is not None else None
+
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "p50_ms": ms(_percentile(latencies, 0.50)),
+        "p95_ms": ms(_percentile(latencies, 0.95)),
+        "p99_ms": ms(_percentile(latencies, 0.99)),
+        "max_ms": ms(max(latencies)),
+        "requests_per_sec": round(requests / wall, 2),
+        "errors": sum(n for code, n in statuses.items() if code >= 400),
+        "statuses": {str(k): v for k, v in sorted(statuses.items())},
+        "provider_calls_per_request": round((fake_app.state.calls - calls_before) / requests, 2),
+        "peak_rss_mb": _peak_rss_mb(),
+        "peak_heap_mb": heap_peak,
+    }
+
+# Provider calls a request must make when every call succeeds (no cache,
+# no injected errors): 3 prompts x 2 models, then 2 per-model + 1 combined
+# evaluations, or a single batched evaluation. More means a fallback ran.
+EXPECTED_CALLS = {
+    "report": 9,
+    "report_batched": 7,
+}
+
+def check_calls(results: dict) -> list:
+    """
+    Returns [(scenario, expected, measured)] that made extra calls.
+    """
+    wrong = []
+    for name, expected in EXPECTED_CALLS.items():
+        current = results["scenarios"].get(name)
+        if current and current["errors"] == 0 and current["provider_calls_per_request"] != expected:
+            wrong.append((name, expected, current["provider_calls_per_request"]))
+    return wrong
+
+# Baseline comparison
+COMPARED = (("p50_ms", -1), ("p95_ms", -1), ("p99_ms", -1), ("requests_per_sec", 1))
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Returns [(scenario, metric, baseline, current, change)] past tolerance.
+    """
+    regressions = []
+    for name, current in results["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        for metric, direction in COMPARED:
+            old, new = before.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if change * direction < -tolerance:
+                regressions.append((name, metric, old, new, change))
+    return regressions
+
+def print_table(results: dict, baseline: dict | None):
+    header = f"{'scenario':24} {'p50':>9} {'p95':>9} {'p99':>9} {'req/s':>8} {'calls/req':>9} {'errors':>6} {'rss MB':>7}"
+    print(header)
+    print("-" * len(header))
+    for name, r in results["scenarios"].items():
+        print(
+            f"{name:24} {r['p50_ms']:>9} {r['p95_ms']:>9} {r['p99_ms']:>9} "
+            f"{r['requests_per_sec']:>8} {r['provider_calls_per_request']:>9} {r['errors']:>6} {r['peak_rss_mb']:>7}"
+        )
+        before = (baseline or {}).get("scenarios", {}).get(name)
+        if before:
+            deltas = []
+            for metric, _ in COMPARED:
+                if before.get(metric):
+                    deltas.append(f"{metric} {100 * (r[metric] - before[metric]) / before[metric]:+.1f}%")
+            print(f"{'':24} vs baseline: " + ", ".join(deltas))
+
+async def run(args, fake_app) -> dict:
+    import httpx
+    from api.main import app
+    from llm.llm_factory import ashutdown_clients
+
+    scenarios = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for name in args.scenarios:
+            print(f"running {name} ({args.requests} requests, concurrency {args.concurrency})", file=sys.stderr)
+            scenarios[name] = await run_scenario(
+                client, fake_app, name, args.requests, args.concurrency, args.trace_memory
+            )
+
+    await ashutdown_clients()
+    return scenarios
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma separated: " + ",".join(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--latency-ms", type=float, default=200, help="median fake provider latency")
+    parser.add_argument("--jitter", type=float, default=0.5, help="lognormal sigma of the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--response-chars", type=int, default=1200)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--cache", action="store_true", help="keep the LLM response cache on")
+    parser.add_argument("--trace-memory", action="store_true", help="tracemalloc peak heap per scenario (slower)")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args()
+
+    args.scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = [s for s in args.scenarios if s not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+
+    from bench.fake_llm_server import FakeConfig
+
+    config = FakeConfig(
+        latency_ms=args.latency_ms,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        response_chars=args.response_chars,
+        seed=args.seed,
+    )
+    port = _free_port()
+    configure_environment(port, args.cache)
+    fake_app, server, thread = start_fake_server(config, port)
+
+    try:
+        scenarios = asyncio.run(run(args, fake_app))
+    finally:
+        server.should_exit = True
+        thread.join(timeout=5)
+
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "fake_server": {
+                "latency_ms": args.latency_ms,
+                "jitter": args.jitter,
+                "error_rate": args.error_rate,
+                "response_chars": args.response_chars,
+            },
+            "cache": args.cache,
+        },
+        "scenarios": scenarios,
+    }
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    print_table(results, baseline)
+
+    # only meaningful when every provider call is real and succeeds
+    miscounted = [] if args.cache or args.error_rate else check_calls(results)
+    for name, expected, measured in miscounted:
+        print(f"CALL COUNT {name}: expected {expected} provider calls per request, measured {measured}")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"baseline saved to {args.baseline}")
+
+    if baseline:
+        regressions = compare(results, baseline, args.tolerance)
+        for name, metric, old, new, change in regressions:
+            print(f"REGRESSION {name} {metric}: {old} -> {new} ({change:+.1%})")
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+
+    if miscounted:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,54 +1,288 @@
-from fastapi import APIRouter
-from pydantic import BaseModel
-from llm.llm_factory import get_llm
+# content_generation.py
+"""
+Blog content generation shared by the non-streaming and streaming
+/content-generation modes.
+
+The clean-up pass (strip, drop "**", collapse newlines) is applied
+incrementally to the token stream; the streamed text joined together is
+identical to clean_content() of the full reply.
 
-router = APIRouter()
+astream_bulk_content() generates many topics concurrently and appends
+each article to a JSONL file under CONTENT_OUTPUT_DIR as it finishes;
+a rerun on the same output skips topics that already have an article.
+"""
 
-class ContentGenerationRequest(BaseModel):
-    topic: str
+import asyncio
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import AsyncIterator, Dict, List
+from llm.llm_factory import get_concurrency, get_llm
+from llm.response_utils import extract_text, extract_text_chunk
 
-class ContentGenerationResponse(BaseModel):
-    topic: str
-    content_type: str
-    content: str
+logger = logging.getLogger(__name__)
 
-@router.post("/content-generation", response_model=ContentGenerationResponse)
-def generate_content(payload: ContentGenerationRequest):
-    llm = get_llm("openai")
+CONTENT_TYPE = "blog"
+CONTENT_OUTPUT_DIR = os.getenv("CONTENT_OUTPUT_DIR", ".cache/content")
 
-    prompt = f"""
-You are a senior luxury industry content strategist.
+def content_prompt(topic: str) -> str:
+    return f"""
+You are a senior industry content strategist.
 
-Your task is to generate a high-quality blog article
+Generate a high-quality blog article
 focused on improving visibility and authority for the topic below.
 
 TOPIC:
-{payload.topic}
+{topic}
 
 CONTENT OBJECTIVE:
 - Strengthen topical authority
 - Educate readers
-- Improve strategic visibility of the topic
+- Improve strategic visibility
 - No promotional tone
-- No sales language
 
 CONTENT RULES:
-- Blog-style content
-- Professional, authoritative tone
-- Clear structure with headings
-- 800–1200 words
-- Insight-driven, not generic
-- Avoid fluff and repetition
-- No brand pushing unless contextually necessary
-
-OUTPUT:
-Return ONLY the blog content as plain text.
+- Blog style
+- Professional tone
+- Clear headings
+- Insight-driven
+- No fluff
+
+Return ONLY plain text content.
 """
 
-    resp = llm.invoke(prompt)
+def clean_content(raw: str) -> str:
+    return (
+        raw.strip()
+        .replace("**", "")
+        .replace("\n\n", "\n")
+        .replace("\n", " ")
+    )
+
+# Incremental clean-up
+class _Strip:
+    """
+    str.strip() over a stream: leading whitespace is dropped, trailing
+    whitespace is held until more text arrives.
+    """
+
+    def __init__(self):
+        self.started = False
+        self.held = ""
+
+    def feed(self, text: str) -> str:
+        if not self.started:
+            text = text.lstrip()
+            if not text:
+                return ""
+            self.started = True
+
+        text = self.held + text
+        body = text.rstrip()
+        self.held = text[len(body):]
+        return body
+
+    def flush(self) -> str:
+        return ""
+
+class _Replace:
+    """
+    str.replace(pattern, repl) for a pattern made of one repeated character
+    ("**", "\\n\\n"): a trailing run of that character is held back, since
+    how it pairs up depends on what follows.
+    """
 
+    def __init__(self, pattern: str, repl: str):
+        self.pattern = pattern
+        self.repl = repl
+        self.char = pattern[0]
+        self.held = ""
+
+    def feed(self, text: str) -> str:
+        text = self.held + text
+        body = text.rstrip(self.char)
+        self.held = text[len(body):]
+        return body.replace(self.pattern, self.repl)
+
+    def flush(self) -> str:
+        text, self.held = self.held, ""
+        return text.replace(self.pattern, self.repl)
+
+class StreamCleaner:
+    def __init__(self):
+        self.stages = [_Strip(), _Replace("**", ""), _Replace("\n\n", "\n")]
+
+    def feed(self, chunk: str) -> str:
+        for stage in self.stages:
+            chunk = stage.feed(chunk)
+        return chunk.replace("\n", " ")
+
+    def flush(self) -> str:
+        text = ""
+        for stage in self.stages:
+            text = stage.feed(text) + stage.flush()
+        return text.replace("\n", " ")
+
+# Generation
+def _result(topic: str, content: str) -> Dict:
     return {
-        "topic": payload.topic,
-        "content_type": "blog",
-        "content": resp.content.strip()
-    }
\ No newline at end of file
+        "topic": topic,
+        "content_type": CONTENT_TYPE,
+        "content": content
+    }
+
+async def agenerate_content(topic: str, provider: str = "openai") -> Dict:
+    resp = await get_llm(provider).ainvoke(content_prompt(topic))
+    return _result(topic, clean_content(extract_text(resp)))
+
+def generate_content(topic: str, provider: str = "openai") -> Dict:
+    resp = get_llm(provider).invoke(content_prompt(topic))
+    return _result(topic, clean_content(extract_text(resp)))
+
+async def astream_content(topic: str, provider: str = "openai") -> AsyncIterator[Dict]:
+    """
+    Events:
+      delta -> cleaned text as it is generated
+      done  -> the full document (same shape as agenerate_content)
+    """
+    cleaner = StreamCleaner()
+    parts = []
+
+    async for chunk in get_llm(provider).astream(content_prompt(topic)):
+        text = cleaner.feed(extract_text_chunk(chunk))
+        if text:
+            parts.append(text)
+            yield {"event": "delta", "text": text}
+
+    tail = cleaner.flush()
+    if tail:
+        parts.append(tail)
+        yield {"event": "delta", "text": tail}
+
+    yield {"event": "done", **_result(topic, "".join(parts))}
+
+# Bulk generation
+def topic_key(topic: str) -> str:
+    return " ".join(topic.split()).casefold()
+
+class ArticleStore:
+    """
+    Append-only JSONL of finished articles, one line per topic.
+    Lines cut short by a crash are ignored on load.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def done_keys(self) -> set:
+        keys = set()
+        if not os.path.exists(self.path):
+            return keys
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    keys.add(json.loads(line)["key"])
+                except (ValueError, KeyError, TypeError):
+                    continue
+        return keys
+
+    def append(self, article: Dict):
+        line = json.dumps(article, ensure_ascii=False) + "\n"
+        with self._lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+def output_path(name: str) -> str:
+    # a bare file name, so requests cannot write outside CONTENT_OUTPUT_DIR
+    name = re.sub(r"[^A-Za-z0-9_.-]+", "_", name).strip("._") or "default"
+    return os.path.join(CONTENT_OUTPUT_DIR, f"{name}.jsonl")
+
+async def astream_bulk_content(
+    topics: List[str],
+    output: str = "default",
+    provider: str = "openai",
+    concurrency: int | None = None,
+) -> AsyncIterator[Dict]:
+    """
+    Events:
+      skipped -> topic already has an article in the output file
+      result  -> article generated and persisted
+      error   -> generation failed (not persisted, retried on rerun)
+      summary -> counts, seconds and articles_per_minute
+    Every event but the summary carries done / total.
+    """
+
+    concurrency = concurrency or get_concurrency(provider)
+    store = ArticleStore(output_path(output))
+    started = time.perf_counter()
+
+    # one article per topic, whatever spelling the list used
+    unique = {}
+    for topic in topics:
+        if topic.strip():
+            unique.setdefault(topic_key(topic), topic.strip())
+
+    existing = await asyncio.to_thread(store.done_keys)
+    pending = {k: t for k, t in unique.items() if k not in existing}
+    total = len(unique)
+    counters = {"done": 0, "generated": 0, "skipped": 0, "failed": 0}
+
+    def progress(event: Dict) -> Dict:
+        counters["done"] += 1
+        return {**event, "done": counters["done"], "total": total}
+
+    for key, topic in unique.items():
+        if key not in pending:
+            counters["skipped"] += 1
+            yield progress({"event": "skipped", "topic": topic})
+
+    slots = asyncio.Semaphore(concurrency)
+
+    async def generate(key: str, topic: str) -> Dict:
+        async with slots:
+            start = time.perf_counter()
+            try:
+                article = await agenerate_content(topic, provider)
+            except Exception as e:
+                logger.warning("content generation failed for %r: %s", topic, e)
+                return {"event": "error", "topic": topic, "error": str(e)}
+
+        seconds = round(time.perf_counter() - start, 3)
+        await asyncio.to_thread(store.append, {
+            "key": key,
+            **article,
+            "provider": provider,
+            "seconds": seconds,
+            "created_at": time.time(),
+        })
+        return {"event": "result", **article, "seconds": seconds}
+
+    tasks = [asyncio.create_task(generate(k, t)) for k, t in pending.items()]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            event = await finished
+            counters["generated" if event["event"] == "result" else "failed"] += 1
+            yield progress(event)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    seconds = time.perf_counter() - started
+    summary = {
+        "event": "summary",
+        "output": store.path,
+        "topics": total,
+        "generated": counters["generated"],
+        "skipped": counters["skipped"],
+        "failed": counters["failed"],
+        "seconds": round(seconds, 2),
+        "articles_per_minute": round(counters["generated"] / seconds * 60, 1) if seconds else None,
+    }
+    logger.info("bulk content %s: %d generated, %d skipped, %d failed in %.1fs",
+                store.path, summary["generated"], summary["skipped"], summary["failed"], seconds)
+    yield summary
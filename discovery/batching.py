@@ -0,0 +1,130 @@
+# discovery/batching.py
+"""
+Multi-key prompting: ask for many (company, product[, persona]) keys in
+one LLM call and get back one JSON object keyed by input id.
+Keys the model drops or mangles are split off and retried.
+"""
+
+import asyncio
+import logging
+import os
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Tuple
+from langchain_core.messages import HumanMessage
+from llm.llm_factory import get_discovery_llm
+from llm.response_utils import ainvoke_json
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = int(os.getenv("DISCOVERY_BATCH_SIZE", "8"))
+
+def _valid(items) -> bool:
+    return isinstance(items, list) and bool(items) and all(isinstance(i, str) and i.strip() for i in items)
+
+async def _ask(prompt: str) -> Dict:
+    llm = get_discovery_llm()
+    return await ainvoke_json(llm, [HumanMessage(content=prompt)], dict, "discovery.batch", default={})
+
+async def _unlimited(coro):
+    return await coro
+
+async def _resolve(
+    keys: List,
+    build_prompt: Callable[[List], str],
+    single: Callable[..., Awaitable[List[str]]],
+    limit: Callable,
+    emit: Callable,
+):
+    """
+    One call for `keys`; anything missing is halved and retried until a
+    lone key falls back to the single-key generator. Every key is emitted
+    exactly once, as (key, items, None) or (key, None, error).
+    """
+    if len(keys) == 1:
+        try:
+            emit(keys[0], await limit(single(keys[0])), None)
+        except Exception as e:
+            emit(keys[0], None, e)
+        return
+
+    try:
+        data = await limit(_ask(build_prompt(keys)))
+    except Exception:
+        data = {}
+
+    missing = []
+    for i, key in enumerate(keys, 1):
+        items = data.get(str(i)) if isinstance(data, dict) else None
+        if _valid(items):
+            emit(key, items, None)
+        else:
+            missing.append(key)
+
+    if missing:
+        mid = (len(missing) + 1) // 2
+        halves = [missing[:mid], missing[mid:]] if len(missing) > 1 else [missing]
+        await asyncio.gather(*[_resolve(h, build_prompt, single, limit, emit) for h in halves if h])
+
+async def astream_batch_generate(
+    keys: List,
+    build_prompt: Callable[[List], str],
+    single: Callable[..., Awaitable[List[str]]],
+    batch_size: int | None = None,
+    limit: Callable | None = None,
+) -> AsyncIterator[Tuple]:
+    """
+    Runs every chunk of `batch_size` keys concurrently and yields
+    (key, items, error) as each key resolves (duplicates collapsed).
+    `limit` wraps every LLM call (e.g. a semaphore-guarded awaiter),
+    so batches and their retries share the caller's concurrency bound.
+    """
+    keys = list(dict.fromkeys(keys))
+    batch_size = batch_size or DEFAULT_BATCH_SIZE
+    limit = limit or _unlimited
+
+    resolved = asyncio.Queue()
+    emitted = set()
+
+    def emit(key, items, error):
+        emitted.add(key)
+        resolved.put_nowait((key, items, error))
+
+    async def run(chunk: List):
+        try:
+            await _resolve(chunk, build_prompt, single, limit, emit)
+        except Exception as e:
+            for key in chunk:
+                if key not in emitted:
+                    emit(key, None, e)
+
+    chunks = [keys[i:i + batch_size] for i in range(0, len(keys), batch_size)]
+    tasks = [asyncio.create_task(run(c)) for c in chunks]
+
+    try:
+        for _ in keys:
+            yield await resolved.get()
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def abatch_generate(
+    keys: List,
+    build_prompt: Callable[[List], str],
+    single: Callable[..., Awaitable[List[str]]],
+    batch_size: int | None = None,
+    limit: Callable | None = None,
+) -> Dict:
+    """
+    Returns {key: [items]} in input order; a key whose generation failed
+    gets [] (and a warning).
+    """
+    keys = list(dict.fromkeys(keys))
+    results = {}
+    async for key, items, error in astream_batch_generate(keys, build_prompt, single, batch_size, limit):
+        if error is not None:
+            logger.warning("discovery batch: %r failed: %s", key, error)
+        results[key] = items or []
+
+    return {key: results.get(key, []) for key in keys}
+
+def numbered(labels: List[str]) -> str:
+    return "\n".join(f'"{i}": {label}' for i, label in enumerate(labels, 1))
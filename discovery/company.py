@@ -1,70 +1,188 @@
 # discovery/company.py
+import asyncio
+import logging
+import os
+import time
+import httpx
 import requests
 import socket
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse
 from langchain_core.messages import HumanMessage
 from llm.llm_factory import get_discovery_llm
+from llm.cache import MemoryLRU, current_cache_mode
+from llm.token_budget import count_tokens
+from llm.response_utils import ainvoke_json, invoke_json
+from llm.singleflight import SingleFlight
+from llm.telemetry import span, traced
+from discovery.page_digest import html_digest
 
-def _domain_resolves(hostname: str) -> bool:
+logger = logging.getLogger(__name__)
+
+# Verification cache: hostname -> result
+# Real companies rarely stop being real; dead domains may come back.
+POSITIVE_TTL = int(os.getenv("COMPANY_VERIFY_TTL", str(24 * 3600)))
+NEGATIVE_TTL = int(os.getenv("COMPANY_VERIFY_NEGATIVE_TTL", "600"))
+DNS_TIMEOUT = float(os.getenv("COMPANY_DNS_TIMEOUT", "2"))
+
+_verified = MemoryLRU(int(os.getenv("COMPANY_VERIFY_CACHE_SIZE", "10000")))
+_inflight = SingleFlight()
+
+def _cache_key(hostname: str) -> str:
+    hostname = hostname.lower().rstrip(".")
+    return hostname[4:] if hostname.startswith("www.") else hostname
+
+def _cached_result(hostname: str):
+    if current_cache_mode() != "use":
+        return None
+    return _verified.get(_cache_key(hostname))
+
+def _remember(hostname: str, result: dict, cacheable: bool = True):
+    if not cacheable or current_cache_mode() == "bypass":
+        return
+    ttl = POSITIVE_TTL if result.get("valid") else NEGATIVE_TTL
+    _verified.set(_cache_key(hostname), result, time.time() + ttl)
+
+def clear_verification_cache():
+    _verified.clear()
+
+# DNS: True = resolves, False = no such domain (cacheable), None = unknown
+# (timeout / resolver failure; never cached)
+DNS_CONCURRENCY = int(os.getenv("COMPANY_DNS_CONCURRENCY", "32"))
+
+# getaddrinfo blocks a thread until the system resolver gives up, even after
+# the caller's deadline; a pool of its own keeps dead domains from starving
+# the default executor
+_dns_pool = ThreadPoolExecutor(max_workers=DNS_CONCURRENCY, thread_name_prefix="dns")
+_dns_slots = weakref.WeakKeyDictionary()
+
+_NO_SUCH_DOMAIN = {socket.EAI_NONAME, getattr(socket, "EAI_NODATA", socket.EAI_NONAME)}
+
+def _resolve(hostname: str):
     try:
-        socket.gethostbyname(hostname)
+        socket.getaddrinfo(hostname, None)
         return True
-    except:
+    except socket.gaierror as e:
+        if e.errno in _NO_SUCH_DOMAIN:
+            return False
+        return None
+    except UnicodeError:
+        # not encodable as a hostname (IDNA label too long / empty)
         return False
+    except OSError:
+        return None
+
+def _domain_resolves(hostname: str):
+    return _resolve(hostname)
+
+async def _adomain_resolves(hostname: str):
+    """
+    Waits for a free resolver thread first; the DNS_TIMEOUT deadline only
+    covers the lookup itself. A slot is released when its thread is done,
+    not at the deadline, so abandoned lookups still count against the pool.
+    """
+    loop = asyncio.get_running_loop()
+    slots = _dns_slots.get(loop)
+    if slots is None:
+        slots = _dns_slots[loop] = asyncio.Semaphore(DNS_CONCURRENCY)
+
+    await slots.acquire()
+    lookup = loop.run_in_executor(_dns_pool, _resolve, hostname)
+    lookup.add_done_callback(lambda _: slots.release())
+
+    try:
+        return await asyncio.wait_for(asyncio.shield(lookup), timeout=DNS_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.info("DNS lookup for %s timed out after %.1fs", hostname, DNS_TIMEOUT)
+        return None
+
+def _dns_failure(resolves) -> dict:
+    if resolves is False:
+        return {"valid": False, "reason": "Domain does not resolve"}
+    return {"valid": False, "reason": "DNS lookup failed or timed out"}
+
+ # NEW: safer website fetch with browser-like headers
+FETCH_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "en-US,en;q=0.9",
+    "Referer": "https://www.google.com/"
+}
+
+# Stop reading after this many bytes; title/meta/hero text live up top
+FETCH_MAX_BYTES = int(os.getenv("COMPANY_FETCH_MAX_BYTES", "200000"))
+
+def _decode(chunks: list, encoding) -> str:
+    return b"".join(chunks).decode(encoding or "utf-8", errors="replace")
 
- # NEW: safer website fetch with browser-like headers 
 def _safe_fetch(url: str):
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)",
-        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
-        "Accept-Language": "en-US,en;q=0.9",
-        "Referer": "https://www.google.com/"
-    }
+    """
+    Streams the page, stops at FETCH_MAX_BYTES and returns
+    (digest, bytes_downloaded). digest is None when the site blocks us.
+    """
+    chunks, size = [], 0
 
     try:
-        resp = requests.get(
+        with requests.get(
             url,
-            headers=headers,
+            headers=FETCH_HEADERS,
             timeout=12,
             allow_redirects=True,
-        )
+            stream=True,
+        ) as resp:
+            if resp.status_code >= 400:
+                return None, 0
+
+            for chunk in resp.iter_content(chunk_size=16384):
+                chunks.append(chunk)
+                size += len(chunk)
+                if size >= FETCH_MAX_BYTES:
+                    break
 
-        if resp.status_code < 400:
-            return resp.text[:6000]
+            return html_digest(_decode(chunks, resp.encoding)), size
 
     except Exception:
-        return None
+        return None, size
 
-    return None
+async def _asafe_fetch(url: str):
+    chunks, size = [], 0
 
-def verify_company_from_url(url: str) -> dict:
-    # URL validation 
-    if not url.startswith(("http://", "https://")):
-        url = "https://" + url
+    try:
+        async with httpx.AsyncClient(headers=FETCH_HEADERS, timeout=12, follow_redirects=True) as client:
+            async with client.stream("GET", url) as resp:
+                if resp.status_code >= 400:
+                    return None, 0
 
-    parsed = urlparse(url)
-    hostname = parsed.hostname
+                async for chunk in resp.aiter_bytes(chunk_size=16384):
+                    chunks.append(chunk)
+                    size += len(chunk)
+                    if size >= FETCH_MAX_BYTES:
+                        break
 
-    if not hostname:
-        return {"valid": False, "reason": "Invalid URL"}
+                return html_digest(_decode(chunks, resp.charset_encoding)), size
 
-    if not _domain_resolves(hostname):
-        return {"valid": False, "reason": "Domain does not resolve"}
+    except Exception:
+        return None, size
 
-    # Website fetch (with fallback) 
-    page_text = _safe_fetch(url)
+# Helper: normalize URL -> (url, hostname)
+def _parse_url(url: str):
+    # URL validation
+    if not url.startswith(("http://", "https://")):
+        url = "https://" + url
+
+    parsed = urlparse(url)
+    return url, parsed.hostname
 
+def _verification_prompt(hostname: str, page_text) -> str:
     # FALLBACK: still verify even if site blocks us
     if not page_text:
         page_text = f"This website belongs to the company at domain: {hostname}"
 
-    # LLM verification 
-    llm = get_discovery_llm()
-
-    prompt = f"""
+    return f"""
 You are a strict company verification system.
 
-Analyze the website content below and answer:
+Analyze the website digest below (title, meta tags, structured data, visible text) and answer:
 
 1. Is this a REAL operating company?
 2. If yes, extract the OFFICIAL company name.
@@ -81,20 +199,308 @@ Rules:
 - Output ONLY JSON
 """
 
-    resp = llm.invoke([HumanMessage(content=prompt)])
-    raw = resp.content
+PARSE_FAILURE = {"valid": False, "reason": "LLM parse failure"}
 
-    if isinstance(raw, list):
-        raw = "".join(p.get("text", "") for p in raw if isinstance(p, dict))
+def _verify_with_llm(prompt: str) -> dict:
+    llm = get_discovery_llm()
+    result = invoke_json(llm, [HumanMessage(content=prompt)], dict, "discovery.company")
+    return result if result is not None else dict(PARSE_FAILURE)
 
-    raw = str(raw).strip()
+async def _averify_with_llm(prompt: str, site: str = "discovery.company") -> dict:
+    llm = get_discovery_llm()
+    result = await ainvoke_json(llm, [HumanMessage(content=prompt)], dict, site)
+    return result if result is not None else dict(PARSE_FAILURE)
+
+def _log_verification(hostname: str, fetched_bytes: int, prompt: str, started: float):
+    logger.info(
+        "verify %s bytes=%d prompt_tokens=%d seconds=%.2f",
+        hostname, fetched_bytes, count_tokens(prompt), time.perf_counter() - started,
+    )
+
+# LLM parse failures / empty replies are transient; never cache them
+def _is_cacheable(result: dict) -> bool:
+    return bool(result) and result != PARSE_FAILURE
+
+def _verify(url: str, hostname: str) -> dict:
+    started = time.perf_counter()
+
+    with span("company.dns"):
+        resolves = _domain_resolves(hostname)
+
+    if not resolves:
+        # only a definite "no such domain" is worth remembering
+        result = _dns_failure(resolves)
+        _remember(hostname, result, resolves is False)
+        return result
+
+    # Website fetch (with fallback)
+    with span("company.fetch"):
+        page_text, fetched_bytes = _safe_fetch(url)
+
+    # LLM verification
+    prompt = _verification_prompt(hostname, page_text)
+    result = _verify_with_llm(prompt)
+    _log_verification(hostname, fetched_bytes, prompt, started)
+    _remember(hostname, result, _is_cacheable(result))
+    return result
+
+def verify_company_from_url(url: str) -> dict:
+    url, hostname = _parse_url(url)
+
+    if not hostname:
+        return {"valid": False, "reason": "Invalid URL"}
 
-    import json, re
-    match = re.search(r"\{.*\}", raw, re.DOTALL)
+    cached = _cached_result(hostname)
+    if cached is not None:
+        return dict(cached)
+
+    with span("company.verify"):
+        return _verify(url, hostname)
+
+async def _averify(url: str, hostname: str) -> dict:
+    started = time.perf_counter()
+
+    with span("company.dns"):
+        resolves = await _adomain_resolves(hostname)
+
+    if not resolves:
+        # only a definite "no such domain" is worth remembering
+        result = _dns_failure(resolves)
+        _remember(hostname, result, resolves is False)
+        return result
+
+    with span("company.fetch"):
+        page_text, fetched_bytes = await _asafe_fetch(url)
+
+    prompt = _verification_prompt(hostname, page_text)
+    result = await _averify_with_llm(prompt)
+    _log_verification(hostname, fetched_bytes, prompt, started)
+    _remember(hostname, result, _is_cacheable(result))
+    return result
+
+async def averify_company_from_url(url: str) -> dict:
+    url, hostname = _parse_url(url)
+
+    if not hostname:
+        return {"valid": False, "reason": "Invalid URL"}
+
+    cached = _cached_result(hostname)
+    if cached is not None:
+        return dict(cached)
+
+    # concurrent checks of the same domain share one verification
+    key = _cache_key(hostname)
+    return dict(await _inflight.ado(key, lambda: traced("company.verify", _averify(url, hostname))))
+
+# Bulk Verification
+BULK_CONCURRENCY = int(os.getenv("COMPANY_BULK_CONCURRENCY", "32"))
+BULK_BATCH_SIZE = int(os.getenv("COMPANY_BULK_BATCH_SIZE", "8"))
+BULK_LLM_CONCURRENCY = int(os.getenv("COMPANY_BULK_LLM_CONCURRENCY", "4"))
+BULK_BATCH_WAIT = float(os.getenv("COMPANY_BULK_BATCH_WAIT", "0.5"))
+
+def _batch_prompt(batch: list) -> str:
+    sites = "\n\n".join(
+        f"### DOMAIN: {hostname}\n{digest or f'This website belongs to the company at domain: {hostname}'}"
+        for _, hostname, digest in batch
+    )
+
+    return f"""
+You are a strict company verification system.
+
+For EACH website digest below answer:
+
+1. Is this a REAL operating company?
+2. If yes, extract the OFFICIAL company name.
+
+{sites}
+
+Rules:
+- One entry per domain, keyed by the exact domain shown after "DOMAIN:"
+- If NOT a real company → {{ "valid": false, "reason": "<short reason>" }}
+- If real company → {{ "valid": true, "company": "<company name>" }}
+- Always return company names in English
+- Output ONLY JSON
+
+FORMAT:
+{{
+  "example.com": {{ "valid": true, "company": "Example Inc" }},
+  "parked-domain.net": {{ "valid": false, "reason": "Parked domain" }}
+}}
+"""
+
+async def _aclassify_batch(batch: list) -> dict:
+    verdicts = await _averify_with_llm(_batch_prompt(batch), "discovery.company.batch")
+    return {str(k).lower(): v for k, v in verdicts.items()}
+
+async def _aclassify_one(hostname: str, digest) -> dict:
+    return await _averify_with_llm(_verification_prompt(hostname, digest))
+
+async def astream_bulk_verification(urls: list, concurrency: int | None = None, batch_size: int | None = None):
+    """
+    Verifies many URLs, one verdict per domain, yielded as each finishes.
+    DNS lookups share the resolver pool (COMPANY_DNS_CONCURRENCY); page
+    fetches run under `concurrency`; digests that made it
+    through are packed `batch_size` at a time into one LLM call.
+    Ends with a "summary" event carrying throughput.
+
+    Domains are fed through a fixed pool of workers, and the hand-off to
+    the LLM is bounded (a short queue, a few batches in flight), so when
+    classification is the bottleneck fetchers wait instead of piling up
+    digests for the whole list.
+    """
+
+    concurrency = concurrency or BULK_CONCURRENCY
+    batch_size = batch_size or BULK_BATCH_SIZE
+    started = time.perf_counter()
+
+    # one verdict per domain, whatever spelling the list used
+    domains = {}
+    invalid = []
+    for url in urls:
+        normalized, hostname = _parse_url(url.strip())
+        if not hostname:
+            invalid.append(url)
+        else:
+            domains.setdefault(_cache_key(hostname), (url, normalized, hostname))
+
+    out = asyncio.Queue()
+    ready = asyncio.Queue(maxsize=2 * batch_size)
+    fetch_slots = asyncio.Semaphore(concurrency)
+    llm_slots = asyncio.Semaphore(BULK_LLM_CONCURRENCY)
+    # batches formed but not yet classified (each holds its digests)
+    batch_slots = asyncio.Semaphore(2 * BULK_LLM_CONCURRENCY)
+    total = len(domains) + len(invalid)
+    counters = {"done": 0, "cached": 0, "llm_calls": 0, "fallbacks": 0}
+    done_marker = object()
+
+    def emit(url: str, hostname, result: dict, cached: bool = False):
+        counters["done"] += 1
+        counters["cached"] += int(cached)
+        out.put_nowait({
+            "event": "result",
+            "url": url,
+            "domain": hostname,
+            **result,
+            "done": counters["done"],
+            "total": total,
+        })
+
+    async def prepare(url: str, normalized: str, hostname: str):
+        cached = _cached_result(hostname)
+        if cached is not None:
+            emit(url, hostname, dict(cached), cached=True)
+            return
+
+        # DNS has its own limit (the resolver pool); fetch slots only cover fetches
+        resolves = await _adomain_resolves(hostname)
+        if not resolves:
+            result = _dns_failure(resolves)
+            _remember(hostname, result, resolves is False)
+            emit(url, hostname, result)
+            return
+
+        async with fetch_slots:
+            digest, _ = await _asafe_fetch(normalized)
+
+        await ready.put((url, hostname, digest))
+
+    async def classify(batch: list):
+        try:
+            await _classify(batch)
+        finally:
+            batch_slots.release()
+
+    async def _classify(batch: list):
+        async with llm_slots:
+            counters["llm_calls"] += 1
+            try:
+                verdicts = await _aclassify_batch(batch)
+            except Exception:
+                verdicts = {}
+
+        for url, hostname, digest in batch:
+            result = verdicts.get(hostname.lower())
+
+            # dropped or mangled by the batch call: ask for this one alone
+            if not isinstance(result, dict) or "valid" not in result:
+                counters["fallbacks"] += 1
+                try:
+                    async with llm_slots:
+                        counters["llm_calls"] += 1
+                        result = await _aclassify_one(hostname, digest)
+                except Exception as e:
+                    result = {"valid": False, "reason": f"Verification failed: {e}"}
+                    emit(url, hostname, result)
+                    continue
+
+            _remember(hostname, result, _is_cacheable(result))
+            emit(url, hostname, result)
+
+    async def batcher():
+        tasks, batch = [], []
+        while True:
+            try:
+                item = await asyncio.wait_for(ready.get(), timeout=BULK_BATCH_WAIT)
+            except asyncio.TimeoutError:
+                item = None if not batch else "flush"
+
+            if item is done_marker:
+                break
+
+            if item not in (None, "flush"):
+                batch.append(item)
+
+            if batch and (len(batch) >= batch_size or item == "flush"):
+                await batch_slots.acquire()
+                tasks.append(asyncio.create_task(classify(batch)))
+                batch = []
+
+        if batch:
+            await batch_slots.acquire()
+            tasks.append(asyncio.create_task(classify(batch)))
+        await asyncio.gather(*tasks)
+
+    async def run():
+        for url in invalid:
+            emit(url, None, {"valid": False, "reason": "Invalid URL"})
+
+        entries = iter(domains.values())
+
+        async def worker():
+            # shared iterator: each worker takes the next domain when free
+            for entry in entries:
+                await prepare(*entry)
+
+        batch_task = asyncio.create_task(batcher())
+        try:
+            workers = min(len(domains), concurrency + DNS_CONCURRENCY)
+            await asyncio.gather(*[worker() for _ in range(workers)])
+            await ready.put(done_marker)
+            await batch_task
+        finally:
+            batch_task.cancel()
+            out.put_nowait(done_marker)
+
+    runner = asyncio.create_task(run())
 
     try:
-        result = json.loads(match.group(0)) if match else {}
-    except:
-        return {"valid": False, "reason": "LLM parse failure"}
+        while True:
+            event = await out.get()
+            if event is done_marker:
+                break
+            yield event
+
+        await runner
 
-    return result
\ No newline at end of file
+        seconds = time.perf_counter() - started
+        yield {
+            "event": "summary",
+            "domains": total,
+            "cached": counters["cached"],
+            "llm_calls": counters["llm_calls"],
+            "fallbacks": counters["fallbacks"],
+            "seconds": round(seconds, 2),
+            "domains_per_minute": round(total / seconds * 60, 1) if seconds else None,
+        }
+    finally:
+        runner.cancel()
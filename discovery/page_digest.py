@@ -0,0 +1,134 @@
+# discovery/page_digest.py
+"""
+Turns raw homepage HTML into a compact, signal-dense digest
+(title, meta, OpenGraph, JSON-LD organization data, visible text)
+for the company verification prompt.
+"""
+
+import json
+import os
+import re
+from html.parser import HTMLParser
+
+DIGEST_CHARS = int(os.getenv("COMPANY_DIGEST_CHARS", "2000"))
+
+# tags whose text never reaches the reader
+_SKIP_TAGS = {"script", "style", "noscript", "svg", "template", "iframe", "head"}
+_BLOCK_TAGS = {"p", "div", "section", "article", "li", "h1", "h2", "h3", "h4", "h5", "h6", "br", "tr", "footer", "header"}
+_ORG_TYPES = {"organization", "corporation", "localbusiness", "onlinestore", "store", "brand"}
+_ORG_FIELDS = ("name", "legalName", "alternateName", "url", "description", "foundingDate", "sameAs")
+
+class _DigestParser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.title = ""
+        self.meta = {}
+        self.json_ld = []
+        self.text = []
+        self._skip_depth = 0
+        self._in_title = False
+        self._in_json_ld = False
+        self._json_buffer = []
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+
+        if tag == "meta":
+            key = (attrs.get("property") or attrs.get("name") or "").lower()
+            if key in ("description", "og:title", "og:site_name", "og:description", "og:type", "application-name"):
+                self.meta.setdefault(key, (attrs.get("content") or "").strip())
+            return
+
+        if tag == "body":
+            # an unclosed <head> must not swallow the whole page
+            self._skip_depth = 0
+        elif tag == "title":
+            self._in_title = True
+        elif tag == "script" and (attrs.get("type") or "").lower() == "application/ld+json":
+            self._in_json_ld = True
+            self._json_buffer = []
+
+        if tag in _SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag in _BLOCK_TAGS:
+            self.text.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag == "title":
+            self._in_title = False
+        elif tag == "script" and self._in_json_ld:
+            self._in_json_ld = False
+            self.json_ld.append("".join(self._json_buffer))
+
+        if tag in _SKIP_TAGS and self._skip_depth:
+            self._skip_depth -= 1
+
+    def handle_data(self, data):
+        if self._in_title:
+            self.title += data
+        elif self._in_json_ld:
+            self._json_buffer.append(data)
+        elif not self._skip_depth:
+            self.text.append(data)
+
+# Helper: pull Organization-like nodes out of JSON-LD blobs
+def _organizations(blobs: list) -> list:
+    found = []
+
+    def walk(node):
+        if isinstance(node, list):
+            for item in node:
+                walk(item)
+        elif isinstance(node, dict):
+            types = node.get("@type", [])
+            types = types if isinstance(types, list) else [types]
+            if any(str(t).lower() in _ORG_TYPES for t in types):
+                found.append({k: node[k] for k in _ORG_FIELDS if node.get(k)})
+            for key in ("@graph", "publisher", "brand", "parentOrganization"):
+                if key in node:
+                    walk(node[key])
+
+    for blob in blobs:
+        try:
+            walk(json.loads(blob))
+        except ValueError:
+            continue
+
+    return [org for org in found if org]
+
+def html_digest(html: str, max_chars: int = DIGEST_CHARS) -> str:
+    parser = _DigestParser()
+    try:
+        parser.feed(html)
+        parser.close()
+    except Exception:
+        # truncated pages can end mid-tag; keep whatever was parsed
+        pass
+
+    lines = []
+    title = " ".join(parser.title.split())
+    if title:
+        lines.append(f"Title: {title}")
+
+    labels = {
+        "og:site_name": "Site name",
+        "application-name": "Application name",
+        "og:title": "OpenGraph title",
+        "description": "Meta description",
+        "og:description": "OpenGraph description",
+        "og:type": "OpenGraph type",
+    }
+    for key, label in labels.items():
+        value = " ".join(parser.meta.get(key, "").split())
+        if value:
+            lines.append(f"{label}: {value}")
+
+    for org in _organizations(parser.json_ld)[:2]:
+        lines.append(f"Organization (JSON-LD): {json.dumps(org, ensure_ascii=False)}")
+
+    body = re.sub(r"[ \t\r\f\v]+", " ", "".join(parser.text))
+    body = "\n".join(line.strip() for line in body.split("\n") if len(line.strip()) > 2)
+    if body:
+        lines.append("Visible text:\n" + body)
+
+    return "\n".join(lines)[:max_chars]
@@ -1,16 +1,12 @@
 # discovery/personas.py
-from typing import List
+from typing import Dict, List
 from langchain_core.messages import HumanMessage
 from llm.llm_factory import get_discovery_llm
-import json, re
+from llm.response_utils import ainvoke_json, invoke_json
+from discovery.batching import abatch_generate, astream_batch_generate, numbered
 
-def generate_personas(company: str, category: str, num: int = 6) -> List[str]:
-    """
-    Returns high-level analytical personas (roles only).
-    No names, no descriptions.
-    """
-
-    prompt = f"""
+def _personas_prompt(company: str, category: str, num: int) -> str:
+    return f"""
 Generate {num} DISTINCT and DOMAIN-SPECIFIC professional roles
 that would analyze, influence, or make strategic decisions
 in the following context:
@@ -28,12 +24,78 @@ Rules:
 - Output ONLY a JSON list
 """
 
+def generate_personas(company: str, category: str, num: int = 6) -> List[str]:
+    """
+    Returns high-level analytical personas (roles only).
+    No names, no descriptions.
+    """
+
     llm = get_discovery_llm()  
-    resp = llm.invoke([HumanMessage(content=prompt)])
+    messages = [HumanMessage(content=_personas_prompt(company, category, num))]
+    return invoke_json(llm, messages, list, "discovery.personas", default=[])
+
+async def agenerate_personas(company: str, category: str, num: int = 6) -> List[str]:
+    llm = get_discovery_llm()
+    messages = [HumanMessage(content=_personas_prompt(company, category, num))]
+    return await ainvoke_json(llm, messages, list, "discovery.personas", default=[])
+
+def _personas_batch_prompt(company: str, categories: List[str], num: int) -> str:
+    return f"""
+For EACH numbered category below, generate {num} DISTINCT and DOMAIN-SPECIFIC
+professional roles that would analyze, influence, or make strategic decisions
+for that category at the company.
+
+Company: {company}
+
+Categories:
+{numbered(categories)}
 
-    raw = resp.content
-    if isinstance(raw, list):
-        raw = "".join(p.get("text", "") for p in raw if isinstance(p, dict))
+Rules:
+- Roles only (2–4 words each)
+- NO generic corporate roles unless highly relevant
+- NO repetition across domains
+- Focus on specialized, realistic industry roles
+- Avoid overused titles like "Product Manager" unless critical
+- No names, no explanations
+- Output ONLY a JSON object mapping EVERY category number to its list of roles
+
+FORMAT:
+{{"1": ["Role", "Role"], "2": ["Role", "Role"]}}
+"""
+
+async def agenerate_personas_batch(
+    company: str,
+    categories: List[str],
+    num: int = 6,
+    batch_size: int | None = None,
+) -> Dict[str, List[str]]:
+    """
+    Personas for many categories, `batch_size` categories per LLM call.
+    """
+
+    return await abatch_generate(
+        categories,
+        lambda keys: _personas_batch_prompt(company, keys, num),
+        lambda category: agenerate_personas(company, category, num),
+        batch_size,
+    )
+
+def astream_personas_batch(
+    company: str,
+    categories: List[str],
+    num: int = 6,
+    batch_size: int | None = None,
+    limit=None,
+):
+    """
+    Like agenerate_personas_batch, but yields (category, personas, error) as each
+    category resolves; `limit` wraps every LLM call.
+    """
 
-    match = re.search(r"\[.*\]", str(raw), re.DOTALL)
-    return json.loads(match.group(0)) if match else []
\ No newline at end of file
+    return astream_batch_generate(
+        categories,
+        lambda keys: _personas_batch_prompt(company, keys, num),
+        lambda category: agenerate_personas(company, category, num),
+        batch_size,
+        limit,
+    )
@@ -1,18 +1,28 @@
-import json, re
 from langchain_core.messages import HumanMessage
 from llm.llm_factory import get_discovery_llm
-from llm.response_utils import extract_text
+from llm.response_utils import ainvoke_json, astream_json_items, invoke_json
 
-def extract_products(company: str):
-    llm = get_discovery_llm()
-
-    prompt = f"""
+def _products_prompt(company: str) -> str:
+    return f"""
 Identify real product categories for company "{company}".
 Return ONLY a JSON list.
 """
 
-    resp = llm.invoke([HumanMessage(content=prompt)])
-    text = extract_text(resp)
+def extract_products(company: str):
+    llm = get_discovery_llm()
+    messages = [HumanMessage(content=_products_prompt(company))]
+    return invoke_json(llm, messages, list, "discovery.products", default=[])
+
+async def aextract_products(company: str):
+    llm = get_discovery_llm()
+    messages = [HumanMessage(content=_products_prompt(company))]
+    return await ainvoke_json(llm, messages, list, "discovery.products", default=[])
 
-    match = re.search(r"\[.*\]", text, re.DOTALL)
-    return json.loads(match.group(0)) if match else []
\ No newline at end of file
+async def astream_products(company: str):
+    """
+    Yields product categories as the model names them.
+    """
+    llm = get_discovery_llm()
+    messages = [HumanMessage(content=_products_prompt(company))]
+    async for item in astream_json_items(llm, messages, "discovery.products"):
+        yield item
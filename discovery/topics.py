@@ -1,17 +1,12 @@
 # discovery/topics.py
-from typing import List
+from typing import Dict, List, Tuple
 from langchain_core.messages import HumanMessage
 from llm.llm_factory import get_discovery_llm
-import json
-import re
+from llm.response_utils import ainvoke_json, invoke_json
+from discovery.batching import abatch_generate, astream_batch_generate, numbered
 
-def generate_topics(company: str, prompt: str, persona: str, num: int = 6) -> List[str]:
-    """
-    Generates HIGH-LEVEL discovery topics.
-    These are dashboard-style themes, NOT analysis questions.
-    """
-
-    prompt = f"""
+def _topics_prompt(company: str, prompt: str, persona: str, num: int) -> str:
+    return f"""
 Generate exactly {num} high-level topic labels
 related to the following domain.
 
@@ -29,12 +24,79 @@ Rules:
 - Output ONLY a JSON list
 """
 
+def generate_topics(company: str, prompt: str, persona: str, num: int = 6) -> List[str]:
+    """
+    Generates HIGH-LEVEL discovery topics.
+    These are dashboard-style themes, NOT analysis questions.
+    """
+
     llm = get_discovery_llm() 
-    resp = llm.invoke([HumanMessage(content=prompt)])
+    messages = [HumanMessage(content=_topics_prompt(company, prompt, persona, num))]
+    return invoke_json(llm, messages, list, "discovery.topics", default=[])
+
+async def agenerate_topics(company: str, prompt: str, persona: str, num: int = 6) -> List[str]:
+    llm = get_discovery_llm()
+    messages = [HumanMessage(content=_topics_prompt(company, prompt, persona, num))]
+    return await ainvoke_json(llm, messages, list, "discovery.topics", default=[])
+
+def _topics_batch_prompt(company: str, pairs: List[Tuple[str, str]], num: int) -> str:
+    labels = [f"Prompt: {prompt} | persona: {persona}" for prompt, persona in pairs]
+
+    return f"""
+For EACH numbered entry below, generate exactly {num} high-level topic labels
+related to that domain.
+
+Company: {company}
 
-    raw = resp.content
-    if isinstance(raw, list):
-        raw = "".join(p.get("text", "") for p in raw if isinstance(p, dict))
+Entries:
+{numbered(labels)}
+
+Rules:
+- Topics must be SHORT (3–8 words)
+- NO analysis words (no analyze, assess, evaluate, compare)
+- NO questions
+- NO long sentences
+- NO brand names inside topics
+- Think: dashboard / report section titles
+- Output ONLY a JSON object mapping EVERY entry number to its list of topics
+
+FORMAT:
+{{"1": ["Topic", "Topic"], "2": ["Topic", "Topic"]}}
+"""
+
+async def agenerate_topics_batch(
+    company: str,
+    pairs: List[Tuple[str, str]],
+    num: int = 6,
+    batch_size: int | None = None,
+) -> Dict[Tuple[str, str], List[str]]:
+    """
+    Topics for many (prompt, persona) pairs, `batch_size` pairs per LLM call.
+    """
+
+    return await abatch_generate(
+        [tuple(p) for p in pairs],
+        lambda keys: _topics_batch_prompt(company, keys, num),
+        lambda pair: agenerate_topics(company, pair[0], pair[1], num),
+        batch_size,
+    )
+
+def astream_topics_batch(
+    company: str,
+    pairs: List[Tuple[str, str]],
+    num: int = 6,
+    batch_size: int | None = None,
+    limit=None,
+):
+    """
+    Like agenerate_topics_batch, but yields (pair, topics, error) as each
+    (product, persona) pair resolves; `limit` wraps every LLM call.
+    """
 
-    match = re.search(r"\[.*\]", str(raw), re.DOTALL)
-    return json.loads(match.group(0)) if match else []
\ No newline at end of file
+    return astream_batch_generate(
+        [tuple(p) for p in pairs],
+        lambda keys: _topics_batch_prompt(company, keys, num),
+        lambda pair: agenerate_topics(company, pair[0], pair[1], num),
+        batch_size,
+        limit,
+    )
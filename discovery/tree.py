@@ -0,0 +1,146 @@
+# discovery/tree.py
+"""
+Builds the whole discovery tree (products -> personas -> topics)
+server-side, expanding each level concurrently.
+"""
+
+import asyncio
+import os
+import time
+from typing import AsyncIterator, Dict
+from discovery.products import astream_products
+from discovery.personas import agenerate_personas, astream_personas_batch
+from discovery.topics import agenerate_topics, astream_topics_batch
+from llm.telemetry import record_stage
+
+DEFAULT_FANOUT = int(os.getenv("DISCOVERY_FANOUT", "8"))
+
+# Helper: products may come back as strings or {"name": ...} objects
+def _label(item) -> str:
+    if isinstance(item, dict):
+        return str(item.get("name") or item.get("category") or next(iter(item.values()), ""))
+    return str(item)
+
+async def astream_discovery_tree(
+    company: str,
+    fanout: int | None = None,
+    num_personas: int = 6,
+    num_topics: int = 6,
+    batch_size: int | None = None,
+) -> AsyncIterator[Dict]:
+    """
+    With `batch_size`, each level is generated with multi-key prompts
+    (batch_size keys per call) instead of one call per branch; results
+    stream per branch as each batch resolves, and batches (and their
+    retries) share the `fanout` bound.
+
+    Products are streamed: each product's branch starts as soon as the
+    model names it, so its personas may arrive before the full list.
+
+    Events:
+      product  -> one product, as soon as it is parsed
+      products -> the product list
+      personas -> one per product
+      topics   -> one per product x persona
+      error    -> a branch that failed (the rest of the tree continues)
+      tree     -> the assembled tree
+    """
+
+    # slots are held only around each LLM call, never across a level,
+    # so parents waiting on children cannot starve the pool
+    slots = asyncio.Semaphore(fanout or DEFAULT_FANOUT)
+    out = asyncio.Queue()
+    done_marker = object()
+
+    async def limited(coro):
+        async with slots:
+            return await coro
+
+    async def expand_persona(product: str, node: Dict):
+        try:
+            node["topics"] = await limited(agenerate_topics(company, product, node["persona"], num_topics))
+            out.put_nowait({"event": "topics", "product": product, "persona": node["persona"], "topics": node["topics"]})
+        except Exception as e:
+            out.put_nowait({"event": "error", "product": product, "persona": node["persona"], "error": str(e)})
+
+    async def expand_product(node: Dict):
+        product = node["product"]
+        try:
+            personas = await limited(agenerate_personas(company, product, num_personas))
+        except Exception as e:
+            out.put_nowait({"event": "error", "product": product, "persona": None, "error": str(e)})
+            return
+
+        node["personas"] = [{"persona": _label(p), "topics": []} for p in personas]
+        out.put_nowait({"event": "personas", "product": product, "personas": [p["persona"] for p in node["personas"]]})
+
+        await asyncio.gather(*[expand_persona(product, p) for p in node["personas"]])
+
+    async def expand_batched():
+        # duplicate labels share one result
+        nodes = {}
+        for node in tree["products"]:
+            nodes.setdefault(node["product"], []).append(node)
+
+        personas = astream_personas_batch(company, list(nodes), num_personas, batch_size, limited)
+        async for product, items, error in personas:
+            if error is not None:
+                out.put_nowait({"event": "error", "product": product, "persona": None, "error": str(error)})
+                continue
+            for node in nodes[product]:
+                node["personas"] = [{"persona": _label(p), "topics": []} for p in items]
+            out.put_nowait({"event": "personas", "product": product, "personas": [_label(p) for p in items]})
+
+        by_pair = {}
+        for label, same in nodes.items():
+            for node in same:
+                for p in node["personas"]:
+                    by_pair.setdefault((label, p["persona"]), []).append(p)
+
+        topics = astream_topics_batch(company, list(by_pair), num_topics, batch_size, limited)
+        async for (product, persona), items, error in topics:
+            if error is not None:
+                out.put_nowait({"event": "error", "product": product, "persona": persona, "error": str(error)})
+                continue
+            for p in by_pair[(product, persona)]:
+                p["topics"] = items
+            out.put_nowait({"event": "topics", "product": product, "persona": persona, "topics": items})
+
+    tree = {"company": company, "products": []}
+
+    async def run():
+        branches = []
+        try:
+            async for item in astream_products(company):
+                node = {"product": _label(item), "personas": []}
+                tree["products"].append(node)
+                out.put_nowait({"event": "product", "product": node["product"]})
+                if not batch_size:
+                    branches.append(asyncio.create_task(expand_product(node)))
+
+            out.put_nowait({"event": "products", "products": [p["product"] for p in tree["products"]]})
+
+            if batch_size:
+                await expand_batched()
+            else:
+                await asyncio.gather(*branches)
+        finally:
+            for branch in branches:
+                branch.cancel()
+            out.put_nowait(done_marker)
+
+    started = time.perf_counter()
+    runner = asyncio.create_task(run())
+
+    try:
+        while True:
+            event = await out.get()
+            if event is done_marker:
+                break
+            yield event
+
+        await runner
+        record_stage("discovery.tree", time.perf_counter() - started)
+        yield {"event": "tree", "tree": tree}
+    finally:
+        runner.cancel()
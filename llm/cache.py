@@ -0,0 +1,359 @@
+# llm/cache.py
+import asyncio
+import contextvars
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from llm.singleflight import SingleFlight
+
+# Cache Settings (env driven)
+CACHE_ENABLED = os.getenv("LLM_CACHE", "1") != "0"
+CACHE_PATH = os.getenv("LLM_CACHE_PATH", ".cache/llm_cache.sqlite3")
+MEMORY_SIZE = int(os.getenv("LLM_CACHE_MEMORY_SIZE", "1024"))
+
+# Seconds a disk entry stays fresh (override with LLM_CACHE_TTL_<PROVIDER>)
+DEFAULT_TTLS = {
+    "openai": 24 * 3600,
+    "gemini": 24 * 3600,
+    "perplexity": 3600,  # web-backed answers go stale faster
+}
+
+# "use" = read + write, "refresh" = skip read but write, "bypass" = neither
+CACHE_MODES = ("use", "refresh", "bypass")
+_cache_mode = contextvars.ContextVar("llm_cache_mode", default="use")
+
+# in-flight provider calls, keyed like the cache
+_flights = SingleFlight()
+
+@contextmanager
+def cache_mode(mode: str | None):
+    """
+    Scopes the cache behaviour for every LLM call made inside the block.
+    """
+    mode = mode or "use"
+    if mode not in CACHE_MODES:
+        raise ValueError(f"Unsupported cache mode: {mode}")
+
+    token = _cache_mode.set(mode)
+    try:
+        yield
+    finally:
+        _cache_mode.reset(token)
+
+def current_cache_mode() -> str:
+    return _cache_mode.get()
+
+def get_ttl(provider: str) -> int:
+    value = os.getenv(f"LLM_CACHE_TTL_{provider.upper()}")
+    if value:
+        return int(value)
+    return DEFAULT_TTLS.get(provider, 3600)
+
+# Helper: normalize prompt/messages into a stable form
+def _normalize(prompt) -> list:
+    if isinstance(prompt, list):
+        items = prompt
+    else:
+        items = [prompt]
+
+    normalized = []
+    for item in items:
+        role = getattr(item, "type", "human")
+        content = getattr(item, "content", item)
+        if not isinstance(content, str):
+            content = json.dumps(content, sort_keys=True, default=str)
+        normalized.append([role, " ".join(content.split())])
+
+    return normalized
+
+def cache_key(provider: str, model, temperature, max_tokens, prompt) -> str:
+    identity = {
+        "provider": provider,
+        "model": model,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "messages": _normalize(prompt),
+    }
+    raw = json.dumps(identity, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+# Memory Tier (LRU)
+class MemoryLRU:
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+
+            content, expires_at = entry
+            if expires_at < time.time():
+                del self._data[key]
+                return None
+
+            self._data.move_to_end(key)
+            return content
+
+    def set(self, key: str, content, expires_at: float):
+        if self.max_size <= 0:
+            return
+
+        with self._lock:
+            self._data[key] = (content, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+# Disk Tier (SQLite)
+class _SQLiteStore:
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            folder = os.path.dirname(self.path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, provider TEXT, content TEXT, "
+                "created_at REAL, expires_at REAL)"
+            )
+        return self._conn
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT content, expires_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+
+        if not row or row[1] < time.time():
+            return None
+
+        return json.loads(row[0]), row[1]
+
+    def set(self, key: str, provider: str, content, expires_at: float):
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?, ?)",
+                (key, provider, json.dumps(content), time.time(), expires_at),
+            )
+            conn.commit()
+
+    def purge_expired(self):
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM llm_cache WHERE expires_at < ?", (time.time(),))
+            conn.commit()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+class ResponseCache:
+    """
+    Two-tier (memory LRU -> SQLite) store for LLM response content.
+    """
+
+    def __init__(self, path: str = CACHE_PATH, memory_size: int = MEMORY_SIZE):
+        self.memory = MemoryLRU(memory_size)
+        self.disk = _SQLiteStore(path) if path else None
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0, "bypassed": 0}
+
+    def _count(self, name: str):
+        with self._lock:
+            self.stats[name] += 1
+
+    def get(self, key: str):
+        content = self.memory.get(key)
+        if content is not None:
+            self._count("hits")
+            self._count("memory_hits")
+            return content
+
+        if self.disk is not None:
+            entry = self.disk.get(key)
+            if entry is not None:
+                content, expires_at = entry
+                self.memory.set(key, content, expires_at)
+                self._count("hits")
+                self._count("disk_hits")
+                return content
+
+        self._count("misses")
+        return None
+
+    def set(self, key: str, provider: str, content):
+        expires_at = time.time() + get_ttl(provider)
+        self.memory.set(key, content, expires_at)
+        if self.disk is not None:
+            self.disk.set(key, provider, content, expires_at)
+        self._count("writes")
+
+    async def aget(self, key: str):
+        # memory hits stay on the loop; only SQLite goes to a thread
+        content = self.memory.get(key)
+        if content is not None:
+            self._count("hits")
+            self._count("memory_hits")
+            return content
+        return await asyncio.to_thread(self.get, key)
+
+    async def aset(self, key: str, provider: str, content):
+        await asyncio.to_thread(self.set, key, provider, content)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        return stats
+
+    def clear(self):
+        self.memory.clear()
+        with self._lock:
+            for name in self.stats:
+                self.stats[name] = 0
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache() -> ResponseCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+        return _cache
+
+def cache_stats() -> dict:
+    return {**get_cache().snapshot(), "coalescing": _flights.snapshot()}
+
+def close_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is not None:
+            _cache.close()
+            _cache = None
+
+# Cached Response (LangChain-style)
+class CachedResponse:
+    def __init__(self, content):
+        self.content = content
+        self.cached = True
+
+# Caching Wrapper
+class CachedLLM:
+    """
+    Wraps a provider client; invoke() is served from cache when possible
+    and identical concurrent misses are coalesced into one call.
+    Every other attribute is forwarded to the wrapped client.
+    """
+
+    def __init__(self, client, provider: str, params: dict):
+        self.client = client
+        self.provider = provider
+        self.model = params.get("deployment_name") or params.get("model")
+        self.temperature = params.get("temperature")
+        self.max_tokens = params.get("max_tokens") or params.get("max_output_tokens")
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def key_for(self, prompt) -> str:
+        return cache_key(self.provider, self.model, self.temperature, self.max_tokens, prompt)
+
+    def _bypass(self) -> bool:
+        if _cache_mode.get() == "bypass":
+            if CACHE_ENABLED:
+                get_cache()._count("bypassed")
+            return True
+        return False
+
+    def _fetch(self, key: str, prompt, *args, **kwargs):
+        resp = self.client.invoke(prompt, *args, **kwargs)
+        content = getattr(resp, "content", None)
+        if CACHE_ENABLED and content:
+            get_cache().set(key, self.provider, content)
+        return resp
+
+    async def _afetch(self, key: str, prompt, *args, **kwargs):
+        resp = await self.client.ainvoke(prompt, *args, **kwargs)
+        content = getattr(resp, "content", None)
+        if CACHE_ENABLED and content:
+            await get_cache().aset(key, self.provider, content)
+        return resp
+
+    def invoke(self, prompt, *args, **kwargs):
+        if self._bypass():
+            return self.client.invoke(prompt, *args, **kwargs)
+
+        key = self.key_for(prompt)
+        if CACHE_ENABLED and _cache_mode.get() == "use":
+            content = get_cache().get(key)
+            if content is not None:
+                return CachedResponse(content)
+
+        # identical concurrent misses share one provider call
+        return _flights.do(key, lambda: self._fetch(key, prompt, *args, **kwargs))
+
+    async def ainvoke(self, prompt, *args, **kwargs):
+        if self._bypass():
+            return await self.client.ainvoke(prompt, *args, **kwargs)
+
+        key = self.key_for(prompt)
+        if CACHE_ENABLED and _cache_mode.get() == "use":
+            content = await get_cache().aget(key)
+            if content is not None:
+                return CachedResponse(content)
+
+        return await _flights.ado(key, lambda: self._afetch(key, prompt, *args, **kwargs))
+
+    async def astream(self, prompt, *args, **kwargs):
+        """
+        Streams from the provider (a cached reply arrives as one chunk)
+        and caches the assembled text. Streams are never coalesced.
+        """
+        key = None
+        if not self._bypass():
+            key = self.key_for(prompt)
+            if CACHE_ENABLED and _cache_mode.get() == "use":
+                content = await get_cache().aget(key)
+                if content is not None:
+                    yield CachedResponse(content)
+                    return
+
+        parts = []
+        async for chunk in self.client.astream(prompt, *args, **kwargs):
+            content = getattr(chunk, "content", None)
+            if isinstance(content, str):
+                parts.append(content)
+            yield chunk
+
+        content = "".join(parts)
+        if key and CACHE_ENABLED and content:
+            await get_cache().aset(key, self.provider, content)
@@ -0,0 +1,258 @@
+# llm/hedging.py
+"""
+Call policies: an ordered provider fallback chain plus a hedge delay.
+
+If the primary has not answered after the hedge delay (fixed seconds or
+the observed p95/p99), a duplicate is fired at the next provider in the
+chain (or the same provider when there is no fallback). The first success
+wins and the other attempt is cancelled. Errors fail over down the chain.
+
+Hedging is off unless enabled per policy (LLM_HEDGE_<NAME>=p95|p99|<seconds>):
+a p95 hedge adds ~5% duplicate calls. A quantile hedge waits for
+LLM_HEDGE_MIN_SAMPLES observed calls unless LLM_HEDGE_DEFAULT_DELAY is set.
+Latencies are recorded below the rate limiter (InstrumentedLLM), so queue
+time never inflates the hedge delay.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+from collections import defaultdict, deque
+
+logger = logging.getLogger(__name__)
+
+# delay for a quantile hedge before enough samples exist (None = no hedge yet)
+DEFAULT_HEDGE_DELAY = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY")) if os.getenv("LLM_HEDGE_DEFAULT_DELAY") else None
+MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+WINDOW = int(os.getenv("LLM_LATENCY_WINDOW", "500"))
+
+# Observed latencies (rolling window per provider)
+class LatencyTracker:
+    def __init__(self, window: int = WINDOW):
+        self._samples = defaultdict(lambda: deque(maxlen=window))
+        self._lock = threading.Lock()
+
+    def record(self, provider: str, seconds: float):
+        with self._lock:
+            self._samples[provider].append(seconds)
+
+    def quantile(self, provider: str, q: float):
+        with self._lock:
+            samples = sorted(self._samples.get(provider, ()))
+        if len(samples) < MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            providers = list(self._samples)
+        return {
+            p: {"p50": self.quantile(p, 0.5), "p95": self.quantile(p, 0.95), "p99": self.quantile(p, 0.99)}
+            for p in providers
+        }
+
+latencies = LatencyTracker()
+
+class CallPolicy:
+    """
+    chain: providers tried after the requested one, in order
+    hedge: None (off), seconds, or "p95" / "p99" of the primary's latency
+    """
+
+    def __init__(self, name: str, chain=None, hedge=None):
+        self.name = name
+        self.chain = list(chain or [])
+        self.hedge = hedge
+
+    def providers(self, primary: str) -> list:
+        return [primary] + [p for p in self.chain if p != primary]
+
+    def hedge_delay(self, primary: str):
+        if self.hedge is None:
+            return None
+        if isinstance(self.hedge, str):
+            observed = latencies.quantile(primary, int(self.hedge[1:]) / 100)
+            return observed if observed is not None else DEFAULT_HEDGE_DELAY
+        return float(self.hedge)
+
+def _parse_hedge(value: str):
+    value = value.strip().lower()
+    if value in ("", "off", "none", "0"):
+        return None
+    if value in ("p95", "p99"):
+        return value
+    return float(value)
+
+# Per-call-type defaults; override with LLM_FALLBACK_<NAME> / LLM_HEDGE_<NAME>
+DEFAULT_POLICIES = {
+    "answer": {"chain": "", "hedge": "off"},  # never fail over: the provider is what is being measured
+    "evaluation": {"chain": "", "hedge": "off"},
+    "discovery": {"chain": "", "hedge": "off"},
+}
+
+_policies = {}
+_policies_lock = threading.Lock()
+
+def get_policy(name: str) -> CallPolicy:
+    with _policies_lock:
+        if name not in _policies:
+            defaults = DEFAULT_POLICIES.get(name, {"chain": "", "hedge": "off"})
+            key = name.upper()
+            chain = os.getenv(f"LLM_FALLBACK_{key}", defaults["chain"])
+            hedge = os.getenv(f"LLM_HEDGE_{key}", defaults["hedge"])
+            _policies[name] = CallPolicy(
+                name,
+                [p.strip().lower() for p in chain.split(",") if p.strip()],
+                _parse_hedge(hedge),
+            )
+        return _policies[name]
+
+def register_policy(policy: CallPolicy):
+    with _policies_lock:
+        _policies[policy.name] = policy
+
+# Hedge / failover counters per policy
+class PolicyStats:
+    def __init__(self):
+        self._counts = defaultdict(lambda: defaultdict(int))
+        self._lock = threading.Lock()
+
+    def count(self, policy: str, field: str):
+        with self._lock:
+            self._counts[policy][field] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            out = {}
+            for policy, counts in self._counts.items():
+                calls = counts.get("calls", 0) or 1
+                out[policy] = {
+                    **counts,
+                    "hedge_rate": round(counts.get("hedged", 0) / calls, 4),
+                    "failover_rate": round(counts.get("failovers", 0) / calls, 4),
+                }
+            return out
+
+policy_stats = PolicyStats()
+
+def hedging_stats() -> dict:
+    return {
+        "policies": policy_stats.snapshot(),
+        "latency": latencies.snapshot(),
+    }
+
+class HedgedLLM:
+    """
+    Races the providers of a policy. `clients` is [(provider, client)],
+    primary first. Attributes are forwarded to the primary client.
+    """
+
+    def __init__(self, policy: CallPolicy, clients: list):
+        self.policy = policy
+        self.clients = clients
+
+    def __getattr__(self, name):
+        return getattr(self.clients[0][1], name)
+
+    async def ainvoke(self, prompt, *args, **kwargs):
+        name = self.policy.name
+        primary = self.clients[0][0]
+        policy_stats.count(name, "calls")
+
+        # hedge target: next provider in the chain, else a duplicate on the primary
+        queue = list(self.clients)
+        hedge_pending = self.policy.hedge_delay(primary) is not None
+        tasks = {}
+        hedge = None
+        last_error = None
+
+        def launch():
+            provider, client = queue.pop(0)
+            task = asyncio.ensure_future(client.ainvoke(prompt, *args, **kwargs))
+            tasks[task] = provider
+            return task
+
+        launch()
+        try:
+            while tasks:
+                timeout = self.policy.hedge_delay(primary) if hedge_pending else None
+                done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    # primary is slow: fire the hedge once
+                    hedge_pending = False
+                    policy_stats.count(name, "hedged")
+                    if not queue:
+                        queue.append(self.clients[0])
+                    hedge = launch()
+                    continue
+
+                for task in done:
+                    provider = tasks.pop(task)
+                    if task.exception() is None:
+                        if task is hedge:
+                            policy_stats.count(name, "hedge_wins")
+                        if provider != primary:
+                            policy_stats.count(name, "fallback_wins")
+                        return task.result()
+
+                    last_error = task.exception()
+                    logger.warning("LLM %s via %s failed: %s", name, provider, last_error)
+
+                if not tasks and queue:
+                    policy_stats.count(name, "failovers")
+                    launch()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        policy_stats.count(name, "failures")
+        raise last_error
+
+    def invoke(self, prompt, *args, **kwargs):
+        """
+        Blocking path: failover only (no hedging).
+        """
+        name = self.policy.name
+        policy_stats.count(name, "calls")
+        last_error = None
+
+        for i, (provider, client) in enumerate(self.clients):
+            if i:
+                policy_stats.count(name, "failovers")
+            try:
+                return client.invoke(prompt, *args, **kwargs)
+            except Exception as e:
+                last_error = e
+                logger.warning("LLM %s via %s failed: %s", name, provider, e)
+
+        policy_stats.count(name, "failures")
+        raise last_error
+
+    async def astream(self, prompt, *args, **kwargs):
+        """
+        Streams from the first provider that starts; fails over only
+        before the first chunk (no hedging of streams).
+        """
+        name = self.policy.name
+        policy_stats.count(name, "calls")
+        last_error = None
+
+        for i, (provider, client) in enumerate(self.clients):
+            if i:
+                policy_stats.count(name, "failovers")
+            started = False
+            try:
+                async for chunk in client.astream(prompt, *args, **kwargs):
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                if started:
+                    raise
+                last_error = e
+                logger.warning("LLM %s via %s failed: %s", name, provider, e)
+
+        policy_stats.count(name, "failures")
+        raise last_error
@@ -1,18 +1,138 @@
 # llm/llm_factory.py
 import os
+import json
+import asyncio
+import logging
+import threading
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_openai import AzureChatOpenAI
+from llm.cache import CachedLLM, cache_stats, close_cache
+from llm.hedging import CallPolicy, HedgedLLM, get_policy, hedging_stats
+from llm.response_utils import parse_failure_counts
+from llm.telemetry import InstrumentedLLM, registry
+from llm.replay import ReplayLLM, split_provider
+from llm.rate_limit import LimitedLLM, ProviderHTTPError, ProviderLimiter, build_limiter, parse_retry_after
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Per-provider parallelism (override with LLM_CONCURRENCY_<PROVIDER>)
+DEFAULT_CONCURRENCY = {
+    "openai": 8,
+    "gemini": 4,
+    "perplexity": 2,
+}
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def get_concurrency(provider: str) -> int:
+    provider = (provider or "openai").lower()
+    value = os.getenv(f"LLM_CONCURRENCY_{provider.upper()}")
+    if value:
+        return max(1, int(value))
+    return DEFAULT_CONCURRENCY.get(provider, 4)
+
+def get_limiter(provider: str) -> ProviderLimiter:
+    """
+    Process-wide limiter for one provider (RPM/TPM buckets + adaptive
+    concurrency). Shared by every client of that provider; under
+    serve.py --workers it enforces this worker's share of the budget.
+    """
+    provider = (provider or "openai").lower()
+    with _limiters_lock:
+        if provider not in _limiters:
+            _limiters[provider] = build_limiter(provider, get_concurrency(provider))
+        return _limiters[provider]
+
+def limiter_stats() -> dict:
+    """
+    Current limits and queue depth per provider.
+    """
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {provider: limiter.snapshot() for provider, limiter in limiters.items()}
+
+# Metrics: discovery provider selection + scrape-time views of limiter/cache state
+discovery_requests = registry.counter("llm_discovery_requests_total", "Discovery LLM lookups", ("provider",))
+
+@registry.collector
+def _limiter_metrics():
+    stats = limiter_stats()
+    fields = [
+        ("llm_concurrency_limit", "gauge", "Current AIMD concurrency window", "concurrency_limit"),
+        ("llm_in_flight", "gauge", "Provider calls in flight", "in_flight"),
+        ("llm_queue_depth", "gauge", "Calls waiting for the limiter", "queued"),
+        ("llm_throttled_total", "counter", "429/503 responses", "throttled"),
+        ("llm_retries_total", "counter", "Throttled calls retried", "retries"),
+    ]
+    return [
+        (name, kind, help, [({"provider": p}, s[field]) for p, s in stats.items()])
+        for name, kind, help, field in fields
+    ]
+
+@registry.collector
+def _cache_metrics():
+    stats = cache_stats()
+    return [
+        ("llm_cache_events_total", "counter", "Response cache events", [
+            ({"event": event}, stats.get(event))
+            for event in ("memory_hits", "disk_hits", "misses", "writes", "bypassed")
+        ]),
+        ("llm_coalesced_total", "counter", "Calls served by an in-flight duplicate", [
+            ({}, stats["coalescing"]["coalesced"]),
+        ]),
+    ]
+
+@registry.collector
+def _policy_metrics():
+    policies = hedging_stats()["policies"]
+    return [
+        (f"llm_policy_{field}_total", "counter", f"Policy {field}", [
+            ({"policy": name}, counts.get(field, 0)) for name, counts in policies.items()
+        ])
+        for field in ("calls", "hedged", "hedge_wins", "failovers", "fallback_wins", "failures")
+    ]
+
+@registry.collector
+def _parse_failure_metrics():
+    return [
+        ("llm_parse_failures_total", "counter", "LLM output JSON parse failures", [
+            ({"site": site}, count) for site, count in parse_failure_counts().items()
+        ]),
+    ]
+
 # Perplexity Wrapper
+PERPLEXITY_URL = os.getenv("PERPLEXITY_API_URL", "https://api.perplexity.ai/chat/completions")
+
+def _perplexity_session(pool_size: int) -> requests.Session:
+    """
+    Keep-alive session so repeated calls reuse TCP+TLS connections.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+# Match LangChain-style response
+class LLMResponse:
+    def __init__(self, content, usage_metadata=None):
+        self.content = content
+        self.usage_metadata = usage_metadata
+
 class PerplexityLLM:
-    def __init__(self, api_key: str, model="sonar"):
+    def __init__(self, api_key: str, model="sonar", pool_size: int = 10):
         self.api_key = api_key
         self.model = model
+        self.pool_size = pool_size
+        self.session = _perplexity_session(pool_size)
+        self._async_client = None
+        self._async_loop = None
 
-    def invoke(self, prompt):
+    def _request(self, prompt):
         # Convert LangChain messages to plain text
         if isinstance(prompt, list):
             prompt = "\n".join([m.content for m in prompt if hasattr(m, "content")])
@@ -21,7 +141,6 @@ class PerplexityLLM:
         else:
             prompt = str(prompt)
 
-        url = "https://api.perplexity.ai/chat/completions"
         headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
@@ -36,55 +155,267 @@ class PerplexityLLM:
             "max_tokens": 512   # REQUIRED by Perplexity
         }
 
-        response = requests.post(url, json=payload, headers=headers, timeout=60)
+        return headers, payload
+
+    def _parse(self, status_code: int, text: str, data, headers=None) -> LLMResponse:
+        # Typed error so the limiter can tell throttling from failures
+        if status_code != 200:
+            retry_after = parse_retry_after((headers or {}).get("retry-after"))
+            raise ProviderHTTPError("Perplexity", status_code, text, retry_after)
+
+        body = data()
+        usage = body.get("usage") or {}
+        return LLMResponse(
+            body["choices"][0]["message"]["content"],
+            {"input_tokens": usage.get("prompt_tokens"), "output_tokens": usage.get("completion_tokens")},
+        )
+
+    def invoke(self, prompt):
+        headers, payload = self._request(prompt)
+        response = self.session.post(PERPLEXITY_URL, json=payload, headers=headers, timeout=60)
+        return self._parse(response.status_code, response.text, response.json, response.headers)
+
+    def _get_async_client(self) -> httpx.AsyncClient:
+        # httpx pools are bound to the loop that created them
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_loop is not loop:
+            self._async_client = httpx.AsyncClient(
+                timeout=60,
+                limits=httpx.Limits(
+                    max_connections=self.pool_size,
+                    max_keepalive_connections=self.pool_size,
+                ),
+            )
+            self._async_loop = loop
+        return self._async_client
+
+    async def ainvoke(self, prompt):
+        headers, payload = self._request(prompt)
+        response = await self._get_async_client().post(PERPLEXITY_URL, json=payload, headers=headers)
+        return self._parse(response.status_code, response.text, response.json, response.headers)
+
+    async def astream(self, prompt):
+        headers, payload = self._request(prompt)
+        payload["stream"] = True
+        usage = None
+
+        async with self._get_async_client().stream("POST", PERPLEXITY_URL, json=payload, headers=headers) as response:
+            if response.status_code != 200:
+                body = await response.aread()
+                self._parse(response.status_code, body.decode("utf-8", "replace"), None, response.headers)
+
+            # Server-sent events: "data: {...}" lines until "data: [DONE]"
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                event = json.loads(data)
+                usage = event.get("usage") or usage
+                choices = event.get("choices") or []
+                delta = (choices[0].get("delta") or {}).get("content") if choices else None
+                if delta:
+                    yield LLMResponse(delta)
+
+        if usage:
+            yield LLMResponse("", {"input_tokens": usage.get("prompt_tokens"), "output_tokens": usage.get("completion_tokens")})
+
+    def close(self):
+        self.session.close()
+        self._async_client = None
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.aclose()
+        self.close()
+
+# Client Registry
+# One rate-limited client per (provider, params); every get_llm() call reuses it.
+# Cached / policy wrappers around them live in _wrappers.
+_clients = {}
+_wrappers = {}
+_clients_lock = threading.Lock()
+
+def _client_params(provider: str) -> dict:
+    if provider == "openai":
+        return {
+            "azure_endpoint": os.getenv("AZURE_OPENAI_ENDPOINT"),
+            "openai_api_key": os.getenv("AZURE_OPENAI_API_KEY"),
+            "deployment_name": os.getenv("AZURE_DEPLOYMENT_NAME"),
+            "api_version": os.getenv("OPENAI_API_VERSION", "2024-02-01"),
+            "temperature": 0.2,
+            "max_tokens": 1500,
+            "max_retries": 0,  # retries are owned by the provider limiter
+        }
+
+    if provider == "gemini":
+        return {
+            "model": os.getenv("GEMINI_MODEL", "gemini-flash-latest"),
+            "google_api_key": os.getenv("GEMINI_API_KEY"),
+            "temperature": 0.2,
+            "max_output_tokens": 1024,
+            "max_retries": 0,
+        }
 
-        # Helpful debugging if it fails
-        if response.status_code != 200:
-            raise Exception(f"Perplexity API Error {response.status_code}: {response.text}")
+    if provider == "perplexity":
+        return {
+            "api_key": os.getenv("PERPLEXITY_API_KEY"),
+            "model": "sonar",  # cheapest chat-compatible model
+            "pool_size": int(os.getenv("PERPLEXITY_POOL_SIZE", "10")),
+        }
 
-        content = response.json()["choices"][0]["message"]["content"]
+    raise ValueError(f"Unsupported LLM provider: {provider}")
+
+# Provider SDKs are imported on first use: a worker that only talks to
+# Azure never pays for the Google stack at boot
+def _build_client(provider: str, params: dict):
+    if provider == "openai":
+        from langchain_openai import AzureChatOpenAI
+        return AzureChatOpenAI(**params)
+
+    if provider == "gemini":
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        return ChatGoogleGenerativeAI(**params)
 
-        # Match LangChain-style response
-        class R:
-            def __init__(self, content):
-                self.content = content
+    return PerplexityLLM(**params)
 
-        return R(content)
+# SDK module per provider, for warming a preloaded parent before forking
+PROVIDER_SDKS = {
+    "openai": "langchain_openai",
+    "gemini": "langchain_google_genai",
+}
+
+def preload_provider_sdks(providers) -> list:
+    """
+    Imports the SDKs of `providers` now; returns the modules loaded.
+    """
+    import importlib
+
+    loaded = []
+    for provider in providers:
+        module = PROVIDER_SDKS.get(provider.lower())
+        if module:
+            importlib.import_module(module)
+            loaded.append(module)
+    return loaded
+
+def shutdown_clients():
+    """
+    Closes pooled connections and empties the registry.
+    Call on app shutdown.
+    """
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+        _wrappers.clear()
+
+    for client in clients:
+        close = getattr(client, "close", None)
+        if callable(close):
+            try:
+                close()
+            except Exception:
+                pass
+
+    close_cache()
+
+async def ashutdown_clients():
+    """
+    Async shutdown: also drains async HTTP pools.
+    """
+    with _clients_lock:
+        clients = list(_clients.values())
+
+    for client in clients:
+        aclose = getattr(client, "aclose", None)
+        if callable(aclose):
+            try:
+                await aclose()
+            except Exception:
+                pass
+
+    shutdown_clients()
+
+def reset_clients():
+    """
+    Drops cached clients and limiters (tests, env reloads).
+    """
+    shutdown_clients()
+    with _limiters_lock:
+        _limiters.clear()
+
+# Helper: the shared rate-limited client for one provider
+def _provider_client(provider: str, replay: str = "off"):
+    params = _client_params(provider)
+    key = (provider, replay, tuple(sorted(params.items())))
+
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            max_tokens = params.get("max_tokens") or params.get("max_output_tokens") or 512
+            model = params.get("deployment_name") or params.get("model")
+            if replay == "replay":
+                # offline: never build (or authenticate) the real client
+                raw = ReplayLLM(None, provider, params, replay)
+            elif replay == "record":
+                raw = ReplayLLM(_build_client(provider, params), provider, params, replay)
+            else:
+                raw = _build_client(provider, params)
+            instrumented = InstrumentedLLM(raw, provider, model)
+            client = LimitedLLM(instrumented, get_limiter(provider), max_tokens)
+            _clients[key] = client
+
+    return client, params, key
+
+# Helper: primary + fallbacks; a fallback that cannot be built is skipped
+def _policy_clients(provider: str, primary, policy: CallPolicy, replay: str) -> list:
+    clients = [(provider, primary)]
+    for fallback in policy.providers(provider)[1:]:
+        try:
+            clients.append((fallback, _provider_client(fallback, replay)[0]))
+        except Exception as e:
+            logger.warning("LLM policy %s: skipping fallback %s (%s)", policy.name, fallback, e)
+    return clients
 
 # Core LLM Factory
-def get_llm(provider: str | None = None):
+def get_llm(provider: str | None = None, policy: str | CallPolicy | None = None):
     """
     Default LLM = OpenAI
     Other providers must be explicitly requested.
+    Clients are shared process-wide per provider + params
+    and answer repeat prompts from the response cache.
+    Cache misses go through the provider's rate limiter.
+
+    `policy` (a name such as "answer" / "evaluation" / "discovery", or a
+    CallPolicy) adds hedging and an ordered fallback chain.
+    Policies are identified by name.
+
+    "replay" / "replay:<provider>" serves recorded responses (see llm.replay);
+    LLM_REPLAY=record|replay applies to every provider. Record and replay
+    clients never use the response cache.
     """
 
     provider = (provider or "openai").lower()
+    if isinstance(policy, str):
+        policy = get_policy(policy)
 
-    if provider == "openai":
-        return AzureChatOpenAI(
-            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-            openai_api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-            deployment_name=os.getenv("AZURE_DEPLOYMENT_NAME"),
-            api_version=os.getenv("OPENAI_API_VERSION", "2024-02-01"),
-            temperature=0.2,
-            max_tokens=1500,
-        )
+    provider, replay = split_provider(provider)
+    primary, params, key = _provider_client(provider, replay)
+    wrapper_key = (key, policy.name if policy else None)
 
-    if provider == "gemini":
-        return ChatGoogleGenerativeAI(
-            model=os.getenv("GEMINI_MODEL", "gemini-flash-latest"),
-            google_api_key=os.getenv("GEMINI_API_KEY"),
-            temperature=0.2,
-            max_output_tokens=1024,
-        )
+    with _clients_lock:
+        client = _wrappers.get(wrapper_key)
+    if client is not None:
+        return client
 
-    if provider == "perplexity":
-        return PerplexityLLM(
-            api_key=os.getenv("PERPLEXITY_API_KEY"),
-            model="sonar"  # cheapest chat-compatible model
-        )
+    inner = primary if policy is None else HedgedLLM(policy, _policy_clients(provider, primary, policy, replay))
+    # record / replay bypass the response cache: a cached prompt would never
+    # reach the cassette, and replay must not serve live answers
+    client = inner if replay != "off" else CachedLLM(inner, provider, params)
 
-    raise ValueError(f"Unsupported LLM provider: {provider}")
+    with _clients_lock:
+        return _wrappers.setdefault(wrapper_key, client)
 
 # Discovery LLM (OpenAI Default)
 def get_discovery_llm(provider: str | None = None):
@@ -94,6 +425,6 @@ def get_discovery_llm(provider: str | None = None):
     """
 
     provider = (provider or "openai").lower()
-    print("ACTIVE DISCOVERY LLM =", provider)
+    discovery_requests.inc(provider)
 
-    return get_llm(provider)
\ No newline at end of file
+    return get_llm(provider, policy="discovery")
\ No newline at end of file
@@ -0,0 +1,371 @@
+# llm/rate_limit.py
+"""
+Per-provider admission control for LLM calls.
+
+Each provider gets:
+- token buckets for requests/minute and tokens/minute (LLM_RPM_<P>, LLM_TPM_<P>)
+- an AIMD concurrency window: +1/limit per success, halved on a 429
+- a shared cool-down honouring Retry-After, so one throttled call
+  pauses the whole provider instead of every caller retrying at once
+- FIFO admission: callers queue and are admitted strictly in arrival
+  order, woken when a slot is released or when a bucket / cool-down
+  allows the next one (no polling)
+
+Budgets are for the whole server: with LLM_WORKER_COUNT worker processes
+(set by serve.py) each process enforces its 1/N share.
+"""
+
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+BASE_BACKOFF = float(os.getenv("LLM_BACKOFF_SECONDS", "1.0"))
+MAX_BACKOFF = float(os.getenv("LLM_MAX_BACKOFF_SECONDS", "30"))
+
+# statuses that mean "slow down and try again"
+RETRYABLE_STATUSES = (429, 503)
+
+class ProviderHTTPError(Exception):
+    """
+    Non-2xx response from a provider we call over raw HTTP.
+    """
+
+    def __init__(self, provider: str, status_code: int, body: str, retry_after: float | None = None):
+        super().__init__(f"{provider} API Error {status_code}: {body}")
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+def _env_float(name: str):
+    value = os.getenv(name)
+    return float(value) if value else None
+
+def parse_retry_after(value) -> float | None:
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+# Helper: recognise throttling across SDKs (openai, google, our own HTTP)
+def throttle_info(error: Exception):
+    """
+    Returns (is_throttled, retry_after_seconds).
+    """
+    status = getattr(error, "status_code", None) or getattr(error, "code", None)
+    if callable(status):
+        status = status()
+
+    name = type(error).__name__
+    throttled = status in RETRYABLE_STATUSES or name in ("RateLimitError", "ResourceExhausted", "TooManyRequests")
+    if not throttled:
+        return False, None
+
+    retry_after = getattr(error, "retry_after", None)
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if retry_after is None and headers is not None:
+        retry_after = parse_retry_after(headers.get("retry-after"))
+        if retry_after is None:
+            ms = parse_retry_after(headers.get("retry-after-ms"))
+            retry_after = ms / 1000 if ms is not None else None
+
+    return True, retry_after
+
+class TokenBucket:
+    def __init__(self, per_minute: float | None):
+        self.per_minute = per_minute
+        self.capacity = per_minute or 0.0
+        self.available = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        if self.per_minute:
+            self.available = min(self.capacity, self.available + (now - self.updated) * self.per_minute / 60)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """
+        Seconds until `amount` is available (0 = take it now).
+        """
+        if not self.per_minute:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.available >= amount:
+            return 0.0
+        return (amount - self.available) * 60 / self.per_minute
+
+    def take(self, amount: float):
+        if self.per_minute:
+            self.available -= min(amount, self.capacity)
+
+class _Waiter:
+    """
+    One queued caller; `wake` is called (under the limiter lock) once it
+    has been granted a slot and returns False if nobody can take it.
+    """
+
+    __slots__ = ("tokens", "wake", "granted")
+
+    def __init__(self, tokens: int, wake):
+        self.tokens = tokens
+        self.wake = wake
+        self.granted = False
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+class ProviderLimiter:
+    def __init__(self, provider: str, max_concurrency: int, rpm: float | None = None, tpm: float | None = None):
+        self.provider = provider
+        self.max_concurrency = max_concurrency
+        self.limit = float(max_concurrency)
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.throttled = 0
+        self.retries = 0
+        self._waiters = deque()
+        self._timer = None
+        self._timer_due = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    # Admission
+    def _dispatch(self):
+        """
+        Admits waiters from the head of the queue while the window and
+        buckets allow; a head held back by time gets a wake-up timer.
+        Called with the lock held.
+        """
+        now = time.monotonic()
+        while self._waiters:
+            head = self._waiters[0]
+            if now < self.blocked_until:
+                self._schedule(self.blocked_until - now)
+                return
+            if self.in_flight >= max(1, int(self.limit)):
+                return  # the next release dispatches
+
+            wait = max(self.requests.wait_time(1, now), self.tokens.wait_time(head.tokens, now))
+            if wait > 0:
+                self._schedule(wait)
+                return
+
+            self._waiters.popleft()
+            self.requests.take(1)
+            self.tokens.take(head.tokens)
+            self.in_flight += 1
+            head.granted = True
+            if not head.wake():
+                self.in_flight -= 1
+
+    def _schedule(self, delay: float):
+        due = time.monotonic() + delay
+        if self._timer is not None and self._timer_due <= due:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(delay, self._on_timer)
+        self._timer.daemon = True
+        self._timer_due = due
+        self._timer.start()
+
+    def _on_timer(self):
+        with self._lock:
+            self._timer = None
+            self._dispatch()
+
+    def acquire(self, tokens: int = 0):
+        event = threading.Event()
+
+        def wake():
+            event.set()
+            return True
+
+        waiter = _Waiter(tokens, wake)
+        with self._lock:
+            self._waiters.append(waiter)
+            self._dispatch()
+        event.wait()
+
+    async def aacquire(self, tokens: int = 0):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            try:
+                loop.call_soon_threadsafe(_resolve, future)
+            except RuntimeError:  # loop closed: the caller is gone
+                return False
+            return True
+
+        waiter = _Waiter(tokens, wake)
+        with self._lock:
+            self._waiters.append(waiter)
+            self._dispatch()
+            if waiter.granted:
+                return
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter.granted:
+                    # admitted as we were cancelled: hand the slot on
+                    self.in_flight -= 1
+                else:
+                    self._waiters.remove(waiter)
+                self._dispatch()
+            raise
+
+    # Feedback (AIMD)
+    def release(self, ok: bool = True):
+        with self._lock:
+            self.in_flight -= 1
+            if ok:
+                self.limit = min(self.max_concurrency, self.limit + 1 / max(self.limit, 1))
+            self._dispatch()
+
+    def on_throttle(self, retry_after: float | None, attempt: int) -> float:
+        """
+        Called before retrying a throttled call: counts the retry, halves
+        the window, pauses the provider and returns the backoff.
+        """
+        backoff = retry_after
+        if backoff is None:
+            backoff = min(MAX_BACKOFF, BASE_BACKOFF * (2 ** attempt)) * random.uniform(0.5, 1.0)
+
+        with self._lock:
+            self.throttled += 1
+            self.retries += 1
+            self.limit = max(1.0, self.limit / 2)
+            self.blocked_until = max(self.blocked_until, time.monotonic() + backoff)
+
+        return backoff
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            now = time.monotonic()
+            return {
+                "concurrency_limit": round(self.limit, 2),
+                "max_concurrency": self.max_concurrency,
+                "in_flight": self.in_flight,
+                "queued": len(self._waiters),
+                "rpm": self.requests.per_minute,
+                "tpm": self.tokens.per_minute,
+                "requests_available": round(self.requests.available, 1) if self.requests.per_minute else None,
+                "tokens_available": round(self.tokens.available, 1) if self.tokens.per_minute else None,
+                "blocked_for": round(max(0.0, self.blocked_until - now), 2),
+                "throttled": self.throttled,
+                "retries": self.retries,
+            }
+
+def worker_count() -> int:
+    return max(1, int(os.getenv("LLM_WORKER_COUNT", "1")))
+
+def build_limiter(provider: str, max_concurrency: int) -> ProviderLimiter:
+    """
+    This process's share of the provider budget: concurrency rounds up
+    (at least 1 call per worker), rates divide evenly.
+    """
+    key = provider.upper()
+    workers = worker_count()
+    rpm = _env_float(f"LLM_RPM_{key}")
+    tpm = _env_float(f"LLM_TPM_{key}")
+    return ProviderLimiter(
+        provider,
+        max(1, -(-max_concurrency // workers)),
+        rpm=rpm / workers if rpm else rpm,
+        tpm=tpm / workers if tpm else tpm,
+    )
+
+# Helper: rough prompt size for the tokens/minute bucket
+def _prompt_text(prompt) -> str:
+    if isinstance(prompt, list):
+        return "\n".join(str(getattr(m, "content", m)) for m in prompt)
+    return str(getattr(prompt, "content", prompt))
+
+class LimitedLLM:
+    """
+    Wraps a provider client so every invoke/ainvoke goes through the
+    provider's limiter and retries throttled calls with backoff.
+    """
+
+    def __init__(self, client, limiter: ProviderLimiter, max_tokens: int | None = None):
+        self.client = client
+        self.limiter = limiter
+        self.max_tokens = max_tokens or 0
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def _estimate(self, prompt) -> int:
+        # ~4 chars/token is plenty for budgeting; completions are charged at max_tokens
+        return len(_prompt_text(prompt)) // 4 + self.max_tokens
+
+    def invoke(self, prompt, *args, **kwargs):
+        tokens = self._estimate(prompt)
+        for attempt in range(MAX_RETRIES + 1):
+            self.limiter.acquire(tokens)
+            try:
+                resp = self.client.invoke(prompt, *args, **kwargs)
+            except Exception as e:
+                self.limiter.release(ok=False)
+                throttled, retry_after = throttle_info(e)
+                if not throttled or attempt == MAX_RETRIES:
+                    raise
+                self.limiter.on_throttle(retry_after, attempt)
+                continue
+            self.limiter.release(ok=True)
+            return resp
+
+    async def ainvoke(self, prompt, *args, **kwargs):
+        tokens = self._estimate(prompt)
+        for attempt in range(MAX_RETRIES + 1):
+            await self.limiter.aacquire(tokens)
+            try:
+                resp = await self.client.ainvoke(prompt, *args, **kwargs)
+            except asyncio.CancelledError:
+                self.limiter.release(ok=False)
+                raise
+            except Exception as e:
+                self.limiter.release(ok=False)
+                throttled, retry_after = throttle_info(e)
+                if not throttled or attempt == MAX_RETRIES:
+                    raise
+                self.limiter.on_throttle(retry_after, attempt)
+                continue
+            self.limiter.release(ok=True)
+            return resp
+
+    async def astream(self, prompt, *args, **kwargs):
+        # the slot is held for the whole stream; only a throttle that
+        # arrives before the first chunk is retried
+        tokens = self._estimate(prompt)
+        for attempt in range(MAX_RETRIES + 1):
+            await self.limiter.aacquire(tokens)
+            started = ok = False
+            try:
+                async for chunk in self.client.astream(prompt, *args, **kwargs):
+                    started = True
+                    yield chunk
+                ok = True
+                return
+            except Exception as e:
+                throttled, retry_after = throttle_info(e)
+                if started or not throttled or attempt == MAX_RETRIES:
+                    raise
+                self.limiter.on_throttle(retry_after, attempt)
+            finally:
+                self.limiter.release(ok=ok)
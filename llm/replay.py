@@ -0,0 +1,188 @@
+# llm/replay.py
+"""
+Record / replay of provider responses for deterministic offline runs.
+
+LLM_REPLAY=record  -> real calls; each response is appended to a cassette
+LLM_REPLAY=replay  -> no network; responses come from the cassette
+                      (keyed like the response cache: provider, model,
+                      temperature, max_tokens, normalized prompt)
+
+get_llm("replay") / get_llm("replay:<provider>") forces replay for one
+client regardless of LLM_REPLAY.
+
+Cassettes are JSONL files per provider under LLM_CASSETTE_DIR.
+LLM_REPLAY_LATENCY=recorded sleeps for the recorded latency (default: zero).
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+from llm.cache import cache_key
+
+REPLAY_MODES = ("off", "record", "replay")
+REPLAY_MODE = os.getenv("LLM_REPLAY", "off").lower()
+CASSETTE_DIR = os.getenv("LLM_CASSETTE_DIR", ".cache/cassettes")
+REPLAY_LATENCY = os.getenv("LLM_REPLAY_LATENCY", "zero").lower()
+
+if REPLAY_MODE not in REPLAY_MODES:
+    raise ValueError(f"LLM_REPLAY must be one of {REPLAY_MODES}")
+
+class CassetteMiss(KeyError):
+    """
+    Replay asked for a prompt that was never recorded.
+    """
+
+def split_provider(provider: str):
+    """
+    "replay" -> ("openai", "replay"), "replay:gemini" -> ("gemini", "replay"),
+    anything else -> (provider, LLM_REPLAY).
+    """
+    if provider == "replay":
+        return "openai", "replay"
+    if provider.startswith("replay:"):
+        return provider.split(":", 1)[1] or "openai", "replay"
+    return provider, REPLAY_MODE
+
+# Replayed response (LangChain-style)
+class ReplayedResponse:
+    def __init__(self, content, usage_metadata=None):
+        self.content = content
+        self.usage_metadata = usage_metadata
+        self.replayed = True
+
+class Cassette:
+    def __init__(self, path: str):
+        self.path = path
+        self._entries = None
+        self._lock = threading.Lock()
+
+    def _load(self) -> dict:
+        if self._entries is None:
+            entries = {}
+            if os.path.exists(self.path):
+                with open(self.path, encoding="utf-8") as f:
+                    for line in f:
+                        line = line.strip()
+                        if line:
+                            entry = json.loads(line)
+                            entries[entry["key"]] = entry
+            self._entries = entries
+        return self._entries
+
+    def get(self, key: str):
+        with self._lock:
+            return self._load().get(key)
+
+    def record(self, entry: dict):
+        with self._lock:
+            self._load()[entry["key"]] = entry
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def __len__(self):
+        with self._lock:
+            return len(self._load())
+
+_cassettes = {}
+_cassettes_lock = threading.Lock()
+
+def get_cassette(provider: str) -> Cassette:
+    with _cassettes_lock:
+        if provider not in _cassettes:
+            _cassettes[provider] = Cassette(os.path.join(CASSETTE_DIR, f"{provider}.jsonl"))
+        return _cassettes[provider]
+
+def _usage(resp):
+    usage = getattr(resp, "usage_metadata", None)
+    return dict(usage) if usage else None
+
+def _preview(prompt) -> str:
+    if isinstance(prompt, list):
+        prompt = "\n".join(str(getattr(m, "content", m)) for m in prompt)
+    return str(getattr(prompt, "content", prompt))[:200]
+
+class ReplayLLM:
+    """
+    mode="record": forwards to `client` and records every response.
+    mode="replay": serves recorded responses; `client` may be None.
+    """
+
+    def __init__(self, client, provider: str, params: dict, mode: str):
+        self.client = client
+        self.provider = provider
+        self.mode = mode
+        self.model = params.get("deployment_name") or params.get("model")
+        self.temperature = params.get("temperature")
+        self.max_tokens = params.get("max_tokens") or params.get("max_output_tokens")
+        self.cassette = get_cassette(provider)
+
+    def __getattr__(self, name):
+        if self.client is None:
+            raise AttributeError(name)
+        return getattr(self.client, name)
+
+    def _key(self, prompt) -> str:
+        return cache_key(self.provider, self.model, self.temperature, self.max_tokens, prompt)
+
+    def _lookup(self, prompt):
+        key = self._key(prompt)
+        entry = self.cassette.get(key)
+        if entry is None:
+            raise CassetteMiss(f"no recorded {self.provider} response for prompt {_preview(prompt)!r} ({key[:12]})")
+        return entry
+
+    def _record(self, prompt, resp, latency: float):
+        self.cassette.record({
+            "key": self._key(prompt),
+            "provider": self.provider,
+            "model": self.model,
+            "prompt": _preview(prompt),
+            "content": getattr(resp, "content", str(resp)),
+            "usage": _usage(resp),
+            "latency": round(latency, 4),
+        })
+
+    def invoke(self, prompt, *args, **kwargs):
+        if self.mode == "replay":
+            entry = self._lookup(prompt)
+            if REPLAY_LATENCY == "recorded":
+                time.sleep(entry.get("latency") or 0)
+            return ReplayedResponse(entry["content"], entry.get("usage"))
+
+        start = time.perf_counter()
+        resp = self.client.invoke(prompt, *args, **kwargs)
+        self._record(prompt, resp, time.perf_counter() - start)
+        return resp
+
+    async def ainvoke(self, prompt, *args, **kwargs):
+        if self.mode == "replay":
+            entry = self._lookup(prompt)
+            if REPLAY_LATENCY == "recorded":
+                await asyncio.sleep(entry.get("latency") or 0)
+            return ReplayedResponse(entry["content"], entry.get("usage"))
+
+        start = time.perf_counter()
+        resp = await self.client.ainvoke(prompt, *args, **kwargs)
+        self._record(prompt, resp, time.perf_counter() - start)
+        return resp
+
+    async def astream(self, prompt, *args, **kwargs):
+        # replayed streams arrive as one chunk
+        if self.mode == "replay":
+            yield await self.ainvoke(prompt, *args, **kwargs)
+            return
+
+        start = time.perf_counter()
+        parts = []
+        usage = None
+        async for chunk in self.client.astream(prompt, *args, **kwargs):
+            content = getattr(chunk, "content", None)
+            if isinstance(content, str):
+                parts.append(content)
+            usage = getattr(chunk, "usage_metadata", None) or usage
+            yield chunk
+
+        self._record(prompt, ReplayedResponse("".join(parts), usage), time.perf_counter() - start)
@@ -1,3 +1,12 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import Counter
+from langchain_core.messages import AIMessage, HumanMessage
+from llm.telemetry import record_stage, site as call_site, span, stage_errors
+
 def extract_text(resp) -> str:
     content = resp.content
 
@@ -13,4 +22,358 @@ def extract_text(resp) -> str:
                 parts.append(item["text"])
         return "\n".join(parts).strip()
 
-    return str(content).strip()
\ No newline at end of file
+    return str(content).strip()
+
+# JSON Extraction
+# Scans for balanced, string-aware [...] / {...} blocks instead of a greedy
+# regex, and tolerates code fences and trailing commas.
+
+_FENCE = re.compile(r"```(?:json|JSON)?\s*(.*?)```", re.DOTALL)
+_TRAILING_COMMA = re.compile(r",(\s*[}\]])")
+
+_parse_failures = Counter()
+_parse_lock = threading.Lock()
+
+def record_parse_failure(site: str):
+    with _parse_lock:
+        _parse_failures[site] += 1
+
+def parse_failure_counts() -> dict:
+    with _parse_lock:
+        return dict(_parse_failures)
+
+def _strip_trailing_commas(block: str) -> str:
+    # only outside strings: walk the text and drop ",]" / ",}" commas
+    out, in_string, escape = [], False, False
+    for i, ch in enumerate(block):
+        if in_string:
+            out.append(ch)
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+            continue
+
+        if ch == '"':
+            in_string = True
+        elif ch == "," and _TRAILING_COMMA.match(block, i):
+            continue
+        out.append(ch)
+
+    return "".join(out)
+
+def _loads(block: str):
+    try:
+        return json.loads(block)
+    except ValueError:
+        return json.loads(_strip_trailing_commas(block))
+
+def _balanced_blocks(text: str, openers: str):
+    """
+    Yields every top-level balanced block starting with one of `openers`.
+    """
+    pairs = {"[": "]", "{": "}"}
+    i = 0
+    while i < len(text):
+        if text[i] not in openers:
+            i += 1
+            continue
+
+        stack, in_string, escape = [], False, False
+        for j in range(i, len(text)):
+            ch = text[j]
+            if in_string:
+                if escape:
+                    escape = False
+                elif ch == "\\":
+                    escape = True
+                elif ch == '"':
+                    in_string = False
+            elif ch == '"':
+                in_string = True
+            elif ch in pairs:
+                stack.append(pairs[ch])
+            elif ch in "]}":
+                if not stack or stack.pop() != ch:
+                    break
+                if not stack:
+                    yield text[i:j + 1]
+                    i = j
+                    break
+        i += 1
+
+def extract_json(text: str, expect: type | None = None, site: str | None = None):
+    """
+    Returns the first JSON value of type `expect` (list / dict / either)
+    found in `text`, or None. Failures are counted per call site.
+    """
+    text = str(text or "")
+    sources = [m.group(1) for m in _FENCE.finditer(text)] + [text]
+    openers = {list: "[", dict: "{"}.get(expect, "[{")
+
+    for source in sources:
+        for block in _balanced_blocks(source, openers):
+            try:
+                value = _loads(block)
+            except ValueError:
+                continue
+            if expect is None or isinstance(value, expect):
+                return value
+
+    if site:
+        record_parse_failure(site)
+    return None
+
+# Incremental list parsing (streamed tokens)
+class JSONListStream:
+    """
+    Feed streamed text chunks; completed top-level list items come back
+    as soon as they close, before the response finishes.
+
+    Like extract_json, a "[" only starts the list if what follows parses:
+    a candidate whose first item is not JSON (prose such as "[see below]")
+    is dropped and the scan resumes right after its bracket. Once an item
+    has been returned the list is committed to.
+    """
+
+    def __init__(self):
+        self._text = ""
+        self._pos = 0
+        self._start = None       # index of the candidate "["
+        self._item_start = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._committed = False
+        self.done = False
+
+    def feed(self, chunk: str) -> list:
+        if self.done:
+            return []
+        self._text += chunk
+        return self._scan()
+
+    def finish(self) -> list:
+        """
+        End of input: a candidate that never closed was not the list
+        either, so rescan past it.
+        """
+        items = []
+        while not (self.done or self._committed) and self._start is not None:
+            self._open_next()
+            items.extend(self._scan())
+        return items
+
+    def _scan(self) -> list:
+        items = []
+
+        while self._pos < len(self._text) and not self.done:
+            if self._start is None:
+                i = self._text.find("[", self._pos)
+                if i < 0:
+                    self._text, self._pos = "", 0
+                    break
+                self._open(i)
+                continue
+
+            ch = self._text[self._pos]
+            self._pos += 1
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "[{":
+                self._depth += 1
+            elif ch in "]}" and self._depth:
+                self._depth -= 1
+            elif ch == "}":
+                # unbalanced: this was never a JSON list
+                if not self._committed:
+                    self._open_next()
+                    continue
+                self.done = True
+            elif ch == "]" or (ch == "," and not self._depth):
+                ok, value = self._item(empty_ok=ch == ",")
+                if not ok and not self._committed:
+                    # not the list we are looking for: rescan after its "["
+                    self._open_next()
+                    continue
+                if ok and value is not _EMPTY:
+                    self._committed = True
+                    items.append(value)
+                self.done = ch == "]"
+                self._item_start = self._pos
+
+        if self._start is not None and not self.done:
+            # keep only what a later item (or a rescan) still needs
+            cut = self._item_start if self._committed else self._start
+            self._text = self._text[cut:]
+            self._pos -= cut
+            self._item_start -= cut
+            self._start -= cut
+        return items
+
+    def _open(self, i: int):
+        self._start = i
+        self._pos = self._item_start = i + 1
+        self._depth = 0
+        self._in_string = self._escape = False
+
+    def _open_next(self):
+        start = self._start
+        self._start = None
+        self._pos = start + 1
+
+    def _item(self, empty_ok: bool):
+        raw = self._text[self._item_start:self._pos - 1].strip()
+        if not raw:
+            return empty_ok or self._committed, _EMPTY
+        try:
+            return True, _loads(raw)
+        except ValueError:
+            return False, None
+
+_EMPTY = object()
+
+def iter_json_items(chunks):
+    stream = JSONListStream()
+    for chunk in chunks:
+        yield from stream.feed(extract_text_chunk(chunk))
+    yield from stream.finish()
+
+async def aiter_json_items(chunks):
+    stream = JSONListStream()
+    async for chunk in chunks:
+        for item in stream.feed(extract_text_chunk(chunk)):
+            yield item
+    for item in stream.finish():
+        yield item
+
+def extract_text_chunk(chunk) -> str:
+    if isinstance(chunk, str):
+        return chunk
+    if hasattr(chunk, "content"):
+        content = chunk.content
+        if isinstance(content, list):
+            return "".join(p if isinstance(p, str) else p.get("text", "") for p in content if isinstance(p, (str, dict)))
+        return str(content)
+    return str(chunk)
+
+# Invoke + parse with a bounded re-ask
+MAX_REASKS = int(os.getenv("LLM_JSON_REASKS", "1"))
+
+def _as_messages(prompt) -> list:
+    if isinstance(prompt, list):
+        return list(prompt)
+    if hasattr(prompt, "content"):
+        return [prompt]
+    return [HumanMessage(content=str(prompt))]
+
+def _reask_messages(prompt, raw: str, expect: type | None) -> list:
+    shape = {list: "a JSON list", dict: "a JSON object"}.get(expect, "JSON")
+    return _as_messages(prompt) + [
+        AIMessage(content=raw),
+        HumanMessage(content=f"Your previous reply was not valid {shape}. Return ONLY {shape}, nothing else."),
+    ]
+
+def invoke_json(llm, prompt, expect: type | None = None, site: str = "unknown", default=None):
+    """
+    llm.invoke + extract_json; re-asks up to LLM_JSON_REASKS times.
+    Runs inside a telemetry span named after `site`.
+    """
+    with span(site):
+        return _invoke_json(llm, prompt, expect, site, default)
+
+def _invoke_json(llm, prompt, expect, site, default):
+    resp = llm.invoke(prompt)
+    raw = extract_text(resp)
+
+    for attempt in range(MAX_REASKS + 1):
+        value = extract_json(raw, expect, site)
+        if value is not None:
+            return value
+        if attempt == MAX_REASKS:
+            break
+        resp = llm.invoke(_reask_messages(prompt, raw, expect))
+        raw = extract_text(resp)
+
+    return default
+
+async def ainvoke_json(llm, prompt, expect: type | None = None, site: str = "unknown", default=None):
+    with span(site):
+        return await _ainvoke_json(llm, prompt, expect, site, default)
+
+async def _ainvoke_json(llm, prompt, expect, site, default, raw: str | None = None):
+    if raw is None:
+        raw = extract_text(await llm.ainvoke(prompt))
+
+    for attempt in range(MAX_REASKS + 1):
+        value = extract_json(raw, expect, site)
+        if value is not None:
+            return value
+        if attempt == MAX_REASKS:
+            break
+        resp = await llm.ainvoke(_reask_messages(prompt, raw, expect))
+        raw = extract_text(resp)
+
+    return default
+
+async def astream_json_items(llm, prompt, site: str = "unknown"):
+    """
+    llm.astream + JSONListStream: yields list items as soon as they close.
+    A reply with no list in it goes through extract_json and the re-asks,
+    like ainvoke_json. The stream is always drained so it gets cached.
+
+    The call-site label is set only around each await (never across a
+    yield), and the stage time excludes the consumer's time.
+    """
+    stream = JSONListStream()
+    parts = []
+    found = False
+    busy = 0.0
+    chunks = llm.astream(prompt).__aiter__()
+
+    async def pull(awaitable):
+        nonlocal busy
+        start = time.perf_counter()
+        try:
+            with call_site(site):
+                return await awaitable
+        except BaseException as e:
+            if not isinstance(e, (StopAsyncIteration, GeneratorExit)):
+                stage_errors.inc(site, type(e).__name__)
+            raise
+        finally:
+            busy += time.perf_counter() - start
+
+    try:
+        while True:
+            try:
+                chunk = await pull(chunks.__anext__())
+            except StopAsyncIteration:
+                break
+            text = extract_text_chunk(chunk)
+            parts.append(text)
+            for item in stream.feed(text):
+                found = True
+                yield item
+
+        for item in stream.finish():
+            found = True
+            yield item
+
+        if not found:
+            for item in await pull(_ainvoke_json(llm, prompt, list, site, [], raw="".join(parts))) or []:
+                yield item
+    finally:
+        if hasattr(chunks, "aclose"):
+            await chunks.aclose()
+        record_stage(site, busy)
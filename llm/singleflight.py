@@ -0,0 +1,83 @@
+# llm/singleflight.py
+"""
+Single-flight coalescing: concurrent callers asking for the same key
+share one in-flight call. The leader's result (or exception) is handed
+to every waiter.
+"""
+
+import asyncio
+import threading
+import weakref
+from typing import Awaitable, Callable
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}
+        self._tasks = weakref.WeakKeyDictionary()  # loop -> {key: Task}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+
+    def do(self, key, fn: Callable):
+        """
+        Blocking variant for threaded callers.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    async def ado(self, key, factory: Callable[[], Awaitable]):
+        """
+        Async variant; tasks are shared per event loop.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            tasks = self._tasks.setdefault(loop, {})
+            task = tasks.get(key)
+            if task is None:
+                task = asyncio.ensure_future(factory())
+                tasks[key] = task
+                task.add_done_callback(lambda _: tasks.pop(key, None))
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+
+        # shield: one caller going away must not cancel the others
+        return await asyncio.shield(task)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            inflight = len(self._calls) + sum(len(t) for t in self._tasks.values())
+            return {
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+                "inflight": inflight,
+            }
@@ -0,0 +1,299 @@
+# llm/telemetry.py
+"""
+In-process metrics (Prometheus text format) and stage spans.
+
+- LLM calls: latency histogram, tokens, errors per provider/model/site
+- spans: duration + errors per pipeline stage; the innermost span name
+  is the "site" label of any LLM call made inside it
+- OpenTelemetry: when opentelemetry-api is installed and TELEMETRY_OTEL=1,
+  every span is also exported through the configured tracer provider
+"""
+
+import asyncio
+import contextvars
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from llm.hedging import latencies
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+# Optional OpenTelemetry
+_tracer = None
+if os.getenv("TELEMETRY_OTEL", "0") == "1":
+    try:
+        from opentelemetry import trace
+        _tracer = trace.get_tracer("geo_intelligence")
+    except ImportError:
+        logger.warning("TELEMETRY_OTEL=1 but opentelemetry-api is not installed")
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _label_text(names, values, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter:
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *values, amount: float = 1):
+        with self._lock:
+            self._values[values] = self._values.get(values, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for values, total in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(self.labels, values)} {total}")
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *values):
+        with self._lock:
+            row = self._values.get(values)
+            if row is None:
+                row = self._values[values] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    row[i] += 1
+            row[-2] += value
+            row[-1] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for values, row in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, row):
+                    le = 'le="%s"' % bound
+                    lines.append(f"{self.name}_bucket{_label_text(self.labels, values, le)} {count}")
+                le = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{_label_text(self.labels, values, le)} {row[-1]}")
+                lines.append(f"{self.name}_sum{_label_text(self.labels, values)} {round(row[-2], 6)}")
+                lines.append(f"{self.name}_count{_label_text(self.labels, values)} {row[-1]}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name: str, help: str, labels=()) -> Counter:
+        metric = Counter(name, help, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, help, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, fn):
+        """
+        fn() -> [(name, type, help, [(labels_dict, value)])], read at scrape time.
+        """
+        self._collectors.append(fn)
+        return fn
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+
+        for fn in self._collectors:
+            try:
+                families = fn()
+            except Exception as e:
+                logger.warning("metrics collector %s failed: %s", getattr(fn, "__name__", fn), e)
+                continue
+            for name, kind, help, samples in families:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    if value is None:
+                        continue
+                    lines.append(f"{name}{_label_text(labels.keys(), labels.values())} {value}")
+
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+# LLM call metrics
+llm_latency = registry.histogram("llm_request_seconds", "Provider call latency", ("provider", "model", "site"))
+llm_requests = registry.counter("llm_requests_total", "Provider calls by outcome", ("provider", "model", "site", "outcome"))
+llm_first_token = registry.histogram("llm_first_token_seconds", "Time to first streamed chunk", ("provider", "model", "site"))
+llm_tokens = registry.counter("llm_tokens_total", "Tokens reported by the provider", ("provider", "model", "site", "kind"))
+
+# Stage metrics
+stage_latency = registry.histogram("stage_seconds", "Pipeline stage duration", ("stage",))
+stage_errors = registry.counter("stage_errors_total", "Pipeline stage failures", ("stage", "error"))
+
+# Spans
+_current_span = contextvars.ContextVar("telemetry_span", default=None)
+
+def current_site() -> str:
+    return _current_span.get() or "unknown"
+
+@contextmanager
+def span(name: str, **attrs):
+    """
+    Times a stage; nested LLM calls are labelled with `name`.
+    """
+    token = _current_span.set(name)
+    otel = _tracer.start_as_current_span(name, attributes=attrs) if _tracer else nullcontext()
+    start = time.perf_counter()
+    try:
+        with otel:
+            yield
+    except BaseException as e:
+        stage_errors.inc(name, type(e).__name__)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        stage_latency.observe(elapsed, name)
+        _current_span.reset(token)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("span %s seconds=%.3f %s", name, elapsed, attrs)
+
+@contextmanager
+def site(name: str):
+    """
+    Labels LLM calls made inside with `name` without timing a stage.
+    Generators use it around each await, never across a yield.
+    """
+    token = _current_span.set(name)
+    try:
+        yield
+    finally:
+        _current_span.reset(token)
+
+async def traced(name: str, coro, **attrs):
+    """
+    Awaits `coro` inside a span (for tasks spawned with ensure_future).
+    """
+    with span(name, **attrs):
+        return await coro
+
+def record_stage(name: str, seconds: float):
+    stage_latency.observe(seconds, name)
+
+# Helper: token usage off LangChain / Perplexity style responses
+def _usage(resp):
+    usage = getattr(resp, "usage_metadata", None) or {}
+    return usage.get("input_tokens"), usage.get("output_tokens")
+
+class InstrumentedLLM:
+    """
+    Records latency, outcome and token usage of every provider attempt.
+    Successful invoke/ainvoke latencies also feed the hedge delays; this
+    layer sits below the rate limiter, so they exclude queue time.
+    """
+
+    def __init__(self, client, provider: str, model):
+        self.client = client
+        self.provider = provider
+        self.model = str(model or "")
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def _record(self, start: float, resp=None, outcome: str = "ok") -> float:
+        elapsed = time.perf_counter() - start
+        site = current_site()
+        llm_latency.observe(elapsed, self.provider, self.model, site)
+        llm_requests.inc(self.provider, self.model, site, outcome)
+
+        if resp is not None:
+            prompt_tokens, completion_tokens = _usage(resp)
+            if prompt_tokens:
+                llm_tokens.inc(self.provider, self.model, site, "prompt", amount=prompt_tokens)
+            if completion_tokens:
+                llm_tokens.inc(self.provider, self.model, site, "completion", amount=completion_tokens)
+        return elapsed
+
+    def invoke(self, prompt, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            resp = self.client.invoke(prompt, *args, **kwargs)
+        except Exception:
+            self._record(start, outcome="error")
+            raise
+        latencies.record(self.provider, self._record(start, resp))
+        return resp
+
+    async def ainvoke(self, prompt, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            resp = await self.client.ainvoke(prompt, *args, **kwargs)
+        except asyncio.CancelledError:
+            # hedge losers / disconnected clients
+            self._record(start, outcome="cancelled")
+            raise
+        except Exception:
+            self._record(start, outcome="error")
+            raise
+        latencies.record(self.provider, self._record(start, resp))
+        return resp
+
+    async def astream(self, prompt, *args, **kwargs):
+        start = time.perf_counter()
+        first = True
+        usage = None
+        outcome = "cancelled"  # consumer stopped early unless we get to the end
+        try:
+            async for chunk in self.client.astream(prompt, *args, **kwargs):
+                if first:
+                    llm_first_token.observe(time.perf_counter() - start, self.provider, self.model, current_site())
+                    first = False
+                if getattr(chunk, "usage_metadata", None):
+                    usage = chunk
+                yield chunk
+            outcome = "ok"
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            self._record(start, usage, outcome)
+
+# Process
+def process_rss_mb() -> float:
+    """
+    Current resident set size (peak RSS where /proc is unavailable).
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return round(pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024), 1)
+    except (OSError, ValueError, IndexError):
+        import resource
+        import sys
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 1)
+
+@registry.collector
+def _process_metrics():
+    return [
+        ("process_resident_memory_megabytes", "gauge", "Worker RSS", [({"pid": os.getpid()}, process_rss_mb())]),
+    ]
+
+def render_metrics() -> str:
+    return registry.render()
@@ -0,0 +1,138 @@
+# llm/token_budget.py
+"""
+Token-aware corpus budgeting for scoring prompts.
+Fits the most relevant passages of a corpus into a token budget instead
+of cutting it at a fixed character offset.
+"""
+
+import os
+import re
+import time
+from functools import lru_cache
+from typing import List, Tuple
+
+DEFAULT_BUDGET = int(os.getenv("SCORING_TOKEN_BUDGET", "3000"))
+
+# a failed tiktoken load is retried after this long (not pinned for good)
+TOKENIZER_RETRY_SECONDS = float(os.getenv("TOKENIZER_RETRY_SECONDS", "60"))
+
+# tiktoken encodings per provider (override with TOKENIZER_<PROVIDER>).
+# Gemini / Perplexity have no public BPE; cl100k is a close-enough proxy.
+DEFAULT_ENCODINGS = {
+    "openai": "cl100k_base",
+    "gemini": "cl100k_base",
+    "perplexity": "cl100k_base",
+}
+
+class _CharEstimator:
+    """
+    Fallback when tiktoken (or its BPE files) is unavailable: ~4 chars/token.
+    """
+
+    def encode(self, text: str) -> list:
+        return [0] * ((len(text) + 3) // 4)
+
+_char_estimator = _CharEstimator()
+_failed_at = {}
+
+@lru_cache(maxsize=None)
+def _encoding(name: str):
+    # only successes are cached; lru_cache never stores an exception
+    import tiktoken
+    return tiktoken.get_encoding(name)
+
+def get_tokenizer(provider: str = "openai"):
+    provider = (provider or "openai").lower()
+    name = os.getenv(f"TOKENIZER_{provider.upper()}", DEFAULT_ENCODINGS.get(provider, "cl100k_base"))
+
+    if time.monotonic() - _failed_at.get(name, float("-inf")) < TOKENIZER_RETRY_SECONDS:
+        return _char_estimator
+    try:
+        return _encoding(name)
+    except Exception:
+        _failed_at[name] = time.monotonic()
+        return _char_estimator
+
+def count_tokens(text: str, provider: str = "openai") -> int:
+    return len(get_tokenizer(provider).encode(text))
+
+# Helper: split corpus into passages (paragraphs, then sentences if huge)
+def split_passages(corpus: str, max_chars: int = 1200) -> List[str]:
+    passages = []
+    for block in re.split(r"\n\s*\n|\n(?=Answer \d+:)", corpus):
+        block = block.strip()
+        if not block:
+            continue
+
+        if len(block) <= max_chars:
+            passages.append(block)
+            continue
+
+        current = ""
+        for sentence in re.split(r"(?<=[.!?])\s+", block):
+            if current and len(current) + len(sentence) > max_chars:
+                passages.append(current)
+                current = ""
+            current = f"{current} {sentence}".strip()
+        if current:
+            passages.append(current)
+
+    return passages
+
+def _relevance(passage: str, phrases: List[str], words: List[str]) -> int:
+    lowered = passage.lower()
+    # exact phrase mentions dominate; loose word hits break ties
+    return 3 * sum(lowered.count(p) for p in phrases) + sum(lowered.count(w) for w in words)
+
+def _trim_to_tokens(text: str, budget: int, tokenizer) -> str:
+    """
+    Longest prefix of `text` that encodes to at most `budget` tokens
+    (binary search, so it holds for any script and either tokenizer).
+    """
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if len(tokenizer.encode(text[:mid])) <= budget:
+            lo = mid
+        else:
+            hi = mid - 1
+    return text[:lo]
+
+def fit_corpus(corpus: str, terms: List[str], provider: str = "openai", budget: int | None = None) -> Tuple[str, int]:
+    """
+    Returns (text, tokens_used).
+    Passages mentioning the terms most are kept first; the kept passages
+    are emitted in their original order so the text still reads naturally.
+    """
+
+    budget = budget or DEFAULT_BUDGET
+    passages = split_passages(corpus or "")
+    if not passages:
+        return "", 0
+
+    phrases = [t.lower() for t in terms if t]
+    words = sorted({w for p in phrases for w in re.findall(r"\w{4,}", p)})
+
+    ranked = sorted(
+        range(len(passages)),
+        key=lambda i: (-_relevance(passages[i], phrases, words), i),
+    )
+
+    tokenizer = get_tokenizer(provider)
+    separator = len(tokenizer.encode("\n\n"))
+    kept = []
+    used = 0
+
+    for i in ranked:
+        cost = len(tokenizer.encode(passages[i])) + (separator if kept else 0)
+        if used + cost > budget:
+            continue
+        kept.append(i)
+        used += cost
+
+    if not kept:
+        # budget smaller than any passage: trim the best one by tokens
+        text = _trim_to_tokens(passages[ranked[0]], budget, tokenizer)
+        return text, len(tokenizer.encode(text))
+
+    return "\n\n".join(passages[i] for i in sorted(kept)), used
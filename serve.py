@@ -0,0 +1,196 @@
+"""
+Production server (run.py stays the single-process dev server with reload).
+
+  python serve.py --workers 4
+  python serve.py --workers 4 --preload --preload-providers openai
+  python serve.py --measure-startup
+
+--preload imports the app (and optionally provider SDKs) once in the
+parent, then forks workers that share its warm memory (POSIX only).
+Without it, uvicorn spawns workers that each import the app.
+Each worker logs its boot time and RSS when it is ready; /metrics
+exposes process_resident_memory_megabytes per worker.
+
+With more than one worker:
+  - report jobs need a store every worker sees: JOB_STORE defaults to
+    sqlite, and JOB_STORE=memory is refused. Workers claim jobs through
+    the store, so each job runs in one process and any worker can serve
+    GET / DELETE /jobs/{id}.
+  - provider budgets (LLM_CONCURRENCY_*, LLM_RPM_*, LLM_TPM_*) are for the
+    whole server; each worker enforces its 1/workers share.
+"""
+
+import argparse
+import copy
+import importlib.util
+import json
+import logging
+import logging.config
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import uvicorn
+from uvicorn.config import LOGGING_CONFIG
+
+logger = logging.getLogger("serve")
+
+# uvicorn's handlers, plus the root logger so app loggers reach stdout
+LOG_CONFIG = copy.deepcopy(LOGGING_CONFIG)
+LOG_CONFIG["root"] = {"handlers": ["default"], "level": os.getenv("LOG_LEVEL", "INFO").upper()}
+
+def _has(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+def server_options(args) -> dict:
+    return {
+        "loop": "uvloop" if _has("uvloop") else "asyncio",
+        "http": "httptools" if _has("httptools") else "h11",
+        "log_config": LOG_CONFIG,
+        "proxy_headers": True,
+        "timeout_keep_alive": args.keep_alive,
+        "backlog": args.backlog,
+    }
+
+# Spawned workers (uvicorn's supervisor)
+def run_spawned(args):
+    uvicorn.run("api.main:app", host=args.host, port=args.port, workers=args.workers, **server_options(args))
+
+# Pre-forked workers sharing a warm parent
+def _bind(host: str, port: int, backlog: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+def run_preloaded(args):
+    if not hasattr(os, "fork"):
+        sys.exit("--preload needs fork(); use plain --workers on this platform")
+
+    started = time.perf_counter()
+    from api.main import app
+    from llm.llm_factory import preload_provider_sdks
+    sdks = preload_provider_sdks(args.preload_providers.split(",")) if args.preload_providers else []
+    logger.info("preloaded app in %.2fs (sdks: %s)", time.perf_counter() - started, ", ".join(sdks) or "none")
+
+    sock = _bind(args.host, args.port, args.backlog)
+    options = server_options(args)
+    children = set()
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            server = uvicorn.Server(uvicorn.Config(app, **options))
+            server.run(sockets=[sock])
+            os._exit(0)
+        children.add(pid)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _ in range(args.workers):
+        spawn()
+    logger.info("serving on %s:%d with %d pre-forked workers (%s, %s)",
+                args.host, args.port, args.workers, options["loop"], options["http"])
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        children.discard(pid)
+        if not stopping:
+            logger.warning("worker %d exited (status %d); restarting", pid, status)
+            spawn()
+
+    sock.close()
+
+# Cold-start measurement (fresh interpreters)
+_PROBE = """
+import json, time
+t = time.perf_counter()
+import api.main
+app_seconds = time.perf_counter() - t
+from llm.telemetry import process_rss_mb
+rss_app = process_rss_mb()
+from llm.llm_factory import preload_provider_sdks
+t = time.perf_counter()
+preload_provider_sdks(["openai", "gemini"])
+sdk_seconds = time.perf_counter() - t
+print(json.dumps({
+    "app_import_seconds": app_seconds,
+    "rss_after_app_mb": rss_app,
+    "provider_sdk_import_seconds": sdk_seconds,
+    "rss_after_sdks_mb": process_rss_mb(),
+}))
+"""
+
+def measure_startup(runs: int) -> dict:
+    samples = []
+    for _ in range(runs):
+        t = time.perf_counter()
+        out = subprocess.run(
+            [sys.executable, "-c", _PROBE],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True,
+        )
+        sample = json.loads(out.stdout.strip().splitlines()[-1])
+        sample["process_seconds"] = time.perf_counter() - t
+        samples.append(sample)
+
+    return {key: round(statistics.median(s[key] for s in samples), 3) for key in samples[0]}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8080")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1))))
+    parser.add_argument("--preload", action="store_true", help="fork workers from a parent that already imported the app")
+    parser.add_argument("--preload-providers", default=os.getenv("PRELOAD_PROVIDERS", ""),
+                        help="comma separated provider SDKs to import in the parent (with --preload)")
+    parser.add_argument("--keep-alive", type=int, default=5)
+    parser.add_argument("--backlog", type=int, default=2048)
+    parser.add_argument("--measure-startup", action="store_true", help="report cold-start time and RSS, then exit")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    logging.config.dictConfig(LOG_CONFIG)
+
+    if args.measure_startup:
+        print(json.dumps(measure_startup(args.runs), indent=2))
+        return
+
+    if args.workers > 1:
+        store = os.environ.setdefault("JOB_STORE", "sqlite").lower()
+        if store == "memory":
+            sys.exit("JOB_STORE=memory keeps jobs inside one worker; use JOB_STORE=sqlite with --workers > 1")
+
+    # read by the workers to split provider budgets
+    os.environ["LLM_WORKER_COUNT"] = str(max(1, args.workers))
+    os.environ["SERVER_START_TIME"] = str(time.time())
+
+    if args.preload:
+        run_preloaded(args)
+    else:
+        run_spawned(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+# state/job_store.py
+"""
+Persistence for background report jobs.
+A job is a plain JSON-serializable dict; stores save and load it, and
+arbitrate which process runs it:
+
+  claim          -> atomically take a queued job (or one whose owner's
+                    lease expired) and mark it running
+  renew          -> the owner extends its leases while it works
+  request_cancel -> any process may ask; the owner sees it on its next
+                    renewal (a job nobody has claimed yet is cancelled
+                    on the spot)
+
+Leases and cancel requests live outside the job document, so progress
+saves by the owner never overwrite them.
+"""
+
+import copy
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, Iterable, List, Optional, Set
+
+# statuses a restart should pick back up
+UNFINISHED = ("queued", "running")
+
+class JobStore(ABC):
+    """
+    Backend interface. Swap implementations with JOB_STORE=memory|sqlite.
+    A store missing any method cannot be instantiated.
+    """
+
+    @abstractmethod
+    def save(self, job: Dict, owner: Optional[str] = None) -> bool:
+        """
+        Writes the job if `owner` holds it (None: only if nobody does).
+        Returns False when another process owns it now.
+        """
+
+    @abstractmethod
+    def get(self, job_id: str) -> Optional[Dict]:
+        ...
+
+    @abstractmethod
+    def list(self, statuses: tuple | None = None) -> List[Dict]:
+        ...
+
+    @abstractmethod
+    def claim(self, job_id: str, owner: str, lease: float) -> Optional[Dict]:
+        """
+        Returns the job marked "running" if this owner now holds it, else None.
+        """
+
+    @abstractmethod
+    def claimable(self) -> List[str]:
+        """
+        Ids of jobs nobody holds, oldest first.
+        """
+
+    @abstractmethod
+    def renew(self, job_ids: Iterable[str], owner: str, lease: float) -> Set[str]:
+        """
+        Extends the owner's leases; returns the ids it still holds.
+        """
+
+    @abstractmethod
+    def release(self, job_id: str, owner: str) -> None:
+        ...
+
+    @abstractmethod
+    def request_cancel(self, job_id: str) -> Optional[Dict]:
+        ...
+
+    @abstractmethod
+    def cancel_requests(self, job_ids: Iterable[str]) -> Set[str]:
+        ...
+
+    def close(self) -> None:
+        pass
+
+def _claimable(job: Dict, lease_until: Optional[float], now: float) -> bool:
+    if job["status"] == "queued":
+        return True
+    # running, but its owner stopped renewing (crash / shutdown)
+    return job["status"] == "running" and (lease_until or 0) < now
+
+class MemoryJobStore(JobStore):
+    def __init__(self):
+        self._jobs = {}
+        self._leases = {}  # job_id -> (owner, lease_until)
+        self._cancels = set()
+        self._lock = threading.Lock()
+
+    def claim(self, job_id: str, owner: str, lease: float) -> Optional[Dict]:
+        now = time.time()
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or not _claimable(job, self._leases.get(job_id, (None, 0))[1], now):
+                return None
+            job["status"] = "running"
+            self._leases[job_id] = (owner, now + lease)
+            return copy.deepcopy(job)
+
+    def claimable(self) -> List[str]:
+        now = time.time()
+        with self._lock:
+            jobs = [j for j in self._jobs.values() if _claimable(j, self._leases.get(j["id"], (None, 0))[1], now)]
+        return [j["id"] for j in sorted(jobs, key=lambda j: j["created_at"])]
+
+    def renew(self, job_ids: Iterable[str], owner: str, lease: float) -> Set[str]:
+        until = time.time() + lease
+        held = set()
+        with self._lock:
+            for job_id in job_ids:
+                if self._leases.get(job_id, (None,))[0] == owner:
+                    self._leases[job_id] = (owner, until)
+                    held.add(job_id)
+        return held
+
+    def release(self, job_id: str, owner: str) -> None:
+        with self._lock:
+            if self._leases.get(job_id, (None,))[0] == owner:
+                del self._leases[job_id]
+            self._cancels.discard(job_id)
+
+    def request_cancel(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job["status"] == "queued":
+                job["status"] = "cancelled"
+                job["updated_at"] = time.time()
+            elif job["status"] == "running":
+                self._cancels.add(job_id)
+            return copy.deepcopy(job)
+
+    def cancel_requests(self, job_ids: Iterable[str]) -> Set[str]:
+        with self._lock:
+            return self._cancels.intersection(job_ids)
+
+    def save(self, job: Dict, owner: Optional[str] = None) -> bool:
+        with self._lock:
+            if job["id"] in self._jobs and self._leases.get(job["id"], (None,))[0] != owner:
+                return False
+            self._jobs[job["id"]] = copy.deepcopy(job)
+            return True
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return copy.deepcopy(job) if job else None
+
+    def list(self, statuses: tuple | None = None) -> List[Dict]:
+        with self._lock:
+            jobs = [copy.deepcopy(j) for j in self._jobs.values()]
+        if statuses:
+            jobs = [j for j in jobs if j["status"] in statuses]
+        return sorted(jobs, key=lambda j: j["created_at"])
+
+class SQLiteJobStore(JobStore):
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+
+    # opened on first use so a preloaded parent never forks a live connection
+    def _connect(self):
+        if self._conn is None:
+            folder = os.path.dirname(self.path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+
+            # autocommit; claims open their own IMMEDIATE transaction
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # every server worker opens the store at boot: migrate under the write lock
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS jobs ("
+                    "id TEXT PRIMARY KEY, status TEXT, created_at REAL, "
+                    "updated_at REAL, data TEXT)"
+                )
+                columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+                for column, kind in (("owner", "TEXT"), ("lease_until", "REAL"), ("cancel_requested", "INTEGER DEFAULT 0")):
+                    if column not in columns:
+                        conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            self._conn = conn
+        return self._conn
+
+    def save(self, job: Dict, owner: Optional[str] = None) -> bool:
+        # "owner IS ?" also matches NULL = NULL
+        with self._lock:
+            cursor = self._connect().execute(
+                "INSERT INTO jobs (id, status, created_at, updated_at, data) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET status = excluded.status, "
+                "updated_at = excluded.updated_at, data = excluded.data WHERE jobs.owner IS ?",
+                (job["id"], job["status"], job["created_at"], job["updated_at"], json.dumps(job), owner),
+            )
+            return cursor.rowcount > 0
+
+    def _transaction(self, fn):
+        # BEGIN IMMEDIATE takes the write lock up front: one claimer wins
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(conn)
+                conn.execute("COMMIT")
+                return result
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def claim(self, job_id: str, owner: str, lease: float) -> Optional[Dict]:
+        def take(conn):
+            now = time.time()
+            row = conn.execute("SELECT data, lease_until FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            job = json.loads(row[0])
+            if not _claimable(job, row[1], now):
+                return None
+            job["status"] = "running"
+            conn.execute(
+                "UPDATE jobs SET status = ?, data = ?, owner = ?, lease_until = ? WHERE id = ?",
+                ("running", json.dumps(job), owner, now + lease, job_id),
+            )
+            return job
+
+        return self._transaction(take)
+
+    def claimable(self) -> List[str]:
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT id FROM jobs WHERE status = 'queued' "
+                "OR (status = 'running' AND COALESCE(lease_until, 0) < ?) ORDER BY created_at",
+                (time.time(),),
+            ).fetchall()
+        return [r[0] for r in rows]
+
+    def renew(self, job_ids: Iterable[str], owner: str, lease: float) -> Set[str]:
+        job_ids = list(job_ids)
+        if not job_ids:
+            return set()
+        until = time.time() + lease
+        with self._lock:
+            conn = self._connect()
+            conn.executemany(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND owner = ?",
+                [(until, job_id, owner) for job_id in job_ids],
+            )
+            rows = conn.execute(
+                f"SELECT id FROM jobs WHERE owner = ? AND id IN ({','.join('?' for _ in job_ids)})",
+                [owner, *job_ids],
+            ).fetchall()
+        return {r[0] for r in rows}
+
+    def release(self, job_id: str, owner: str) -> None:
+        with self._lock:
+            self._connect().execute(
+                "UPDATE jobs SET owner = NULL, lease_until = NULL, cancel_requested = 0 WHERE id = ? AND owner = ?",
+                (job_id, owner),
+            )
+
+    def request_cancel(self, job_id: str) -> Optional[Dict]:
+        def cancel(conn):
+            row = conn.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            job = json.loads(row[0])
+            if job["status"] == "queued":
+                job["status"] = "cancelled"
+                job["updated_at"] = time.time()
+                conn.execute(
+                    "UPDATE jobs SET status = ?, updated_at = ?, data = ? WHERE id = ?",
+                    (job["status"], job["updated_at"], json.dumps(job), job_id),
+                )
+            elif job["status"] == "running":
+                conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ?", (job_id,))
+            return job
+
+        return self._transaction(cancel)
+
+    def cancel_requests(self, job_ids: Iterable[str]) -> Set[str]:
+        job_ids = list(job_ids)
+        if not job_ids:
+            return set()
+        with self._lock:
+            rows = self._connect().execute(
+                f"SELECT id FROM jobs WHERE cancel_requested = 1 AND id IN ({','.join('?' for _ in job_ids)})",
+                job_ids,
+            ).fetchall()
+        return {r[0] for r in rows}
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._connect().execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def list(self, statuses: tuple | None = None) -> List[Dict]:
+        query = "SELECT data FROM jobs"
+        args = ()
+        if statuses:
+            query += f" WHERE status IN ({','.join('?' for _ in statuses)})"
+            args = tuple(statuses)
+        query += " ORDER BY created_at"
+
+        with self._lock:
+            rows = self._connect().execute(query, args).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+def get_job_store() -> JobStore:
+    backend = os.getenv("JOB_STORE", "memory").lower()
+
+    if backend == "memory":
+        return MemoryJobStore()
+
+    if backend == "sqlite":
+        return SQLiteJobStore(os.getenv("JOB_STORE_PATH", ".cache/jobs.sqlite3"))
+
+    raise ValueError(f"Unsupported job store: {backend}")
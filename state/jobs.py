@@ -0,0 +1,265 @@
+# state/jobs.py
+"""
+Background report jobs.
+Per-run state that survives restarts (it replaced the global "active
+model" registry): finished answers are persisted as they arrive, so a
+resumed job only asks for what is still missing.
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import Dict, Optional
+from analysis.report import astream_report, group_prompts
+from llm.cache import cache_mode
+from state.job_store import JobStore, get_job_store
+
+logger = logging.getLogger(__name__)
+
+FINISHED = ("completed", "failed", "cancelled")
+
+# a job whose owner stops renewing for this long is picked up elsewhere
+LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "30"))
+
+# answers are flushed at most this often; every other event saves at once
+SAVE_INTERVAL = float(os.getenv("JOB_SAVE_INTERVAL", "1.0"))
+
+def _new_job(payload: Dict, cache: str) -> Dict:
+    prompts_by_model = group_prompts(payload)
+    models = list(dict.fromkeys(payload.get("models", [])))
+    now = time.time()
+
+    return {
+        "id": uuid.uuid4().hex,
+        "status": "queued",
+        "created_at": now,
+        "updated_at": now,
+        "payload": payload,
+        "cache": cache,
+        "progress": {
+            "answers_done": 0,
+            "answers_total": sum(len(prompts_by_model.get(m, [])) for m in models),
+            "evaluations_done": 0,
+            "evaluations_total": len(models) + 1,
+        },
+        # {model: {prompt_index: answer}} — str keys so it round-trips through JSON
+        "answers": {m: {} for m in models},
+        "errors": [],
+        "per_model": {},
+        "combined": None,
+        "report": None,
+        "error": None,
+    }
+
+class _LeaseLost(Exception):
+    pass
+
+class ReportJobManager:
+    """
+    Runs report jobs on a fixed pool of asyncio workers.
+
+    Several managers (one per server worker process) may share a store:
+    a worker claims a job before running it and holds a lease while it
+    runs, so each job runs in exactly one process. A heartbeat renews the
+    leases, picks up jobs that are queued or whose owner died, and applies
+    cancel requests made through any process.
+    """
+
+    def __init__(self, store: JobStore, workers: int = 2, lease: float = LEASE_SECONDS):
+        self.store = store
+        self.workers = workers
+        self.lease = lease
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._queue: Optional[asyncio.Queue] = None
+        self._queued = set()
+        self._workers = []
+        self._heartbeat: Optional[asyncio.Task] = None
+        self._running: Dict[str, asyncio.Task] = {}
+        self._cancelling = set()
+        self._lost = set()
+
+    async def _save(self, job: Dict, owner: Optional[str] = None) -> bool:
+        job["updated_at"] = time.time()
+        return await asyncio.to_thread(self.store.save, job, owner)
+
+    async def _persist(self, job: Dict):
+        # saves from a run must come from the lease holder
+        if not await self._save(job, self.owner):
+            raise _LeaseLost(job["id"])
+
+    def _enqueue(self, job_id: str):
+        if job_id not in self._queued and job_id not in self._running:
+            self._queued.add(job_id)
+            self._queue.put_nowait(job_id)
+
+    async def start(self):
+        """
+        Spawns the worker pool and the heartbeat; the first beat picks up
+        anything a restart interrupted.
+        """
+        self._queue = asyncio.Queue()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._heartbeat = asyncio.create_task(self._beat())
+
+    async def stop(self):
+        tasks = list(self._running.values())
+        for task in tasks + self._workers + [self._heartbeat]:
+            if task is not None:
+                task.cancel()
+        await asyncio.gather(*tasks, *self._workers, return_exceptions=True)
+        self._workers = []
+        self.store.close()
+
+    async def _beat(self):
+        while True:
+            try:
+                await self._tick()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("job heartbeat failed")
+            await asyncio.sleep(self.lease / 3)
+
+    async def _tick(self):
+        running = list(self._running)
+        held = await asyncio.to_thread(self.store.renew, running, self.owner, self.lease)
+        cancels = await asyncio.to_thread(self.store.cancel_requests, running)
+
+        for job_id in running:
+            task = self._running.get(job_id)
+            if task is None:
+                continue
+            if job_id in cancels:
+                self._cancelling.add(job_id)
+                task.cancel()
+            elif job_id not in held:
+                # lease lost (we stalled past it): someone else runs it now
+                logger.warning("lost lease on job %s", job_id)
+                self._lost.add(job_id)
+                task.cancel()
+
+        for job_id in await asyncio.to_thread(self.store.claimable):
+            self._enqueue(job_id)
+
+    async def submit(self, payload: Dict, cache: str = "use") -> Dict:
+        job = _new_job(payload, cache)
+        await self._save(job)
+        self._enqueue(job["id"])
+        return job
+
+    async def get(self, job_id: str) -> Optional[Dict]:
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    async def cancel(self, job_id: str) -> Optional[Dict]:
+        job = await self.get(job_id)
+        if job is None or job["status"] in FINISHED:
+            return job
+
+        task = self._running.get(job_id)
+        if task is not None:
+            self._cancelling.add(job_id)
+            task.cancel()
+            await asyncio.wait([task])
+            return await self.get(job_id)
+
+        # queued jobs are cancelled on the spot; a job running in another
+        # process is flagged and stopped by its owner's next heartbeat
+        job = await asyncio.to_thread(self.store.request_cancel, job_id)
+        deadline = time.monotonic() + self.lease
+        while job is not None and job["status"] not in FINISHED and time.monotonic() < deadline:
+            await asyncio.sleep(0.25)
+            job = await self.get(job_id)
+        return job
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                self._queued.discard(job_id)
+                job = await asyncio.to_thread(self.store.claim, job_id, self.owner, self.lease)
+                if job is None:
+                    continue
+
+                task = asyncio.create_task(self._run(job))
+                self._running[job_id] = task
+                await asyncio.wait([task])
+            finally:
+                if job_id in self._running:
+                    self._running.pop(job_id)
+                    await asyncio.shield(asyncio.to_thread(self.store.release, job_id, self.owner))
+                self._cancelling.discard(job_id)
+                self._lost.discard(job_id)
+                self._queue.task_done()
+
+    async def _run(self, job: Dict):
+        # a resumed job keeps finished answers; failed prompts and
+        # evaluations are redone
+        progress = job["progress"]
+        progress["answers_done"] = sum(len(a) for a in job["answers"].values())
+        progress["evaluations_done"] = 0
+        job.update(status="running", errors=[], per_model={}, combined=None)
+        saved = time.monotonic()
+        unsaved = False
+
+        try:
+            await self._persist(job)
+            with cache_mode(job.get("cache")):
+                events = astream_report(job["payload"], completed=job["answers"])
+
+                async for event in events:
+                    kind = event["event"]
+
+                    if kind == "answer":
+                        job["answers"][event["model"]][str(event["prompt_index"])] = event["answer"]
+                        progress["answers_done"] += 1
+                    elif kind == "answer_error":
+                        job["errors"].append({k: v for k, v in event.items() if k != "event"})
+                        progress["answers_done"] += 1
+                    elif kind == "per_model":
+                        job["per_model"][event["model"]] = event["result"]
+                        progress["evaluations_done"] += 1
+                    elif kind == "combined":
+                        job["combined"] = event["result"]
+                        progress["evaluations_done"] += 1
+                    elif kind == "report":
+                        job["report"] = event["report"]
+                        job["status"] = "completed"
+
+                    # the job document grows with every answer; batch them
+                    if kind in ("answer", "answer_error") and time.monotonic() - saved < SAVE_INTERVAL:
+                        unsaved = True
+                        continue
+
+                    await self._persist(job)
+                    saved = time.monotonic()
+                    unsaved = False
+
+            if unsaved:
+                await self._persist(job)
+
+        except asyncio.CancelledError:
+            # user cancel is final; a shutdown leaves the job resumable
+            # (with its answers flushed); a lost lease saves nothing
+            if job["id"] in self._cancelling:
+                job["status"] = "cancelled"
+                await self._save(job, self.owner)
+            elif unsaved and job["id"] not in self._lost:
+                await self._save(job, self.owner)
+            raise
+        except _LeaseLost:
+            # another process re-claimed it while we stalled; its copy wins
+            logger.warning("job %s was re-claimed elsewhere; stopping", job["id"])
+            self._lost.add(job["id"])
+        except Exception as e:
+            job["status"] = "failed"
+            job["error"] = str(e)
+            await self._save(job, self.owner)
+
+def get_job_manager() -> ReportJobManager:
+    return ReportJobManager(
+        store=get_job_store(),
+        workers=int(os.getenv("REPORT_JOB_WORKERS", "2")),
+    )